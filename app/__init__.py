@@ -1,18 +1,28 @@
-from flask import Flask, make_response, jsonify, redirect
+from flask import Flask, make_response, redirect
 from flask_cors import CORS
 
+from app.compression import Compress
+from app.encoding import JSONEncoder, jsonify
+from app.metrics import Metrics, service_gauges
 from settings.settings import app_config
 
 app = Flask(__name__)
+app.json_encoder = JSONEncoder
 
 CORS(app)
+Compress(app)
+metrics = Metrics(app)
 
 app.config.from_object(app_config['development'])
 
 from app.auth.views import auth
 from app.bucketlists.views import bucketlist
 from app.callback.views import callback
+from app.health.views import health
 from app.search.views import search
+from app.stats.views import stats
+from app.transfer.views import transfer
+from app.models import Category
 
 
 @app.errorhandler(404)
@@ -34,7 +44,13 @@ def method_not_allowed(error):
 def index():
     return redirect("https://app.swaggerhub.com/apis/ridgekimani/bucket_list/1.0.0")
 
+app.before_first_request(Category.warm_cache)
+metrics.register(*service_gauges())
+
 app.register_blueprint(auth)
 app.register_blueprint(bucketlist)
 app.register_blueprint(callback)
+app.register_blueprint(health)
 app.register_blueprint(search)
+app.register_blueprint(stats)
+app.register_blueprint(transfer)
@@ -1,10 +1,12 @@
 import uuid
 
+from app.encoding import jsonify
+
 from app.models import User
 
-from app.utils import validate_email, send_mail, login_required
+from app.utils import validate_email, send_mail, login_required, forget_principal
 
-from flask import Blueprint, request, jsonify, make_response, session
+from flask import Blueprint, request, make_response, session
 
 from flask.views import MethodView
 
@@ -93,6 +95,10 @@ class LoginApi(MethodView):
         if not user.check_password(password):
             return make_response(jsonify(dict(error='Incorrect password!')), 403)
 
+        if user.needs_rehash():
+            user.password = password
+            user.save()
+
         token = user.generate_token()
         session['user'] = user.email
         response = make_response(jsonify(dict(success='Authenticated successfully',
@@ -104,6 +110,7 @@ class LoginApi(MethodView):
 class LogoutApi(MethodView):
 
     def post(self):
+        forget_principal(token=request.headers.get('token'), email=session.get('user'))
         session.pop('user', None)
         response = make_response(jsonify(dict(success='Logout successful')))
         response.headers['token'] = None
@@ -144,6 +151,7 @@ class ResetPassword(MethodView):
                                                     'it again')), 500)
         user.password = password
         user.save()
+        forget_principal(user_id=user.id)
 
         return make_response(jsonify(dict(success='An email has been sent with instructions for '
                                                   'your new password')), 201)
@@ -194,6 +202,7 @@ class ChangePassword(MethodView):
 
         user.password = new_password
         user.save()
+        forget_principal(user_id=user.id)
         return make_response(jsonify(dict(success='Password changed successfully')), 200)
 
 
@@ -224,7 +233,9 @@ class DeleteAccount(MethodView):
         if not user.check_password(password):
             return make_response(jsonify(dict(error='Incorrect password')), 403)
 
+        user_id = user.id
         User.delete(email)
+        forget_principal(user_id=user_id)
         return make_response(jsonify(dict(success="Account deleted successfully")), 200)
 
 
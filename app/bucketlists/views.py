@@ -1,15 +1,27 @@
-from app.models import Bucket, Activity, User, Category
+from app.encoding import jsonify
 
-from app.utils import login_required, validate_text
+from app.models import Bucket, Activity, Category
+
+from app.utils import login_required, conditional, validate_text, paginate, paginate_after, \
+    stream_json, parse_fields, page_url
 
 from datetime import datetime
 
-from flask import Blueprint, session, make_response, jsonify, request
+from flask import Blueprint, g, make_response, request, current_app
 from flask.views import MethodView
 
 bucketlist = Blueprint('bucketlists', __name__, url_prefix='/api/v1/bucketlists')
 
 
+def conflict_or_bad_request(results):
+    """
+    Used to get the status of a bulk create where nothing was created
+    :param results: results of every entry
+    :return: 409 when every entry is a conflict, 400 otherwise
+    """
+    return 409 if results and all(result['status'] == 409 for result in results) else 400
+
+
 class BucketListsApi(MethodView):
     """
     This class is used to handle the bucket list operations that will be done by a user
@@ -17,6 +29,7 @@ class BucketListsApi(MethodView):
     """
 
     @login_required
+    @conditional(Bucket.fingerprint)
     def get(self, bucket_id=None):
         """
         Used to get the buckets that have been added
@@ -25,21 +38,45 @@ class BucketListsApi(MethodView):
         """
         limit = request.args.get('limit', None)
         page = request.args.get("page", 1)
+        cursor = request.args.get('cursor')
+
+        user = g.principal
+
+        try:
+            fields = parse_fields(Bucket)
 
-        email = session.get('user')
-        user = User.query.filter_by(email=email).first()
+        except ValueError:
+            return make_response(jsonify(error='Please enter valid fields'), 400)
+
+        query = Bucket.query.filter_by(user_id=user.id).options(Bucket.load_fields(fields))
 
         if bucket_id:
 
             if not Bucket.exists(bucket_id, user.id):
                 return make_response(jsonify({"error": "Bucket not found"}), 404)
 
-            bucket = Bucket.query.filter_by(user=user, id=bucket_id).first()
-            return make_response(jsonify(bucket=bucket.serialize), 200)
+            bucket = query.filter_by(id=bucket_id).first()
+            return make_response(jsonify(bucket=Bucket.serialize_many([bucket], fields)[0]), 200)
+
+        if cursor is not None:
+            try:
+                limit = int(limit or current_app.config['DEFAULT_PAGE_LIMIT'])
+                buckets, next_cursor = paginate_after(query, Bucket.id, cursor, limit)
+
+            except ValueError:
+                return make_response(jsonify(error='Please enter a valid cursor or limit'), 400)
+
+            next_page = ''
+            if next_cursor:
+                next_page = page_url('cursor', next_cursor, limit)
+
+            return make_response(jsonify(buckets=Bucket.serialize_many(buckets, fields),
+                                         next_cursor=next_cursor, next_page=next_page,
+                                         total=Bucket.total(user.id)))
 
         if not all([limit, page]):
-            buckets = Bucket.query.filter_by(user=user).all()
-            return make_response(jsonify(buckets=[bucket_.serialize for bucket_ in buckets]), 200)
+            return stream_json('buckets', query.order_by(Bucket.id),
+                               lambda buckets: Bucket.serialize_many(buckets, fields))
 
         try:
             limit = int(limit)
@@ -48,28 +85,33 @@ class BucketListsApi(MethodView):
         except ValueError:
             return make_response(jsonify(error='Please enter valid page or limit numbers'), 400)
 
-        page_buckets = Bucket.query.filter_by(user=user).paginate(page, limit, error_out=False)
+        page_buckets = paginate(query.order_by(Bucket.id), page, limit, Bucket.total(user.id))
         next_page = ''
         previous_page = ''
         if page_buckets.has_next:
-            next_page = request.base_url + '?page=' + str(page+1) + '&limit=' + str(limit)
+            next_page = page_url('page', page + 1, limit)
 
         if page_buckets.has_prev:
-            previous_page = request.base_url + '?page=' + str(page-1) + '&limit=' + str(limit)
+            previous_page = page_url('page', page - 1, limit)
 
-        return make_response(jsonify(buckets=[bucket.serialize for bucket in page_buckets.items],
-                                     next_page=next_page, previous_page=previous_page))
+        return make_response(jsonify(buckets=Bucket.serialize_many(page_buckets.items, fields),
+                                     next_page=next_page, previous_page=previous_page,
+                                     total=page_buckets.total))
 
     @login_required
-    def post(self):
+    def post(self, bulk=False):
         """
         Used to add a user's bucket
+        :param bulk: whether a list of buckets is being created
         :return: serialized bucket
         """
 
         if not request.get_json():
             return make_response(jsonify(dict(error='Bad request. Please enter some data')), 400)
 
+        if bulk:
+            return self.post_many(g.principal)
+
         data = request.get_json()
         bucket_name = data.get('bucket_name')
         category = data.get('category', 'General')
@@ -78,8 +120,6 @@ class BucketListsApi(MethodView):
         if not bucket_name:
             return make_response(jsonify(dict(error='Please enter the bucket name')), 400)
 
-        category = Category.exists(category)
-
         if not description:
             return make_response(jsonify(dict(error='Please describe your bucket')), 400)
 
@@ -89,17 +129,91 @@ class BucketListsApi(MethodView):
         if not validate_text(description):
             return make_response(jsonify(dict(error="Please enter a valid description")), 400)
 
-        email = session.get('user')
-        user = User.query.filter_by(email=email).first()
+        user = g.principal
 
         if Bucket.test_duplicate(bucket_name, user.id):
             return make_response(jsonify(error='Bucket name exists. Add activities from it'), 409)
 
-        data = dict(bucket_name=bucket_name, user_id=user.id, category_id=category.id,
-                    description=description)
+        data = dict(bucket_name=bucket_name, user_id=user.id,
+                    category_id=Category.get_id(category), description=description)
         bucket = Bucket(**data).save()
         return make_response(jsonify(bucket=bucket.serialize), 201)
 
+    @staticmethod
+    def post_many(user):
+        """
+        Used to add a list of buckets in a single transaction.
+        Every bucket is validated first, categories are resolved together, name collisions
+        are looked up with one query and the valid buckets are inserted with one statement
+        :param user:
+        :return: status and serialized bucket or error of every bucket, in the order received
+        """
+        data = request.get_json()
+
+        if not isinstance(data, list):
+            return make_response(jsonify(dict(error='Please send a list of buckets')), 400)
+
+        if len(data) > current_app.config['BULK_MAX_ITEMS']:
+            return make_response(jsonify(dict(error='Please send at most %s buckets' %
+                                                    current_app.config['BULK_MAX_ITEMS'])), 400)
+
+        results = []
+        buckets = []
+        bucket_names = set()
+        for entry in data:
+            entry = entry if isinstance(entry, dict) else {}
+            bucket_name = entry.get('bucket_name')
+            description = entry.get('description')
+            category = entry.get('category') or 'General'
+
+            if not bucket_name:
+                results.append(dict(status=400, error='Please enter the bucket name'))
+
+            elif not description:
+                results.append(dict(status=400, error='Please describe your bucket'))
+
+            elif not isinstance(bucket_name, str) or not validate_text(bucket_name) or \
+                    len(bucket_name) > 70:
+                results.append(dict(status=400, error='Please enter a valid bucket name'))
+
+            elif not isinstance(description, str) or not validate_text(description) or \
+                    len(description) > 100:
+                results.append(dict(status=400, error='Please enter a valid description'))
+
+            elif not isinstance(category, str) or not validate_text(category) or \
+                    len(category) > 70:
+                results.append(dict(status=400, error='Please enter a valid category'))
+
+            elif bucket_name in bucket_names:
+                results.append(dict(status=409, error='Bucket name exists. Add activities from it'))
+
+            else:
+                results.append(dict(status=201, bucket_name=bucket_name))
+                bucket_names.add(bucket_name)
+                buckets.append((bucket_name, description, category))
+
+        existing = Bucket.find_duplicates(user.id, bucket_names)
+        buckets = [bucket for bucket in buckets if bucket[0] not in existing]
+        category_ids = Category.get_ids([category for _, _, category in buckets])
+
+        created = Bucket.bulk_create(user.id, [
+            dict(bucket_name=bucket_name, description=description,
+                 category_id=category_ids[category])
+            for bucket_name, description, category in buckets])
+        serialized = dict((bucket['bucket_name'], bucket)
+                          for bucket in Bucket.serialize_many(created.values()))
+
+        for result in results:
+            bucket_name = result.pop('bucket_name', None)
+            if bucket_name in existing:
+                result.update(status=409, error='Bucket name exists. Add activities from it')
+
+            elif bucket_name:
+                result['bucket'] = serialized[bucket_name]
+
+        status = 201 if created else conflict_or_bad_request(results)
+        return make_response(jsonify(dict(buckets=results, created=len(created))), status)
+
     @login_required
     def put(self, bucket_id=None):
         """
@@ -124,8 +238,7 @@ class BucketListsApi(MethodView):
         if not validate_text(bucket_name):
             return make_response(jsonify(dict(error="Please enter a valid bucket name")), 400)
 
-        email = session.get('user')
-        user = User.query.filter_by(email=email).first()
+        user = g.principal
         bucket = Bucket.query.filter_by(id=bucket_id, user_id=user.id).first()
 
         if bucket.bucket_name != bucket_name:
@@ -139,8 +252,7 @@ class BucketListsApi(MethodView):
         if category:
             if not validate_text(category):
                 return make_response(jsonify(dict(error="Please enter a valid description")), 400)
-            category = Category.exists(category)
-            bucket.category_id = category.id
+            bucket.category_id = Category.get_id(category)
 
         if description:
             if not validate_text(description):
@@ -162,13 +274,11 @@ class BucketListsApi(MethodView):
         if not bucket_id:
             return make_response(jsonify(dict(error='Please specify the bucket id')), 400)
 
-        email = session.get('user')
-        user = User.query.filter_by(email=email).first()
+        user = g.principal
         if Bucket.exists(bucket_id, user.id):
             Bucket.delete(bucket_id, user.id)
-            buckets = Bucket.query.filter_by(user=user).all()
-            return make_response(jsonify(dict(buckets=[bucket_.serialize for bucket_ in buckets])),
-                                 200)
+            buckets = Bucket.query.filter_by(user_id=user.id).all()
+            return make_response(jsonify(dict(buckets=Bucket.serialize_many(buckets))), 200)
 
         return make_response(jsonify(dict(error='Bucket not found!')), 400)
 
@@ -180,6 +290,7 @@ class ItemsApi(MethodView):
     The user must be logged in to consume this endpoints
     """
     @login_required
+    @conditional(Activity.fingerprint)
     def get(self, bucket_id=None, item_id=None):
         """
         Used to get the list of buckets or a single bucket
@@ -188,29 +299,54 @@ class ItemsApi(MethodView):
         :return: serialized bucket or serialized list of buckets
         """
 
-        email = session.get('user')
-        user = User.query.filter_by(email=email).first()
+        user = g.principal
 
         if not bucket_id:
             return make_response(jsonify(error='Please specify your bucket id'), 400)
 
+        try:
+            fields = parse_fields(Activity)
+
+        except ValueError:
+            return make_response(jsonify(error='Please enter valid fields'), 400)
+
+        query = Activity.query.filter_by(bucket_id=bucket_id, user_id=user.id)\
+            .options(Activity.load_fields(fields))
+
         if item_id and bucket_id:
 
             if not Activity.exists(bucket_id, user.id, item_id):
                 return make_response(jsonify({"error": "Bucket or activity not found"}), 404)
 
-            act = Activity.query.filter_by(bucket_id=bucket_id, user=user, id=item_id).first()
-            return make_response(jsonify(activity=act.serialize))
+            act = query.filter_by(id=item_id).first()
+            return make_response(jsonify(activity=Activity.serialize_many([act], fields)[0]))
 
         if not Bucket.exists(bucket_id, user.id):
             return make_response(jsonify({"error": "Bucket not found"}), 404)
 
         limit = request.args.get('limit')
         page = request.args.get('page', 1)
+        cursor = request.args.get('cursor')
+
+        if cursor is not None:
+            try:
+                limit = int(limit or current_app.config['DEFAULT_PAGE_LIMIT'])
+                items, next_cursor = paginate_after(query, Activity.id, cursor, limit)
+
+            except ValueError:
+                return make_response(jsonify(error='Please enter a valid cursor or limit'), 400)
+
+            next_page = ''
+            if next_cursor:
+                next_page = page_url('cursor', next_cursor, limit)
+
+            return make_response(jsonify(activities=Activity.serialize_many(items, fields),
+                                         next_cursor=next_cursor, next_page=next_page,
+                                         total=Activity.total(bucket_id, user.id)))
 
         if not all([limit, page]):
-            items = Activity.query.filter_by(bucket_id=bucket_id, user=user).all()
-            return make_response(jsonify(activities=[item.serialize for item in items]))
+            return stream_json('activities', query.order_by(Activity.id),
+                               lambda activities: Activity.serialize_many(activities, fields))
 
         try:
             limit = int(limit)
@@ -219,31 +355,32 @@ class ItemsApi(MethodView):
         except ValueError:
             return make_response(jsonify(error='Please enter valid page or limit numbers'), 400)
 
-        page_items = Activity.query.filter_by(user=user, bucket_id=bucket_id)\
-            .paginate(page, limit, error_out=False)
+        page_items = paginate(query.order_by(Activity.id), page, limit,
+                              Activity.total(bucket_id, user.id))
         next_page = ''
         previous_page = ''
         if page_items.has_next:
-            next_page = request.base_url + '?page=' + str(page+1) + '&limit=' + str(limit)
+            next_page = page_url('page', page + 1, limit)
 
         if page_items.has_prev:
-            previous_page = request.base_url + '?page=' + str(page-1) + '&limit=' + str(limit)
+            previous_page = page_url('page', page - 1, limit)
 
-        return make_response(jsonify(buckets=[bucket.serialize for bucket in page_items.items],
-                                     next_page=next_page, previous_page=previous_page))
+        return make_response(jsonify(buckets=Activity.serialize_many(page_items.items, fields),
+                                     next_page=next_page, previous_page=previous_page,
+                                     total=page_items.total))
 
     @login_required
-    def post(self, bucket_id=None):
+    def post(self, bucket_id=None, bulk=False):
         """
         Used to create a single iten
         :param bucket_id:
+        :param bulk: whether a list of items is being created
         :return: serialized item
         """
         if not bucket_id:
             return make_response(jsonify(error='Please specify your bucket id'), 400)
 
-        email = session.get('user')
-        user = User.query.filter_by(email=email).first()
+        user = g.principal
 
         if not Bucket.exists(bucket_id, user.id):
             return make_response(jsonify(error='Bucket not found'), 400)
@@ -251,6 +388,9 @@ class ItemsApi(MethodView):
         if not request.get_json():
             return make_response(jsonify(dict(error='Bad request. Please enter some data')), 400)
 
+        if bulk:
+            return self.post_many(bucket_id, user)
+
         data = request.get_json()
         description = data.get('description')
 
@@ -261,11 +401,66 @@ class ItemsApi(MethodView):
             return make_response(jsonify(dict(error="Please enter a valid description")), 400)
 
         if Activity.test_duplicate(bucket_id, user.id, description):
-            return make_response(jsonify(dict(error="Activity exists with the same description!")), 409)
+            return make_response(jsonify(dict(error="Activity exists with the same description!")),
+                                 409)
 
         activity = Activity(description=description, bucket_id=bucket_id, user_id=user.id).save()
         return make_response(jsonify(dict(item=activity.serialize)), 201)
 
+    @staticmethod
+    def post_many(bucket_id, user):
+        """
+        Used to create a list of items in a single transaction.
+        Every item is validated first, duplicates are looked up with one query and the
+        valid items are inserted with one multi-row statement
+        :param bucket_id:
+        :param user:
+        :return: status and serialized item or error of every item, in the order received
+        """
+        data = request.get_json()
+
+        if not isinstance(data, list):
+            return make_response(jsonify(dict(error='Please send a list of activities')), 400)
+
+        if len(data) > current_app.config['BULK_MAX_ITEMS']:
+            return make_response(jsonify(dict(error='Please send at most %s activities' %
+                                                    current_app.config['BULK_MAX_ITEMS'])), 400)
+
+        results = []
+        descriptions = []
+        for entry in data:
+            description = entry.get('description') if isinstance(entry, dict) else None
+
+            if not description:
+                results.append(dict(status=400, error='Please describe your activity'))
+
+            elif not isinstance(description, str) or not validate_text(description):
+                results.append(dict(status=400, error='Please enter a valid description'))
+
+            elif description in descriptions:
+                results.append(dict(status=409, error='Activity exists with the same description!'))
+
+            else:
+                results.append(dict(status=201, description=description))
+                descriptions.append(description)
+
+        existing = Activity.find_duplicates(bucket_id, user.id, descriptions)
+        created = Activity.bulk_create(bucket_id, user.id,
+                                       [value for value in descriptions if value not in existing])
+        serialized = dict((item['description'], item)
+                          for item in Activity.serialize_many(created.values()))
+
+        for result in results:
+            description = result.pop('description', None)
+            if description in existing:
+                result.update(status=409, error='Activity exists with the same description!')
+
+            elif description:
+                result['item'] = serialized[description]
+
+        status = 201 if created else conflict_or_bad_request(results)
+        return make_response(jsonify(dict(items=results, created=len(created))), status)
+
     @login_required
     def put(self, bucket_id=None, item_id=None):
         """
@@ -280,8 +475,7 @@ class ItemsApi(MethodView):
         if not item_id:
             return make_response(jsonify(error='Please specify your item id'), 400)
 
-        email = session.get('user')
-        user = User.query.filter_by(email=email).first()
+        user = g.principal
 
         if not Activity.exists(bucket_id, user.id, item_id):
             return make_response(jsonify(dict(error='Activity not found')), 400)
@@ -321,18 +515,21 @@ class ItemsApi(MethodView):
         if not all([bucket_id, item_id]):
             return jsonify(dict(error='Please specify the bucket and the activity'), 400)
 
-        email = session.get('user')
-        user = User.query.filter_by(email=email).first()
+        user = g.principal
 
         if not Activity.exists(bucket_id, user.id, item_id):
             return make_response(jsonify(dict(error='Activity not found')), 400)
 
         Activity.delete(bucket_id, item_id, user.id)
         items = Activity.query.filter_by(bucket_id=bucket_id, user_id=user.id).all()
-        return make_response(jsonify(items=[item.serialize for item in items]))
+        return make_response(jsonify(items=Activity.serialize_many(items)))
 
 
 bucketlist.add_url_rule('/', view_func=BucketListsApi.as_view('buckets'))
+bucketlist.add_url_rule('/bulk', view_func=BucketListsApi.as_view('bulk-buckets'),
+                        methods=['POST'], defaults=dict(bulk=True))
 bucketlist.add_url_rule('/<int:bucket_id>', view_func=BucketListsApi.as_view('bucket_specific'))
 bucketlist.add_url_rule('/<int:bucket_id>/items', view_func=ItemsApi.as_view('bucket-items'))
+bucketlist.add_url_rule('/<int:bucket_id>/items/bulk', view_func=ItemsApi.as_view('bulk-items'),
+                        methods=['POST'], defaults=dict(bulk=True))
 bucketlist.add_url_rule('/<int:bucket_id>/items/<int:item_id>', view_func=ItemsApi.as_view('item'))
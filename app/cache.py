@@ -0,0 +1,170 @@
+import itertools
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Thread safe, size bounded, least recently used cache.
+    Entries also expire after a time to live, when one is given
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        """
+        :param maxsize: maximum number of entries kept
+        :param ttl: default time to live of the entries in seconds, None to never expire
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Used to get a cached value
+        :param key:
+        :param default: returned on a miss
+        :return: cached value or default
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= time.time():
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """
+        Used to cache a value, evicting the least recently used entry when full
+        :param key:
+        :param value:
+        :param ttl: time to live of this entry, defaults to the cache ttl
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl or ttl)
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        Used to remove an entry
+        :param key:
+        :param default:
+        :return: removed value or default
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def discard_where(self, predicate):
+        """
+        Used to remove all the entries whose value matches a predicate
+        :param predicate: callable taking a cached value
+        """
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if predicate(entry[0])]:
+                del self._entries[key]
+
+    def clear(self):
+        """
+        Used to remove all the entries
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Used to get the usage counters of the cache
+        :return: dict of hits, misses and size
+        """
+        return dict(hits=self.hits, misses=self.misses, size=len(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class UserCache(object):
+    """
+    Cache of per user results, all of a user's entries being invalidated at once.
+    Every user has a generation number which is part of the keys of their entries, writes
+    move the user to a new generation so the older entries are never read again and age out
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        """
+        :param maxsize: maximum number of results kept
+        :param ttl: time to live of the results in seconds, None to never expire
+        """
+        self.results = LRUCache(maxsize, ttl)
+        self._generations = LRUCache(maxsize)
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def key(self, user_id, key):
+        """
+        Used to build the cache key of a result for the user's current generation.
+        It must be built before the result is computed, so a result read before a write
+        is stored under the previous generation
+        :param user_id:
+        :param key: hashable key of the result within the user's results
+        :return: cache key
+        """
+        with self._lock:
+            generation = self._generations.get(user_id)
+            if generation is None:
+                generation = next(self._counter)
+                self._generations.set(user_id, generation)
+        return user_id, generation, key
+
+    def get(self, key, default=None):
+        """
+        Used to get a cached result
+        :param key: key built with UserCache.key
+        :param default:
+        :return: cached result or default
+        """
+        return self.results.get(key, default)
+
+    def set(self, key, value):
+        """
+        Used to cache a result
+        :param key: key built with UserCache.key
+        :param value:
+        """
+        self.results.set(key, value)
+
+    def invalidate(self, user_id):
+        """
+        Used to drop all the cached results of a user. It must be called after every write
+        :param user_id:
+        """
+        with self._lock:
+            self._generations.set(user_id, next(self._counter))
+
+    def clear(self):
+        """
+        Used to drop all the cached results
+        """
+        self.results.clear()
+        self._generations.clear()
+
+    def stats(self):
+        """
+        Used to get the usage counters of the cache
+        :return: dict of hits, misses and size
+        """
+        return self.results.stats()
@@ -1,6 +1,7 @@
 
+from app.encoding import jsonify
 from app.utils import login_required
-from flask import make_response, jsonify, Blueprint
+from flask import make_response, Blueprint
 from flask.views import MethodView
 
 callback = Blueprint('callback', __name__, url_prefix='/api/v1/')
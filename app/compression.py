@@ -0,0 +1,127 @@
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def compressor(encoding, level):
+    """
+    Used to create an incremental compressor
+    :param encoding: gzip or br
+    :param level: compression level, the brotli quality for br
+    :return: (compress, flush, finish) callables
+    """
+    if encoding == 'br':
+        stream = brotli.Compressor(quality=level)
+        return stream.process, stream.flush, stream.finish
+
+    stream = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return stream.compress, lambda: stream.flush(zlib.Z_SYNC_FLUSH), stream.flush
+
+
+def compress(data, encoding, level):
+    """
+    Used to compress a whole payload
+    :param data: bytes
+    :param encoding: gzip or br
+    :param level:
+    :return: compressed bytes
+    """
+    process, _, finish = compressor(encoding, level)
+    return process(data) + finish()
+
+
+def compress_chunks(chunks, encoding, level):
+    """
+    Used to compress a streamed body. Every chunk is flushed as soon as it is compressed
+    so the client keeps receiving data while the rest is produced
+    :param chunks: iterable of bytes or str
+    :param encoding:
+    :param level:
+    :return: generator of compressed chunks
+    """
+    process, flush, finish = compressor(encoding, level)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if chunk:
+                yield process(chunk) + flush()
+        yield finish()
+
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+class Compress(object):
+    """
+    Compresses the responses with the best encoding the client accepts.
+    Bodies smaller than COMPRESS_MIN_SIZE are sent as they are, streamed bodies are always
+    compressed since their size is not known in advance
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Used to register the compression on an app
+        :param app:
+        """
+        app.config.setdefault('COMPRESS_MIMETYPES', ['application/json', 'application/x-ndjson'])
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BROTLI', True)
+        app.config.setdefault('COMPRESS_BROTLI_QUALITY', 4)
+        app.after_request(self.after_request)
+        self.config = app.config
+
+    def choose_encoding(self):
+        """
+        Used to pick the encoding of the response from the Accept-Encoding header
+        :return: (encoding, level), encoding being None when the client accepts none
+        """
+        encodings = ['gzip']
+        if brotli is not None and self.config['COMPRESS_BROTLI']:
+            encodings.insert(0, 'br')
+
+        encoding = request.accept_encodings.best_match(encodings)
+        if encoding == 'br':
+            return encoding, self.config['COMPRESS_BROTLI_QUALITY']
+        return encoding, self.config['COMPRESS_LEVEL']
+
+    def after_request(self, response):
+        """
+        Used to compress a response
+        :param response:
+        :return: response
+        """
+        if response.mimetype not in self.config['COMPRESS_MIMETYPES'] or \
+                response.status_code < 200 or response.status_code in (204, 304) or \
+                response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding, level = self.choose_encoding()
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_chunks(response.response, encoding, level)
+            response.headers.pop('Content-Length', None)
+
+        else:
+            data = response.get_data()
+            if len(data) < self.config['COMPRESS_MIN_SIZE']:
+                return response
+            response.set_data(compress(data, encoding, level))
+
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,267 @@
+import datetime
+import json
+import logging
+import random
+import threading
+import time
+
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context, request
+from flask_sqlalchemy import SQLAlchemy
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    Queue pool measuring how long checkouts wait for a free connection
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedQueuePool, self).__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super(InstrumentedQueuePool, self)._do_get()
+
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def stats(self):
+        """
+        Used to get the state of the pool and the waits of the checkouts so far
+        :return: dict
+        """
+        return dict(size=self.size(), checked_in=self.checkedin(),
+                    checked_out=self.checkedout(), overflow=self.overflow(),
+                    checkouts=self.checkouts, timeouts=self.timeouts,
+                    wait_seconds=self.wait_seconds, max_wait_seconds=self.max_wait_seconds)
+
+
+def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    """
+    Tests a connection before the pool hands it out. A connection closed by the server is
+    reported as a disconnection so the pool replaces it, up to three times, instead of
+    failing the request
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+
+    except Exception:
+        raise exc.DisconnectionError()
+
+    finally:
+        cursor.close()
+
+
+def redact(parameters):
+    """
+    Used to describe bound parameters without their values, which may be emails or
+    password hashes
+    :param parameters: dict, sequence, or list of them for executemany
+    :return: str, the names or positions of the parameters with the type of their values
+    """
+    if isinstance(parameters, dict):
+        return repr(dict((name, type(value).__name__) for name, value in parameters.items()))
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return '%d x %s' % (len(parameters), redact(parameters[0]))
+        return repr([type(value).__name__ for value in parameters])
+    return type(parameters).__name__
+
+
+class SlowQueryLog(object):
+    """
+    Records the statements taking longer than a threshold with the names and types of their
+    parameters and the endpoint which sent them, in a bounded ring and a rotating file.
+    A sample of the slow SELECT statements is run again under EXPLAIN (ANALYZE, BUFFERS) on
+    another connection, one at a time and outside of the request, to capture their plan
+    """
+
+    def __init__(self, threshold_ms, explain_rate=0.0, size=100, path=None,
+                 max_bytes=10 * 1024 * 1024, backups=5):
+        """
+        :param threshold_ms: statements taking at least this many milliseconds are recorded
+        :param explain_rate: share of the slow SELECT statements whose plan is captured
+        :param size: number of statements kept in memory
+        :param path: file the statements are written to, None to only keep them in memory
+        :param max_bytes: size of the file before it is rotated
+        :param backups: number of rotated files kept
+        """
+        self.threshold = threshold_ms / 1000.0
+        self.explain_rate = explain_rate
+        self.recorded = 0
+        self._entries = deque(maxlen=size)
+        self._explaining = threading.Lock()
+        self._thread = None
+        self.logger = logging.getLogger('%s.%d' % (__name__, id(self)))
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        if path:
+            self.logger.addHandler(RotatingFileHandler(path, maxBytes=max_bytes,
+                                                       backupCount=backups, delay=True))
+
+    def attach(self, engine):
+        """
+        Used to time the statements of an engine
+        :param engine:
+        """
+        if not event.contains(engine, 'before_cursor_execute', self.before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault(self, []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get(self)
+        if not started:
+            return
+
+        duration = time.perf_counter() - started.pop()
+        if duration >= self.threshold:
+            self.record(conn.engine, statement, parameters, duration, executemany)
+
+    @staticmethod
+    def explainable(statement):
+        """
+        Used to check a statement can be run again to get its plan without side effects
+        :param statement:
+        :return: bool
+        """
+        statement = statement.lstrip().upper()
+        return statement.startswith('SELECT') and ' FOR UPDATE' not in statement and \
+            ' FOR SHARE' not in statement
+
+    def record(self, engine, statement, parameters, duration, executemany=False):
+        """
+        Used to record a slow statement and to start capturing its plan when it is sampled
+        :param engine:
+        :param statement:
+        :param parameters: bound parameters
+        :param duration: seconds
+        :param executemany:
+        """
+        entry = dict(time=datetime.datetime.now().isoformat(),
+                     duration_ms=round(duration * 1000, 3),
+                     endpoint=request.endpoint if has_request_context() else None,
+                     statement=statement, parameters=redact(parameters)[:1000], plan=None)
+        self._entries.append(entry)
+        self.recorded += 1
+
+        if engine.dialect.name == 'postgresql' and not executemany and \
+                random.random() < self.explain_rate and self.explainable(statement) and \
+                self._explaining.acquire(False):
+            self._thread = threading.Thread(target=self.explain,
+                                            args=(engine, entry, statement, parameters))
+            self._thread.daemon = True
+            self._thread.start()
+        else:
+            self.logger.info(json.dumps(entry))
+
+    def explain(self, engine, entry, statement, parameters):
+        """
+        Used to capture the plan of a statement on a connection of its own. The transaction
+        is rolled back so functions called by the statement leave nothing behind
+        :param engine:
+        :param entry: recorded entry the plan is added to
+        :param statement:
+        :param parameters:
+        """
+        try:
+            connection = engine.raw_connection()
+            try:
+                cursor = connection.cursor()
+                cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + statement, parameters)
+                entry['plan'] = '\n'.join(row[0] for row in cursor.fetchall())
+
+            finally:
+                connection.rollback()
+                connection.close()
+
+        except Exception as error:
+            entry['plan'] = 'EXPLAIN failed: %s' % error
+
+        finally:
+            self.logger.info(json.dumps(entry))
+            self._explaining.release()
+
+    def join(self, timeout=None):
+        """
+        Used to wait for the plan being captured, if any
+        :param timeout: seconds
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def entries(self):
+        """
+        Used to get the statements recorded last
+        :return: list of dicts, oldest first
+        """
+        return list(self._entries)
+
+
+class Database(SQLAlchemy):
+    """
+    Flask-SQLAlchemy configured from the DATABASE_* settings: the pool is instrumented and
+    pings its connections, and Postgres connections get connect and statement timeouts.
+    Statements slower than SLOW_QUERY_MS are recorded in slow_queries
+    """
+
+    slow_queries = None
+
+    def apply_driver_hacks(self, app, info, options):
+        super(Database, self).apply_driver_hacks(app, info, options)
+        options.setdefault('poolclass', InstrumentedQueuePool)
+
+        if info.drivername.startswith('postgresql'):
+            connect_args = options.setdefault('connect_args', {})
+            connect_args.setdefault('connect_timeout', app.config['DATABASE_CONNECT_TIMEOUT'])
+            if app.config['DATABASE_STATEMENT_TIMEOUT']:
+                connect_args.setdefault('options', '-c statement_timeout=%d' %
+                                        app.config['DATABASE_STATEMENT_TIMEOUT'])
+
+    def get_engine(self, app=None, bind=None):
+        engine = super(Database, self).get_engine(app, bind)
+        app = self.get_app(app)
+        if app.config['DATABASE_PRE_PING'] and \
+                not event.contains(engine.pool, 'checkout', ping_connection):
+            event.listen(engine.pool, 'checkout', ping_connection)
+
+        if app.config['SLOW_QUERY_MS'] is not None:
+            if self.slow_queries is None:
+                self.slow_queries = SlowQueryLog(
+                    app.config['SLOW_QUERY_MS'], app.config['SLOW_QUERY_EXPLAIN_RATE'],
+                    app.config['SLOW_QUERY_RING_SIZE'], app.config['SLOW_QUERY_LOG'],
+                    app.config['SLOW_QUERY_LOG_MAX_BYTES'], app.config['SLOW_QUERY_LOG_BACKUPS'])
+            self.slow_queries.attach(engine)
+        return engine
+
+    def pool_stats(self, bind=None):
+        """
+        Used to get the live stats of the connection pool
+        :param bind:
+        :return: dict, empty when the pool is not instrumented
+        """
+        pool = self.get_engine(bind=bind).pool
+        return pool.stats() if isinstance(pool, InstrumentedQueuePool) else {}
@@ -0,0 +1,134 @@
+import datetime
+import re
+
+from flask import current_app, request, json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Exponents of the floats orjson writes. The stdlib writes 1e+16 where orjson writes 1e16,
+# 1e-05 where it writes 0.00001, and escapes DEL. Those outputs, and the strings that
+# merely look like them, are left to the stdlib
+EXPONENT = re.compile(br'e[-0-9]')
+
+
+class JSONEncoder(json.JSONEncoder):
+    """
+    Application JSON encoder, datetimes and dates are encoded as str() formats them
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.date)):
+            return str(o)
+        return super(JSONEncoder, self).default(o)
+
+
+def stdlib_dumps(data):
+    """
+    Used to encode data with the application encoder, in the compact form of jsonify
+    :param data:
+    :return: str
+    """
+    return json.dumps(data, separators=(',', ':'))
+
+
+def _str_default(o):
+    if isinstance(o, (datetime.datetime, datetime.date)):
+        return str(o)
+    raise TypeError
+
+
+def orjson_dumps(data):
+    """
+    Used to encode data with orjson. It only answers when its output is the one of
+    stdlib_dumps, NaN and infinities aside, anything else is left to the stdlib
+    :param data:
+    :return: str, or None when the stdlib must encode the data
+    """
+    option = orjson.OPT_PASSTHROUGH_DATETIME
+    if current_app.config['JSON_SORT_KEYS']:
+        option |= orjson.OPT_SORT_KEYS
+    try:
+        encoded = orjson.dumps(data, default=_str_default, option=option)
+        text = encoded.decode('ascii' if current_app.config['JSON_AS_ASCII'] else 'utf-8')
+
+    except (TypeError, UnicodeDecodeError):
+        return None
+
+    if b'\x7f' in encoded or b'0.0000' in encoded or EXPONENT.search(encoded):
+        return None
+    return text
+
+
+BACKENDS = {'stdlib': stdlib_dumps}
+if orjson is not None:
+    BACKENDS['orjson'] = orjson_dumps
+BACKENDS['auto'] = BACKENDS.get('orjson', stdlib_dumps)
+
+
+def dumps(data):
+    """
+    Used to encode data with the JSON_BACKEND configured, falling back to the stdlib
+    :param data:
+    :return: str
+    """
+    backend = BACKENDS.get(current_app.config['JSON_BACKEND'], BACKENDS['auto'])
+    text = backend(data)
+    return stdlib_dumps(data) if text is None else text
+
+
+def pretty_print():
+    """
+    Used to check if the responses of the request are pretty printed, as flask's jsonify
+    does when JSONIFY_PRETTYPRINT_REGULAR is set, which only the development config does
+    :return: bool
+    """
+    return current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] and not request.is_xhr
+
+
+def pretty_dumps(data):
+    """
+    Used to encode data in the pretty printed form of jsonify
+    :param data:
+    :return: str
+    """
+    return json.dumps(data, indent=2, separators=(', ', ': '))
+
+
+def list_framing(key, pretty):
+    """
+    Used to get the text jsonify writes around the items of the list of a one key object,
+    for the items to be encoded and sent a chunk at a time
+    :param key: name of the list
+    :param pretty: whether the output is pretty printed
+    :return: (opening, separator, closing, empty object, item encoder)
+    """
+    if pretty:
+        return ('{\n  %s: [\n    ' % pretty_dumps(key), ', \n    ', '\n  ]\n}\n',
+                '{\n  %s: []\n}\n' % pretty_dumps(key),
+                lambda item: pretty_dumps(item).replace('\n', '\n    '))
+    return '{%s:[' % dumps(key), ',', ']}\n', '{%s:[]}\n' % dumps(key), dumps
+
+
+def jsonify(*args, **kwargs):
+    """
+    Drop-in replacement of flask.jsonify producing the same bytes.
+    Pretty printed responses are left to the stdlib, compact ones go through dumps
+    :return: json response
+    """
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+    elif len(args) == 1:
+        data = args[0]
+    else:
+        data = args or kwargs
+
+    if pretty_print():
+        text = pretty_dumps(data)
+    else:
+        text = dumps(data)
+    return current_app.response_class((text, '\n'),
+                                      mimetype=current_app.config['JSONIFY_MIMETYPE'])
@@ -0,0 +1,98 @@
+import threading
+import time
+
+from app import app
+
+from concurrent.futures import ThreadPoolExecutor
+
+from flask_bcrypt import Bcrypt
+
+
+class HashingPool(object):
+    """
+    Caps how many bcrypt hashes run at once by running them on a bounded pool of worker
+    threads, and records the time spent waiting for and running them.
+    The request thread still waits for the whole hash, nothing is offloaded: a burst of
+    logins queues instead of running every hash at the same time on all the cores
+    """
+
+    def __init__(self, bcrypt, workers):
+        """
+        :param bcrypt: Flask-Bcrypt instance
+        :param workers: maximum number of hashes computed at the same time
+        """
+        self.bcrypt = bcrypt
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.queue_depth = 0
+        self.hashes = 0
+        self.hash_seconds = 0.0
+        self.wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def run(self, func, *args):
+        """
+        Used to run a hashing function on the pool, blocking the caller until it is done
+        :param func:
+        :param args:
+        :return: result of the function
+        """
+        submitted = time.perf_counter()
+        with self._lock:
+            self.queue_depth += 1
+
+        def timed():
+            started = time.perf_counter()
+            with self._lock:
+                self.queue_depth -= 1
+            try:
+                return func(*args)
+
+            finally:
+                finished = time.perf_counter()
+                with self._lock:
+                    self.hashes += 1
+                    self.hash_seconds += finished - started
+                    self.wait_seconds += started - submitted
+
+        return self.executor.submit(timed).result()
+
+    def generate_password_hash(self, password):
+        """
+        Used to hash a password with the configured cost
+        :param password:
+        :return: hash
+        """
+        return self.run(self.bcrypt.generate_password_hash, password,
+                        app.config['BCRYPT_LOG_ROUNDS'])
+
+    def check_password_hash(self, pw_hash, password):
+        """
+        Used to check a password against a hash
+        :param pw_hash:
+        :param password:
+        :return: bool
+        """
+        return self.run(self.bcrypt.check_password_hash, pw_hash, password)
+
+    @staticmethod
+    def needs_rehash(pw_hash):
+        """
+        Used to check if a hash was made with another cost than the configured one
+        :param pw_hash:
+        :return: bool
+        """
+        if isinstance(pw_hash, str):
+            pw_hash = pw_hash.encode()
+        return int(bytes(pw_hash).split(b'$')[2]) != app.config['BCRYPT_LOG_ROUNDS']
+
+    def stats(self):
+        """
+        Used to get the counters of the pool
+        :return: dict of queue depth, number of hashes and time spent hashing and waiting
+        """
+        return dict(workers=self.workers, queue_depth=self.queue_depth, hashes=self.hashes,
+                    hash_seconds=self.hash_seconds, wait_seconds=self.wait_seconds)
+
+
+hashing = HashingPool(Bcrypt(app), app.config['BCRYPT_WORKERS'])
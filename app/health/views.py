@@ -0,0 +1,29 @@
+from app.encoding import jsonify
+from app.models import db
+from flask import Blueprint, make_response
+from sqlalchemy.exc import DBAPIError
+
+
+health = Blueprint('health', __name__, url_prefix='/api/v1')
+
+
+@health.route('/health', methods=['GET'])
+def health_api():
+    """
+    This end point is used by the monitoring to check the database can be reached and to
+    read the live stats of the connection pool
+    :return: json response, 503 when the database cannot be reached
+    """
+    status = 200
+    database = 'ok'
+    try:
+        db.session.execute('SELECT 1')
+
+    except DBAPIError:
+        status = 503
+        database = 'unavailable'
+
+    finally:
+        db.session.rollback()
+
+    return make_response(jsonify(database=database, pool=db.pool_stats()), status)
@@ -0,0 +1,319 @@
+import bisect
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def format_labels(names, values):
+    """
+    Used to format the labels of a sample
+    :param names:
+    :param values:
+    :return: str, empty when there is no label
+    """
+    if not names:
+        return ''
+    values = [str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+              for value in values]
+    return '{%s}' % ','.join('%s="%s"' % pair for pair in zip(names, values))
+
+
+def format_value(value):
+    """
+    Used to format the value of a sample
+    :param value: int or float
+    :return: str
+    """
+    if isinstance(value, float):
+        return repr(value) if value != float('inf') else '+Inf'
+    return str(value)
+
+
+class Counter(object):
+    """
+    Thread safe counter of every label combination
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        """
+        Used to add to the counter of a label combination
+        :param labels: tuple of the label values
+        :param amount:
+        """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        """
+        Used to list the samples of the counter
+        :return: list of (suffix, label names, label values, value)
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+        return [('', self.labels, labels, value) for labels, value in values]
+
+
+class Histogram(object):
+    """
+    Thread safe histogram of every label combination, with fixed buckets
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        """
+        Used to record a value of a label combination
+        :param labels: tuple of the label values
+        :param value:
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [[0] * (len(self.buckets) + 1), 0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    def samples(self):
+        """
+        Used to list the samples of the histogram, the buckets being cumulative
+        :return: list of (suffix, label names, label values, value)
+        """
+        with self._lock:
+            values = sorted((labels, (list(counts), total))
+                            for labels, (counts, total) in self._values.items())
+
+        names = self.labels + ('le',)
+        samples = []
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(('_bucket', names, labels + (format_value(float(bound)),),
+                                cumulative))
+            samples.append(('_sum', self.labels, labels, float(total)))
+            samples.append(('_count', self.labels, labels, cumulative))
+        return samples
+
+
+class Gauge(object):
+    """
+    Metric whose samples are read when the metrics are collected
+    """
+
+    def __init__(self, name, description, kind, labels, collect):
+        """
+        :param name:
+        :param description:
+        :param kind: gauge or counter
+        :param labels: label names
+        :param collect: callable returning a list of (label values, value)
+        """
+        self.name = name
+        self.description = description
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def samples(self):
+        """
+        Used to list the current samples
+        :return: list of (suffix, label names, label values, value)
+        """
+        return [('', self.labels, labels, value) for labels, value in self.collect()]
+
+
+def render(metrics):
+    """
+    Used to format metrics in the Prometheus text format
+    :param metrics: list of metrics
+    :return: str
+    """
+    lines = []
+    for metric in metrics:
+        lines.append('# HELP %s %s' % (metric.name, metric.description))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        for suffix, names, labels, value in metric.samples():
+            lines.append('%s%s%s %s' % (metric.name, suffix, format_labels(names, labels),
+                                        format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def stat_gauges(prefix, description, stats, kinds, labels=()):
+    """
+    Used to expose the dicts of counters returned by the stats methods
+    :param prefix: prefix of the metric names
+    :param description: description of the source of the counters
+    :param stats: callable returning a list of (label values, stats dict)
+    :param kinds: dict of stat name to (metric suffix, gauge or counter)
+    :param labels: label names
+    :return: list of gauges
+    """
+    def collect(name):
+        return lambda: [(values, counters[name]) for values, counters in stats()
+                        if name in counters]
+
+    return [Gauge(prefix + suffix, '%s: %s' % (description, name.replace('_', ' ')), kind,
+                  labels, collect(name))
+            for name, (suffix, kind) in sorted(kinds.items())]
+
+
+class Metrics(object):
+    """
+    Records the latency, status, number of SQL statements and database time of the
+    requests of every endpoint, and serves them with the pool, hashing and cache stats on
+    /metrics in the Prometheus text format.
+    Recording a request costs a few clock reads and dict updates so it can stay enabled
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.requests = Counter('http_requests_total', 'Requests by endpoint and status',
+                                ('endpoint', 'method', 'status'))
+        self.latency = Histogram('http_request_duration_seconds',
+                                 'Time spent answering the requests by endpoint',
+                                 ('endpoint', 'method'))
+        self.db_time = Histogram('http_request_db_seconds',
+                                 'Time spent waiting for the database per request',
+                                 ('endpoint', 'method'))
+        self.queries = Histogram('http_request_queries', 'SQL statements sent per request',
+                                 ('endpoint', 'method'), QUERY_BUCKETS)
+        self.collectors = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Used to register the request hooks, the SQL listeners and the /metrics route on an app
+        :param app:
+        """
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_api, methods=['GET'])
+        if not event.contains(Engine, 'before_cursor_execute', self.before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def register(self, *metrics):
+        """
+        Used to add metrics read when /metrics is requested
+        :param metrics: gauges
+        """
+        self.collectors.extend(metrics)
+
+    @staticmethod
+    def before_request():
+        """
+        Used to start timing a request
+        """
+        g.metrics_queries = 0
+        g.metrics_db_seconds = 0.0
+        g.metrics_start = time.perf_counter()
+
+    @staticmethod
+    def after_request(response):
+        """
+        Used to keep the status of the response until the request is over
+        :param response:
+        :return: response
+        """
+        g.metrics_status = response.status_code
+        return response
+
+    def teardown_request(self, error=None):
+        """
+        Used to record a request once it is over, after the last chunk of streamed bodies.
+        Requests which failed without a response are recorded as 500
+        :param error:
+        """
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+
+        labels = (request.endpoint or 'none', request.method)
+        status = g.pop('metrics_status', 500)
+        self.requests.inc(labels + (str(status),))
+        self.latency.observe(labels, time.perf_counter() - start)
+        self.db_time.observe(labels, g.metrics_db_seconds)
+        self.queries.observe(labels, g.metrics_queries)
+
+    @staticmethod
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        """
+        Used to start timing a SQL statement sent while answering a request
+        """
+        if has_request_context() and 'metrics_start' in g:
+            conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    @staticmethod
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        """
+        Used to add a SQL statement to the counters of the request
+        """
+        started = conn.info.get('metrics_started')
+        if started and has_request_context() and 'metrics_start' in g:
+            g.metrics_db_seconds += time.perf_counter() - started.pop()
+            g.metrics_queries += 1
+
+    def metrics_api(self):
+        """
+        This end point is used by Prometheus to scrape the metrics
+        :return: text response
+        """
+        body = render([self.requests, self.latency, self.db_time, self.queries] +
+                      self.collectors)
+        return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def service_gauges():
+    """
+    Used to expose the stats of the connection pool, the password hashing pool and the caches.
+    It must be called once the models are loaded
+    :return: list of gauges
+    """
+    from app.hashing import hashing
+    from app.models import category_ids, db, search_results, user_stats
+    from app.utils import principals
+
+    caches = dict(category_ids=category_ids, principals=principals,
+                  search_results=search_results, user_stats=user_stats)
+    return stat_gauges('db_pool_', 'Connection pool', lambda: [((), db.pool_stats())], dict(
+        size=('size', 'gauge'), checked_in=('checked_in', 'gauge'),
+        checked_out=('checked_out', 'gauge'), overflow=('overflow', 'gauge'),
+        checkouts=('checkouts_total', 'counter'), timeouts=('timeouts_total', 'counter'),
+        wait_seconds=('wait_seconds_total', 'counter'),
+        max_wait_seconds=('max_wait_seconds', 'gauge'))) + \
+        stat_gauges('bcrypt_', 'Password hashing pool', lambda: [((), hashing.stats())], dict(
+            workers=('workers', 'gauge'), queue_depth=('queue_depth', 'gauge'),
+            hashes=('hashes_total', 'counter'), hash_seconds=('hash_seconds_total', 'counter'),
+            wait_seconds=('wait_seconds_total', 'counter'))) + \
+        stat_gauges('cache_', 'In memory caches',
+                    lambda: [((name,), cache.stats()) for name, cache in sorted(caches.items())],
+                    dict(hits=('hits_total', 'counter'), misses=('misses_total', 'counter'),
+                         size=('size', 'gauge')), labels=('cache',)) + \
+        [Gauge('db_slow_queries_total', 'Statements slower than SLOW_QUERY_MS', 'counter', (),
+               lambda: [((), db.slow_queries.recorded)] if db.slow_queries else [])]
@@ -2,19 +2,38 @@ import datetime
 
 from app import app
 
-from flask_bcrypt import Bcrypt
+from app.cache import LRUCache, UserCache
 
-from flask_sqlalchemy import SQLAlchemy, BaseQuery
+from app.database import Database
+
+from app.hashing import hashing
+
+from flask_sqlalchemy import BaseQuery
 
 from itsdangerous import TimedJSONWebSignatureSerializer, BadSignature, SignatureExpired
+from sqlalchemy import DDL, and_, cast, event, func, literal, or_, select, tuple_, union_all
+from sqlalchemy.dialects.postgresql import REAL, insert
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy_searchable import make_searchable
+from sqlalchemy.orm import load_only
+from sqlalchemy_searchable import make_searchable, search_manager
 from sqlalchemy_searchable import SearchQueryMixin
 from sqlalchemy_utils.types import TSVectorType
 
-db = SQLAlchemy(app)
-hashing = Bcrypt(app)
+db = Database(app)
 make_searchable()
+category_ids = LRUCache(app.config['CATEGORY_CACHE_SIZE'], app.config['CATEGORY_CACHE_TTL'])
+search_results = UserCache(app.config['SEARCH_CACHE_SIZE'], app.config['SEARCH_CACHE_TTL'])
+user_stats = UserCache(app.config['STATS_CACHE_SIZE'], app.config['STATS_CACHE_TTL'])
+
+
+def invalidate_user_caches(user_id):
+    """
+    Drops the cached search results and stats of a user. It must be called after every write
+    to the user's buckets or activities
+    :param user_id:
+    """
+    search_results.invalidate(user_id)
+    user_stats.invalidate(user_id)
 
 
 class BucketQuery(BaseQuery, SearchQueryMixin):
@@ -42,13 +61,15 @@ class User(db.Model):
     _password = db.Column(db.LargeBinary(), nullable=False)
     first_name = db.Column(db.String(30), nullable=True)
     last_name = db.Column(db.String(30), nullable=True)
-    date_joined = db.Column(db.DateTime(), default=datetime.datetime.now())
+    date_joined = db.Column(db.DateTime(), default=datetime.datetime.now)
     is_active = db.Column(db.Boolean(), default=True)
     last_login = db.Column(db.DateTime(), nullable=True)
+    bucket_count = db.Column(db.Integer, nullable=False, server_default='0')
+    activity_count = db.Column(db.Integer, nullable=False, server_default='0')
     buckets = db.relationship("Bucket", backref='user', lazy='dynamic',
-                              cascade="delete, delete-orphan")
+                              cascade="delete, delete-orphan", passive_deletes=True)
     activities = db.relationship("Activity", backref='user', lazy='dynamic',
-                                 cascade="delete, delete-orphan")
+                                 cascade="delete, delete-orphan", passive_deletes=True)
 
     @hybrid_property
     def password(self):
@@ -75,6 +96,13 @@ class User(db.Model):
         """
         return hashing.check_password_hash(self.password, password)
 
+    def needs_rehash(self):
+        """
+        Used to check if the password was hashed with another cost than the configured one
+        :return: bool
+        """
+        return hashing.needs_rehash(self.password)
+
     @staticmethod
     def exists(email):
         """
@@ -122,32 +150,67 @@ class User(db.Model):
         key = TimedJSONWebSignatureSerializer(app.config['SECRET_KEY'])
         return key.dumps(dict(id=self.id))
 
-    @classmethod
-    def verify_token(cls, token):
+    @staticmethod
+    def decode_token(token):
         """
-        Used to verify the validity of a token
+        Used to check the signature of a token without touching the database
         :param token:
-        :return: None or user id
+        :return: None or dict with the user id and the expiry timestamp
         """
         key = TimedJSONWebSignatureSerializer(app.config['SECRET_KEY'])
 
         try:
-            data = key.loads(token)
+            data, header = key.loads(token, return_header=True)
 
         except (SignatureExpired, BadSignature):
             return None
+        return dict(id=data['id'], exp=header['exp'])
+
+    @classmethod
+    def verify_token(cls, token):
+        """
+        Used to verify the validity of a token
+        :param token:
+        :return: None or user id
+        """
+        data = cls.decode_token(token)
+
+        if data is None:
+            return None
         return cls.query.filter_by(id=data['id']).first()
 
     @staticmethod
     def delete(email):
         """
-        Used to delete a user
+        Used to delete a user.
+        The buckets and activities are removed by the database through ON DELETE CASCADE
         :param email:
         """
-        user = User.query.filter_by(email=email).first()
-        db.session.delete(user)
+        User.query.filter_by(email=email).delete(synchronize_session=False)
         db.session.commit()
 
+    @staticmethod
+    def counters(user_id):
+        """
+        Used to get the number of buckets and activities of a user from the user's counters
+        :param user_id:
+        :return: (bucket_count, activity_count)
+        """
+        return db.session.query(User.bucket_count, User.activity_count)\
+            .filter(User.id == user_id).one()
+
+    @staticmethod
+    def emails_by_id(user_ids):
+        """
+        Used to get the emails of several users in a single query
+        :param user_ids:
+        :return: dict of user id to email
+        """
+        user_ids = set(user_id for user_id in user_ids if user_id)
+        if not user_ids:
+            return {}
+        return dict(db.session.query(User.id, User.email).filter(User.id.in_(user_ids)).all())
+
     def get_or_create(self):
         if User.exists(self.email):
             return User.query.filter_by(email=self.email).first()
@@ -160,19 +223,27 @@ class Bucket(db.Model):
     This contains tables for the bucket
     """
     __tablename__ = 'bucket'
+    __table_args__ = (db.Index('ix_bucket_user_id_id', 'user_id', 'id'),)
+    __mapper_args__ = {'eager_defaults': True}
     query_class = BucketQuery
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     bucket_name = db.Column(db.String(70), nullable=False)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
-    created = db.Column(db.DateTime(), default=datetime.datetime.now())
-    updated = db.Column(db.DateTime(), default=datetime.datetime.now())
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created = db.Column(db.DateTime(), default=datetime.datetime.now)
+    updated = db.Column(db.DateTime(), default=datetime.datetime.now)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
     description = db.Column(db.String(100), nullable=False)
+    item_count = db.Column(db.Integer, nullable=False, server_default='0')
     activities = db.relationship("Activity", backref='bucket', lazy='dynamic',
-                                 cascade="delete, delete-orphan")
+                                 cascade="delete, delete-orphan", passive_deletes=True)
     search_vector = db.Column(TSVectorType('bucket_name', 'description'))
 
+    # Serialized fields and the column each one is read from
+    FIELDS = dict(id='id', bucket_name='bucket_name', created='created', user='user_id',
+                  description='description', updated='updated', category='category_id',
+                  item_count='item_count')
+
     def get_id(self):
         """
         Used to get the specific id for a bucket
@@ -187,18 +258,21 @@ class Bucket(db.Model):
         """
         db.session.add(self)
         db.session.commit()
-        return Bucket.query.filter_by(id=self.id).first()
+        bucket = Bucket.query.filter_by(id=self.id).first()
+        invalidate_user_caches(bucket.user_id)
+        return bucket
 
     @staticmethod
     def delete(bucket_id, user):
         """
-        Used to delete a bucket
+        Used to delete a bucket.
+        The activities are removed by the database through ON DELETE CASCADE
         :param bucket_id:
         :param user:
         """
-        bucket = Bucket.query.filter_by(id=bucket_id, user_id=user).first()
-        db.session.delete(bucket)
+        Bucket.query.filter_by(id=bucket_id, user_id=user).delete(synchronize_session=False)
         db.session.commit()
+        invalidate_user_caches(user)
 
     @property
     def serialize(self):
@@ -206,15 +280,156 @@ class Bucket(db.Model):
         Returns a serialized object of the bucket
         :return: serialized obj
         """
-        category = Category.query.filter_by(id=self.category_id).first()
-        serialized_obj = dict(id=self.id, bucket_name=self.bucket_name,
-                              created=str(self.created.date()), user=self.user.email,
-                              description=self.description, updated=str(self.updated))
+        return Bucket.serialize_many([self])[0]
+
+    @staticmethod
+    def load_fields(fields=None):
+        """
+        Used to get the loader option selecting only the columns of some serialized fields
+        :param fields: names of the fields, None for all of them
+        :return: query option
+        """
+        names = Bucket.FIELDS if fields is None else fields
+        return load_only('id', *set(Bucket.FIELDS[name] for name in names if name in Bucket.FIELDS))
+
+    @staticmethod
+    def serialize_many(buckets, fields=None):
+        """
+        Serializes a list of buckets.
+        Categories and owners are loaded in one query each, whatever the number of buckets,
+        and only when their field is asked for
+        :param buckets:
+        :param fields: names of the fields to serialize, None for all of them
+        :return: list of serialized objs
+        """
+        buckets = list(buckets)
+        fields = Bucket.FIELDS if fields is None else fields
+        categories = {}
+        if 'category' in fields:
+            category_ids = set(bucket.category_id for bucket in buckets if bucket.category_id)
+            if category_ids:
+                categories = dict(db.session.query(Category.id, Category.category_name)
+                                  .filter(Category.id.in_(category_ids)).all())
+
+        emails = User.emails_by_id(bucket.user_id for bucket in buckets) if 'user' in fields \
+            else {}
+        getters = dict(id=lambda bucket: bucket.id,
+                       bucket_name=lambda bucket: bucket.bucket_name,
+                       created=lambda bucket: bucket.created.date(),
+                       user=lambda bucket: emails.get(bucket.user_id),
+                       description=lambda bucket: bucket.description,
+                       updated=lambda bucket: bucket.updated,
+                       item_count=lambda bucket: bucket.item_count)
+        getters = [(name, getters[name]) for name in fields if name in getters]
+        serialized = []
+
+        for bucket in buckets:
+            serialized_obj = dict((name, getter(bucket)) for name, getter in getters)
+
+            if categories and bucket.category_id in categories:
+                serialized_obj['category'] = categories[bucket.category_id]
+
+            serialized.append(serialized_obj)
+        return serialized
+
+    @staticmethod
+    def find_duplicates(user_id, bucket_names):
+        """
+        Finds which of several bucket names a user already has, in a single query
+        :param user_id:
+        :param bucket_names:
+        :return: set of existing bucket names
+        """
+        if not bucket_names:
+            return set()
+        rows = db.session.query(Bucket.bucket_name)\
+            .filter(Bucket.user_id == user_id, Bucket.bucket_name.in_(list(bucket_names))).all()
+        return set(row.bucket_name for row in rows)
+
+    @staticmethod
+    def bulk_create(user_id, buckets):
+        """
+        Used to add several buckets with one multi-row INSERT and a single commit
+        :param user_id:
+        :param buckets: list of dicts with unique bucket names, descriptions and category ids
+        :return: dict of bucket name to inserted row
+        """
+        if not buckets:
+            return {}
+        table = Bucket.__table__
+        statement = table.insert().values([dict(bucket, user_id=user_id) for bucket in buckets])\
+            .returning(table.c.id, table.c.bucket_name, table.c.category_id, table.c.user_id,
+                       table.c.description, table.c.created, table.c.updated,
+                       table.c.item_count)
+        rows = db.session.execute(statement).fetchall()
+        db.session.commit()
+        invalidate_user_caches(user_id)
+        return dict((row.bucket_name, row) for row in rows)
+
+    @staticmethod
+    def insert_many(user_id, buckets):
+        """
+        Used to add several buckets with one multi-row INSERT in the caller's transaction
+        :param user_id:
+        :param buckets: list of dicts with unique bucket names
+        :return: dict of bucket name to id
+        """
+        if not buckets:
+            return {}
+        table = Bucket.__table__
+        statement = table.insert().values([dict(bucket, user_id=user_id) for bucket in buckets])\
+            .returning(table.c.bucket_name, table.c.id)
+        return dict(db.session.execute(statement).fetchall())
 
-        if category:
-            serialized_obj['category'] = category.category_name
+    @staticmethod
+    def total(user_id):
+        """
+        Used to get the number of buckets of a user from the user's counter
+        :param user_id:
+        :return: int
+        """
+        return db.session.query(User.bucket_count).filter(User.id == user_id).scalar() or 0
 
-        return serialized_obj
+    @staticmethod
+    def count_by_category(user_id):
+        """
+        Used to count the buckets of a user in each category
+        :param user_id:
+        :return: list of category name, None for no category, and number of buckets
+        """
+        return db.session.query(Category.category_name, func.count(Bucket.id))\
+            .select_from(Bucket).outerjoin(Category, Bucket.category_id == Category.id)\
+            .filter(Bucket.user_id == user_id).group_by(Category.category_name)\
+            .order_by(func.count(Bucket.id).desc(), Category.category_name).all()
+
+    @staticmethod
+    def recently_updated(user_id, limit):
+        """
+        Used to get the buckets of a user updated last
+        :param user_id:
+        :param limit:
+        :return: list of buckets
+        """
+        return Bucket.query.filter_by(user_id=user_id).options(Bucket.load_fields())\
+            .order_by(Bucket.updated.desc(), Bucket.id.desc()).limit(limit).all()
+
+    @staticmethod
+    def fingerprint(user_id, bucket_id=None):
+        """
+        Used to get aggregates that change whenever a user's buckets, or one bucket, change.
+        The item counts are included since adding or deleting an item leaves updated as is
+        :param user_id:
+        :param bucket_id: None for all the buckets of the user
+        :return: count, max id, max updated and total item count, None when the bucket does
+        not exist
+        """
+        query = db.session.query(func.count(Bucket.id), func.max(Bucket.id),
+                                 func.max(Bucket.updated), func.sum(Bucket.item_count))\
+            .filter(Bucket.user_id == user_id)
+        if bucket_id is not None:
+            query = query.filter(Bucket.id == bucket_id)
+        state = query.one()
+        return None if bucket_id is not None and not state[0] else tuple(state)
 
     @staticmethod
     def exists(bucket_id, user_id):
@@ -260,14 +475,102 @@ class Category(db.Model):
         return Category.query.filter_by(id=self.id).first()
 
     @staticmethod
-    def exists(category_name):
+    def get_id(category_name):
         """
-        Checks the existence of a category and get or create
+        Gets the id of a category, creating it when it does not exist.
+        Known names are served from memory. Unknown ones are inserted with
+        INSERT ... ON CONFLICT DO NOTHING in the caller's transaction, so concurrent
+        creation of the same category cannot fail on the unique constraint
         :param category_name:
-        :return: category instance
+        :return: category id
+        """
+        return Category.get_ids([category_name])[category_name]
+
+    @staticmethod
+    def get_ids(category_names):
+        """
+        Gets the ids of several categories, creating the missing ones.
+        All the unknown names are inserted with a single INSERT ... ON CONFLICT DO NOTHING
+        and the ones created meanwhile by other transactions are read with a single SELECT
+        :param category_names:
+        :return: dict of category name to id
+        """
+        pending = db.session.info.setdefault('new_categories', {})
+        ids = {}
+        missing = []
+        for category_name in set(category_names):
+            category_id = category_ids.get(category_name, pending.get(category_name))
+            if category_id is None:
+                missing.append(category_name)
+            else:
+                ids[category_name] = category_id
+
+        if not missing:
+            return ids
+
+        table = Category.__table__
+        statement = insert(table).values([dict(category_name=name) for name in missing])\
+            .on_conflict_do_nothing(index_elements=['category_name'])\
+            .returning(table.c.category_name, table.c.id)
+        created = dict(db.session.execute(statement).fetchall())
+        # Only cached once committed, a rollback would leave dangling ids
+        pending.update(created)
+        ids.update(created)
+
+        existing = [name for name in missing if name not in created]
+        if existing:
+            rows = db.session.query(Category.category_name, Category.id)\
+                .filter(Category.category_name.in_(existing)).all()
+            for category_name, category_id in rows:
+                category_ids.set(category_name, category_id)
+                ids[category_name] = category_id
+        return ids
+
+    @staticmethod
+    def warm_cache():
+        """
+        Loads the categories into memory, up to the size of the cache
         """
-        category = Category.query.filter_by(category_name=category_name).first()
-        return category if category else Category(category_name=category_name).save()
+        rows = db.session.query(Category.category_name, Category.id)\
+            .order_by(Category.id).limit(category_ids.maxsize).all()
+        for category_name, category_id in rows:
+            category_ids.set(category_name, category_id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def cache_new_categories(session):
+    """
+    Caches the categories created by a transaction once it is committed
+    :param session:
+    """
+    for category_name, category_id in session.info.pop('new_categories', {}).items():
+        category_ids.set(category_name, category_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_new_categories(session):
+    """
+    Forgets the categories created by a transaction that was rolled back
+    :param session:
+    """
+    session.info.pop('new_categories', None)
+
+
+@event.listens_for(Category.__table__, 'after_drop')
+def clear_category_cache(*args, **kwargs):
+    """
+    Empties the category cache when the table is dropped
+    """
+    category_ids.clear()
+
+
+@event.listens_for(Bucket.__table__, 'after_drop')
+def clear_search_cache(*args, **kwargs):
+    """
+    Empties the search and stats caches when the buckets are dropped
+    """
+    search_results.clear()
+    user_stats.clear()
 
 
 class Activity(db.Model):
@@ -275,16 +578,21 @@ class Activity(db.Model):
     Table containing activity related data
     """
     __tablename__ = 'activity'
+    __table_args__ = (db.Index('ix_activity_bucket_id_id', 'bucket_id', 'id'),)
     query_class = ItemQuery
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     description = db.Column(db.Text())
-    bucket_id = db.Column(db.Integer, db.ForeignKey('bucket.id'))
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    created = db.Column(db.DateTime(), default=datetime.datetime.now())
-    updated = db.Column(db.DateTime(), default=datetime.datetime.now())
+    bucket_id = db.Column(db.Integer, db.ForeignKey('bucket.id', ondelete='CASCADE'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), index=True)
+    created = db.Column(db.DateTime(), default=datetime.datetime.now)
+    updated = db.Column(db.DateTime(), default=datetime.datetime.now)
     search_vector = db.Column(TSVectorType('description'))
 
+    # Serialized fields and the column each one is read from
+    FIELDS = dict(activity_id='id', description='description', user='user_id',
+                  created='created', bucket_id='bucket_id', updated='updated')
+
     def get_id(self):
         return self.id
 
@@ -295,7 +603,9 @@ class Activity(db.Model):
         """
         db.session.add(self)
         db.session.commit()
-        return Activity.query.filter_by(id=self.id).first()
+        activity = Activity.query.filter_by(id=self.id).first()
+        invalidate_user_caches(activity.user_id)
+        return activity
 
     @property
     def serialize(self):
@@ -303,10 +613,93 @@ class Activity(db.Model):
         Returns a serialized object of the Item
         :return: serialized obj
         """
-        serialized_obj = dict(activity_id=self.id, description=self.description,
-                              user=self.user.email, created=str(self.created.date()),
-                              bucket_id=self.bucket.id, updated=str(self.updated.date()))
-        return serialized_obj
+        return Activity.serialize_many([self])[0]
+
+    @staticmethod
+    def load_fields(fields=None):
+        """
+        Used to get the loader option selecting only the columns of some serialized fields
+        :param fields: names of the fields, None for all of them
+        :return: query option
+        """
+        names = Activity.FIELDS if fields is None else fields
+        return load_only('id', *set(Activity.FIELDS[name] for name in names
+                                    if name in Activity.FIELDS))
+
+    @staticmethod
+    def serialize_many(activities, fields=None):
+        """
+        Serializes a list of items.
+        The owners are loaded in a single query, whatever the number of items, and only when
+        their field is asked for
+        :param activities:
+        :param fields: names of the fields to serialize, None for all of them
+        :return: list of serialized objs
+        """
+        activities = list(activities)
+        fields = Activity.FIELDS if fields is None else fields
+        emails = User.emails_by_id(activity.user_id for activity in activities) \
+            if 'user' in fields else {}
+        getters = dict(activity_id=lambda activity: activity.id,
+                       description=lambda activity: activity.description,
+                       user=lambda activity: emails.get(activity.user_id),
+                       created=lambda activity: activity.created.date(),
+                       bucket_id=lambda activity: activity.bucket_id,
+                       updated=lambda activity: activity.updated.date())
+        getters = [(name, getters[name]) for name in fields if name in getters]
+        return [dict((name, getter(activity)) for name, getter in getters)
+                for activity in activities]
+
+    @staticmethod
+    def total(bucket_id, user_id):
+        """
+        Used to get the number of activities of a bucket from the bucket's counter
+        :param bucket_id:
+        :param user_id:
+        :return: int
+        """
+        return db.session.query(Bucket.item_count)\
+            .filter(Bucket.id == bucket_id, Bucket.user_id == user_id).scalar() or 0
+
+    @staticmethod
+    def count_by_week(user_id, weeks):
+        """
+        Used to count the activities a user created in each of the last weeks
+        :param user_id:
+        :param weeks: number of weeks, the current one included
+        :return: list of the monday starting the week and number of activities, weeks without
+        activities being left out
+        """
+        today = datetime.date.today()
+        since = today - datetime.timedelta(days=today.weekday(), weeks=weeks - 1)
+        week = func.date_trunc('week', Activity.created)
+        return db.session.query(week, func.count(Activity.id))\
+            .filter(Activity.user_id == user_id, Activity.created >= since)\
+            .group_by(week).order_by(week).all()
+
+    @staticmethod
+    def fingerprint(user_id, bucket_id=None, item_id=None):
+        """
+        Used to get aggregates that change whenever the activities of a bucket, or one
+        activity, change. The bucket is outer joined so a missing bucket is told apart
+        from an empty one within the same query
+        :param user_id:
+        :param bucket_id:
+        :param item_id: None for all the activities of the bucket
+        :return: count, max id and max updated, None when the bucket or activity does not exist
+        """
+        if bucket_id is None:
+            return None
+        condition = Activity.bucket_id == Bucket.id
+        if item_id is not None:
+            condition = and_(condition, Activity.id == item_id)
+        state = db.session.query(func.count(Bucket.id), func.count(Activity.id),
+                                 func.max(Activity.id), func.max(Activity.updated))\
+            .select_from(Bucket).outerjoin(Activity, condition)\
+            .filter(Bucket.id == bucket_id, Bucket.user_id == user_id).one()
+        if not state[0] or (item_id is not None and not state[1]):
+            return None
+        return tuple(state[1:])
 
     @staticmethod
     def exists(bucket_id, user_id, activity_id):
@@ -333,6 +726,57 @@ class Activity(db.Model):
                                             id=activity_id).first()
         db.session.delete(activity)
         db.session.commit()
+        invalidate_user_caches(user_id)
+
+    @staticmethod
+    def find_duplicates(bucket_id, user_id, descriptions):
+        """
+        Finds which of several descriptions already exist in a bucket, in a single query
+        :param bucket_id:
+        :param user_id:
+        :param descriptions:
+        :return: set of existing descriptions
+        """
+        if not descriptions:
+            return set()
+        rows = db.session.query(Activity.description)\
+            .filter(Activity.bucket_id == bucket_id, Activity.user_id == user_id,
+                    Activity.description.in_(descriptions)).all()
+        return set(row.description for row in rows)
+
+    @staticmethod
+    def bulk_create(bucket_id, user_id, descriptions):
+        """
+        Used to add several activities with one multi-row INSERT and a single commit
+        :param bucket_id:
+        :param user_id:
+        :param descriptions: unique descriptions
+        :return: dict of description to inserted row
+        """
+        if not descriptions:
+            return {}
+        table = Activity.__table__
+        statement = table.insert().values([dict(description=description, bucket_id=bucket_id,
+                                                user_id=user_id)
+                                           for description in descriptions])\
+            .returning(table.c.id, table.c.description, table.c.bucket_id, table.c.user_id,
+                       table.c.created, table.c.updated)
+        rows = db.session.execute(statement).fetchall()
+        db.session.commit()
+        invalidate_user_caches(user_id)
+        return dict((row.description, row) for row in rows)
+
+    @staticmethod
+    def insert_many(user_id, activities):
+        """
+        Used to add activities of several buckets with one multi-row INSERT in the caller's
+        transaction
+        :param user_id:
+        :param activities: list of dicts with bucket ids and descriptions
+        """
+        if activities:
+            db.session.execute(Activity.__table__.insert().values(
+                [dict(activity, user_id=user_id) for activity in activities]))
 
     @staticmethod
     def test_duplicate(bucket_id, user_id, description):
@@ -346,3 +790,192 @@ class Activity(db.Model):
         activity = Activity.query.filter_by(bucket_id=bucket_id, user_id=user_id,
                                             description=description).first()
         return True if activity else False
+
+
+# Statement level triggers keeping the counters of the owners in step with the rows inserted
+# and deleted, in the same transaction. Rows are never moved to another owner. Reading the
+# transition tables needs PostgreSQL 10 or later
+BUCKET_COUNTERS = """
+CREATE OR REPLACE FUNCTION count_buckets() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE "user" SET bucket_count = "user".bucket_count + added.total
+        FROM (SELECT user_id, count(*) AS total FROM new_rows GROUP BY user_id) AS added
+        WHERE "user".id = added.user_id;
+    ELSE
+        UPDATE "user" SET bucket_count = "user".bucket_count - removed.total
+        FROM (SELECT user_id, count(*) AS total FROM old_rows GROUP BY user_id) AS removed
+        WHERE "user".id = removed.user_id;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER bucket_counters_insert AFTER INSERT ON bucket
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE count_buckets();
+
+CREATE TRIGGER bucket_counters_delete AFTER DELETE ON bucket
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE count_buckets();
+"""
+
+ACTIVITY_COUNTERS = """
+CREATE OR REPLACE FUNCTION count_activities() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE bucket SET item_count = bucket.item_count + added.total
+        FROM (SELECT bucket_id, count(*) AS total FROM new_rows GROUP BY bucket_id) AS added
+        WHERE bucket.id = added.bucket_id;
+        UPDATE "user" SET activity_count = "user".activity_count + added.total
+        FROM (SELECT user_id, count(*) AS total FROM new_rows GROUP BY user_id) AS added
+        WHERE "user".id = added.user_id;
+    ELSE
+        UPDATE bucket SET item_count = bucket.item_count - removed.total
+        FROM (SELECT bucket_id, count(*) AS total FROM old_rows GROUP BY bucket_id) AS removed
+        WHERE bucket.id = removed.bucket_id;
+        UPDATE "user" SET activity_count = "user".activity_count - removed.total
+        FROM (SELECT user_id, count(*) AS total FROM old_rows GROUP BY user_id) AS removed
+        WHERE "user".id = removed.user_id;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER activity_counters_insert AFTER INSERT ON activity
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE count_activities();
+
+CREATE TRIGGER activity_counters_delete AFTER DELETE ON activity
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE count_activities();
+"""
+
+event.listen(Bucket.__table__, 'after_create',
+             DDL(BUCKET_COUNTERS).execute_if(dialect='postgresql'))
+event.listen(Activity.__table__, 'after_create',
+             DDL(ACTIVITY_COUNTERS).execute_if(dialect='postgresql'))
+
+
+def repair_counters():
+    """
+    Recomputes the counters maintained by the triggers, in case rows were changed while
+    the triggers were disabled
+    :return: dict of counter name to number of rows fixed
+    """
+    buckets = select([func.count(Bucket.id)]).where(Bucket.user_id == User.id).as_scalar()
+    activities = select([func.count(Activity.id)]).where(Activity.user_id == User.id).as_scalar()
+    items = select([func.count(Activity.id)]).where(Activity.bucket_id == Bucket.id).as_scalar()
+    counters = [('bucket_count', User.__table__, User.bucket_count, buckets),
+                ('activity_count', User.__table__, User.activity_count, activities),
+                ('item_count', Bucket.__table__, Bucket.item_count, items)]
+    fixed = {}
+    for name, table, column, count in counters:
+        statement = table.update().values({name: count}).where(column != count)
+        fixed[name] = db.session.execute(statement).rowcount
+    db.session.commit()
+    return fixed
+
+
+def export_rows(user_id, chunk_size):
+    """
+    Reads all the buckets of a user, each followed by its activities, from a server side
+    cursor fetching chunk_size rows at a time
+    :param user_id:
+    :param chunk_size:
+    :return: iterable of rows, the activity columns being None for buckets without activity
+    """
+    return db.session.query(
+        Bucket.id.label('bucket_id'), Bucket.bucket_name, Bucket.description,
+        Category.category_name.label('category'), Bucket.created, Bucket.updated,
+        Activity.id.label('activity_id'), Activity.description.label('activity_description'),
+        Activity.created.label('activity_created'), Activity.updated.label('activity_updated'))\
+        .outerjoin(Category, Bucket.category_id == Category.id)\
+        .outerjoin(Activity, Activity.bucket_id == Bucket.id)\
+        .filter(Bucket.user_id == user_id).order_by(Bucket.id, Activity.id)\
+        .execution_options(stream_results=True).yield_per(chunk_size)
+
+
+def search_hits(user_id, search_query, limit, after=None):
+    """
+    Finds the buckets and activities of a user matching a parsed search query.
+    Both tables are searched through their search_vector GIN indexes and the hits are merged
+    and ordered by ts_rank, then by type and id
+    :param user_id:
+    :param search_query: query parsed with sqlalchemy_searchable.parse_search_query
+    :param limit:
+    :param after: (rank, type, id) of the last hit of the previous page
+    :return: list of hits with type, id and rank
+    """
+    regconfig = search_manager.options['regconfig']
+    ts_query = func.to_tsquery(regconfig, search_query)
+    selects = []
+    for kind, model in [('bucket', Bucket), ('activity', Activity)]:
+        selects.append(select([literal(kind).label('type'), model.id.label('id'),
+                               func.ts_rank(model.search_vector, ts_query).label('rank')])
+                       .where(and_(model.user_id == user_id,
+                                   model.search_vector.match(search_query,
+                                                             postgresql_regconfig=regconfig))))
+    hits = union_all(*selects).alias('hits')
+    statement = select([hits.c.type, hits.c.id, hits.c.rank])
+
+    if after is not None:
+        # ts_rank is a real, the rank of the cursor is cast back so ties compare equal
+        rank, kind, hit_id = after
+        rank = cast(rank, REAL)
+        statement = statement.where(or_(hits.c.rank < rank,
+                                        and_(hits.c.rank == rank,
+                                             tuple_(hits.c.type, hits.c.id) >
+                                             tuple_(kind, hit_id))))
+
+    statement = statement.order_by(hits.c.rank.desc(), hits.c.type, hits.c.id).limit(limit)
+    return db.session.execute(statement).fetchall()
+
+
+def autocomplete_hits(user_id, fragment, limit, timeout_ms):
+    """
+    Finds the bucket names and activity descriptions of a user containing a fragment.
+    The ILIKE lookups are served by the pg_trgm GIN indexes on both columns. Texts starting
+    with the fragment come first, then the ones where it appears earliest, then the shortest.
+    Runs in a savepoint under a statement timeout which ends with it, so the transaction of
+    the caller is left as it was
+    :param user_id:
+    :param fragment:
+    :param limit:
+    :param timeout_ms: milliseconds the lookup may take
+    :return: list of hits with type, id and text
+    :raises OperationalError: with QueryCanceledError when the lookup exceeded the timeout
+    """
+    escaped = fragment.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    selects = []
+    for kind, model, column in [('bucket', Bucket, Bucket.bucket_name),
+                                ('activity', Activity, Activity.description)]:
+        selects.append(select([literal(kind).label('type'), model.id.label('id'),
+                               column.label('text'),
+                               func.strpos(func.lower(column), fragment.lower()).label('position')])
+                       .where(and_(model.user_id == user_id,
+                                   column.ilike('%' + escaped + '%', escape='\\'))))
+    hits = union_all(*selects).alias('hits')
+    statement = select([hits.c.type, hits.c.id, hits.c.text]).order_by(
+        hits.c.position, func.length(hits.c.text), hits.c.type, hits.c.id).limit(limit)
+
+    savepoint = db.session.begin_nested()
+    try:
+        db.session.execute('SET LOCAL statement_timeout = {:d}'.format(int(timeout_ms)))
+        return db.session.execute(statement).fetchall()
+    finally:
+        savepoint.rollback()
+
+
+def search_snippets(model, ids, search_query):
+    """
+    Highlights the matching words of some buckets or activities
+    :param model: Bucket or Activity
+    :param ids:
+    :param search_query: query parsed with sqlalchemy_searchable.parse_search_query
+    :return: dict of id to highlighted text
+    """
+    if not ids:
+        return {}
+    regconfig = search_manager.options['regconfig']
+    text = model.bucket_name + ' ' + model.description if model is Bucket else model.description
+    rows = db.session.query(model.id, func.ts_headline(regconfig, text,
+                                                       func.to_tsquery(regconfig, search_query)))\
+        .filter(model.id.in_(ids)).all()
+    return dict(rows)
@@ -1,6 +1,11 @@
-from app.models import Bucket, Activity, User
-from flask import Blueprint, make_response, jsonify, request, session
-from app.utils import login_required
+from app.encoding import jsonify
+from app.models import Bucket, Activity, autocomplete_hits, search_hits, search_snippets, \
+    search_results
+from flask import Blueprint, make_response, request, g, current_app
+from app.utils import login_required, encode_cursor, decode_cursor, parse_fields
+from psycopg2.extensions import QueryCanceledError
+from sqlalchemy.exc import OperationalError
+from sqlalchemy_searchable import parse_search_query
 
 
 search = Blueprint('search', __name__, url_prefix='/api/v1')
@@ -10,17 +15,135 @@ search = Blueprint('search', __name__, url_prefix='/api/v1')
 @login_required
 def search_api():
     """
-    This end point is used to search for buckets and activities in the bucket
+    This end point is used to search for buckets and activities in the bucket.
+    Results are cached per user until the user's buckets or activities change
     :return: json response
     """
     query = request.args.get('q')
     if not query:
         return make_response(jsonify(error='Please enter search parameters'), 400)
 
-    email = session.get('user')
-    user = User.query.filter_by(email=email).first()
-    bucket_lists = Bucket.query.search(query).filter_by(user_id=user.id).all()
-    activities = Activity.query.search(query).filter_by(user_id=user.id).all()
-    bucket_obj = [bucket.serialize for bucket in bucket_lists]
-    activity_obj = [activity.serialize for activity in activities]
-    return make_response(jsonify(buckets=bucket_obj, activities=activity_obj))
+    try:
+        fields = parse_fields(Bucket, Activity)
+
+    except ValueError:
+        return make_response(jsonify(error='Please enter valid fields'), 400)
+
+    user = g.principal
+    options = tuple(sorted((name, value) for name, value in request.args.items() if name != 'q'))
+    key = search_results.key(user.id, (' '.join(query.lower().split()), options))
+    results = search_results.get(key)
+    cache_status = 'HIT'
+
+    if results is None:
+        cache_status = 'MISS'
+        if request.args.get('mode') == 'ranked':
+            try:
+                results = ranked_search(query, user, fields)
+
+            except ValueError:
+                return make_response(jsonify(error='Please enter a valid cursor or limit'), 400)
+        else:
+            bucket_lists = Bucket.query.search(query).filter_by(user_id=user.id)\
+                .options(Bucket.load_fields(fields)).all()
+            activities = Activity.query.search(query).filter_by(user_id=user.id)\
+                .options(Activity.load_fields(fields)).all()
+            results = dict(buckets=Bucket.serialize_many(bucket_lists, fields),
+                           activities=Activity.serialize_many(activities, fields))
+        search_results.set(key, results)
+
+    response = make_response(jsonify(**results))
+    response.headers['X-Cache'] = cache_status
+    return response
+
+
+@search.route('/search/autocomplete', methods=['GET'])
+@login_required
+def autocomplete_api():
+    """
+    This end point is used to suggest the bucket names and activity descriptions
+    containing what the user typed so far. It is meant to be called on every keystroke,
+    so the suggestions are capped and the lookup is cancelled when it is too slow
+    :return: json response
+    """
+    fragment = ' '.join(request.args.get('q', '').split())
+    config = current_app.config
+    try:
+        limit = int(request.args.get('limit') or config['AUTOCOMPLETE_MAX_RESULTS'])
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return make_response(jsonify(error='Please enter a valid limit'), 400)
+
+    limit = min(limit, config['AUTOCOMPLETE_MAX_RESULTS'])
+    if len(fragment) < config['AUTOCOMPLETE_MIN_LENGTH']:
+        return make_response(jsonify(suggestions=[], truncated=False))
+
+    user = g.principal
+    key = search_results.key(user.id, ('autocomplete', fragment.lower(), limit))
+    results = search_results.get(key)
+    cache_status = 'HIT'
+
+    if results is None:
+        cache_status = 'MISS'
+        try:
+            hits = autocomplete_hits(user.id, fragment, limit, config['AUTOCOMPLETE_TIMEOUT_MS'])
+            results = dict(suggestions=[dict(type=hit.type, id=hit.id, text=hit.text)
+                                        for hit in hits], truncated=False)
+            search_results.set(key, results)
+
+        except OperationalError as error:
+            # Only the lookups cancelled by the statement timeout are answered without
+            # suggestions, a database which is down is still an error
+            if not isinstance(error.orig, QueryCanceledError):
+                raise
+            results = dict(suggestions=[], truncated=True)
+
+    response = make_response(jsonify(**results))
+    response.headers['X-Cache'] = cache_status
+    return response
+
+
+def ranked_search(query, user, fields=None):
+    """
+    Used to search buckets and activities together, best matches first, a page at a time
+    :param query:
+    :param user:
+    :param fields: names of the fields to serialize, None for all of them
+    :return: hits of the page and the cursor of the next one
+    """
+    cursor = request.args.get('cursor')
+    limit = int(request.args.get('limit') or current_app.config['DEFAULT_PAGE_LIMIT'])
+    after = decode_cursor(cursor) if cursor else None
+    if limit < 1 or (after is not None and (not isinstance(after, list) or len(after) != 3)):
+        raise ValueError('Invalid cursor or limit')
+
+    limit = min(limit, current_app.config['SEARCH_MAX_LIMIT'])
+    search_query = parse_search_query(query)
+    if not search_query:
+        return dict(results=[], next_cursor='')
+
+    hits = search_hits(user.id, search_query, limit + 1, after)
+    next_cursor = ''
+    if len(hits) > limit:
+        hits = hits[:limit]
+        next_cursor = encode_cursor([hits[-1].rank, hits[-1].type, hits[-1].id])
+
+    serialized = {}
+    snippets = {}
+    highlight = request.args.get('highlight') == 'true'
+    for kind, model in [('bucket', Bucket), ('activity', Activity)]:
+        ids = [hit.id for hit in hits if hit.type == kind]
+        rows = model.query.filter(model.id.in_(ids)).options(model.load_fields(fields)).all() \
+            if ids else []
+        serialized[kind] = dict(zip([row.id for row in rows], model.serialize_many(rows, fields)))
+        if highlight:
+            snippets[kind] = search_snippets(model, ids, search_query)
+
+    results = []
+    for hit in hits:
+        result = {'type': hit.type, 'rank': hit.rank, hit.type: serialized[hit.type][hit.id]}
+        if highlight:
+            result['snippet'] = snippets[hit.type].get(hit.id)
+        results.append(result)
+    return dict(results=results, next_cursor=next_cursor)
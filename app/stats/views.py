@@ -0,0 +1,42 @@
+from app.encoding import jsonify
+from app.models import User, Bucket, Activity, user_stats
+from app.utils import login_required
+from flask import Blueprint, make_response, g, current_app
+
+
+stats = Blueprint('stats', __name__, url_prefix='/api/v1')
+
+
+@stats.route('/stats', methods=['GET'])
+@login_required
+def stats_api():
+    """
+    This end point is used to get the dashboard figures of the user: totals, buckets per
+    category, activities created per week and the buckets updated last.
+    Totals come from the counters and the rest is cached until the user's buckets or
+    activities change, so repeated calls do not scan the tables
+    :return: json response
+    """
+    user = g.principal
+    key = user_stats.key(user.id, 'stats')
+    results = user_stats.get(key)
+    cache_status = 'HIT'
+
+    if results is None:
+        cache_status = 'MISS'
+        config = current_app.config
+        bucket_count, activity_count = User.counters(user.id)
+        results = dict(
+            buckets=bucket_count,
+            activities=activity_count,
+            buckets_per_category=[dict(category=category, buckets=count) for category, count
+                                  in Bucket.count_by_category(user.id)],
+            activities_per_week=[dict(week=week.date(), activities=count) for week, count
+                                 in Activity.count_by_week(user.id, config['STATS_WEEKS'])],
+            recently_updated=Bucket.serialize_many(
+                Bucket.recently_updated(user.id, config['STATS_RECENT_BUCKETS'])))
+        user_stats.set(key, results)
+
+    response = make_response(jsonify(**results))
+    response.headers['X-Cache'] = cache_status
+    return response
@@ -0,0 +1,292 @@
+import datetime
+
+from app.encoding import dumps, jsonify
+from app.models import db, Bucket, Activity, Category, export_rows, invalidate_user_caches
+from app.utils import login_required, validate_text
+from flask import Blueprint, Response, make_response, g, current_app, json, request, \
+    stream_with_context
+
+
+transfer = Blueprint('transfer', __name__, url_prefix='/api/v1')
+
+TIMESTAMP_FORMATS = ['%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S']
+
+
+class InvalidLine(Exception):
+    """
+    Raised when a line of an import cannot be loaded
+    """
+
+    def __init__(self, number, message, status=400):
+        super(InvalidLine, self).__init__('Line %s: %s' % (number, message))
+        self.status = status
+
+
+def isoformat(value):
+    """
+    Used to format an optional timestamp
+    :param value: datetime or None
+    :return: str or None
+    """
+    return value.isoformat() if value is not None else None
+
+
+def parse_timestamp(number, value):
+    """
+    Used to read an optional timestamp of an imported line
+    :param number: number of the line
+    :param value: timestamp in the ISO format or None
+    :return: datetime or None
+    """
+    if value is None:
+        return None
+    for timestamp_format in TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(str(value), timestamp_format)
+        except ValueError:
+            pass
+    raise InvalidLine(number, 'Invalid timestamp %s' % value)
+
+
+class Importer(object):
+    """
+    Loads the lines of an import in batches, every batch being inserted with one statement
+    per table. Activities must follow the line of their bucket, so only the ids of the last
+    batch of buckets are kept and memory does not grow with the size of the import.
+    Nothing is committed, the caller commits once every line was loaded
+    """
+
+    def __init__(self, user_id, batch_size):
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.buckets = []
+        self.activities = []
+        self.bucket_names = set()
+        self.descriptions = set()
+        self.ids = set()
+        self.bucket_ids = {}
+        self.current = None
+        self.counts = dict(buckets=0, activities=0)
+
+    def add(self, number, line):
+        """
+        Used to add a line to the batch, loading the batch once full
+        :param number: number of the line
+        :param line: JSON object of a bucket or an activity
+        """
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            raise InvalidLine(number, 'Invalid JSON')
+
+        kind = entry.get('type') if isinstance(entry, dict) else None
+        if kind == 'bucket':
+            self.add_bucket(number, entry)
+        elif kind == 'activity':
+            self.add_activity(number, entry)
+        else:
+            raise InvalidLine(number, 'The type must be bucket or activity')
+
+        if len(self.buckets) + len(self.activities) >= self.batch_size:
+            self.flush()
+
+    @staticmethod
+    def timestamps(number, entry):
+        """
+        Used to read the timestamps of a line, missing ones being set to now
+        :param number:
+        :param entry:
+        :return: dict of created and updated
+        """
+        created = parse_timestamp(number, entry.get('created')) or datetime.datetime.now()
+        return dict(created=created,
+                    updated=parse_timestamp(number, entry.get('updated')) or created)
+
+    def add_bucket(self, number, entry):
+        """
+        Used to validate and add a bucket
+        :param number:
+        :param entry:
+        """
+        bucket_name = entry.get('bucket_name')
+        description = entry.get('description')
+        category = entry.get('category')
+
+        if not isinstance(bucket_name, str) or not validate_text(bucket_name) or \
+                len(bucket_name) > 70:
+            raise InvalidLine(number, 'Please enter a valid bucket name')
+
+        if not isinstance(description, str) or not validate_text(description) or \
+                len(description) > 100:
+            raise InvalidLine(number, 'Please enter a valid description')
+
+        if category is not None and (not isinstance(category, str) or
+                                     not validate_text(category) or len(category) > 70):
+            raise InvalidLine(number, 'Please enter a valid category')
+
+        if not isinstance(entry.get('id'), (int, str, type(None))):
+            raise InvalidLine(number, 'Please enter a valid id')
+
+        # Activities are attached through the ids so they must not repeat within a batch
+        if entry.get('id') is not None and (entry.get('id') in self.ids or
+                                            entry.get('id') in self.bucket_ids):
+            raise InvalidLine(number, 'The id of the bucket is repeated')
+
+        if bucket_name in self.bucket_names:
+            raise InvalidLine(number, 'Bucket name exists', 409)
+
+        row = dict(bucket_name=bucket_name, description=description,
+                   **self.timestamps(number, entry))
+        self.buckets.append((number, entry.get('id'), row, category))
+        self.bucket_names.add(bucket_name)
+        if entry.get('id') is not None:
+            self.ids.add(entry.get('id'))
+        self.current = entry.get('id')
+
+    def add_activity(self, number, entry):
+        """
+        Used to validate and add an activity
+        :param number:
+        :param entry:
+        """
+        description = entry.get('description')
+        bucket = entry.get('bucket_id')
+
+        if bucket is None or bucket != self.current:
+            raise InvalidLine(number, 'Activities must follow the line of their bucket')
+
+        if not isinstance(description, str) or not validate_text(description):
+            raise InvalidLine(number, 'Please describe your activity')
+
+        if (bucket, description) in self.descriptions:
+            raise InvalidLine(number, 'Activity exists with the same description', 409)
+
+        row = dict(description=description, **self.timestamps(number, entry))
+        self.activities.append((number, bucket, row))
+        self.descriptions.add((bucket, description))
+
+    def flush(self):
+        """
+        Used to load the batch: name collisions are looked up with one query, categories are
+        resolved together and each table gets one INSERT
+        """
+        existing = Bucket.find_duplicates(self.user_id, self.bucket_names)
+        for number, _, row, _ in self.buckets:
+            if row['bucket_name'] in existing:
+                raise InvalidLine(number, 'Bucket name exists', 409)
+
+        # The bucket carried over from the previous batch may already have these activities
+        for bucket, bucket_id in self.bucket_ids.items():
+            carried = [(number, row['description']) for number, activity_bucket, row
+                       in self.activities if activity_bucket == bucket]
+            existing = Activity.find_duplicates(bucket_id, self.user_id,
+                                                [description for _, description in carried])
+            for number, description in carried:
+                if description in existing:
+                    raise InvalidLine(number, 'Activity exists with the same description', 409)
+
+        category_ids = Category.get_ids([category for _, _, _, category in self.buckets
+                                         if category is not None])
+        created = Bucket.insert_many(self.user_id, [
+            dict(row, category_id=category_ids.get(category))
+            for _, _, row, category in self.buckets])
+        self.bucket_ids.update((bucket, created[row['bucket_name']])
+                               for _, bucket, row, _ in self.buckets)
+        Activity.insert_many(self.user_id, [dict(row, bucket_id=self.bucket_ids[bucket])
+                                            for _, bucket, row in self.activities])
+
+        self.counts['buckets'] += len(self.buckets)
+        self.counts['activities'] += len(self.activities)
+        self.bucket_ids = dict((bucket, bucket_id) for bucket, bucket_id in
+                               self.bucket_ids.items()
+                               if bucket is not None and bucket == self.current)
+        self.buckets, self.activities = [], []
+        self.bucket_names, self.descriptions, self.ids = set(), set(), set()
+
+
+@transfer.route('/export', methods=['GET'])
+@login_required
+def export_api():
+    """
+    This end point is used to download all the buckets and activities of the user as
+    newline delimited JSON, each bucket being followed by its activities.
+    Rows are read from a server side cursor and sent in chunks of STREAM_CHUNK_SIZE lines,
+    so memory does not grow with the size of the account
+    :return: streamed NDJSON response
+    """
+    chunk_size = current_app.config['STREAM_CHUNK_SIZE']
+    rows = export_rows(g.principal.id, chunk_size)
+
+    def generate():
+        lines = []
+        bucket_id = None
+        for row in rows:
+            if row.bucket_id != bucket_id:
+                bucket_id = row.bucket_id
+                lines.append(dumps(dict(type='bucket', id=row.bucket_id,
+                                        bucket_name=row.bucket_name,
+                                        description=row.description, category=row.category,
+                                        created=isoformat(row.created),
+                                        updated=isoformat(row.updated))))
+            if row.activity_id is not None:
+                lines.append(dumps(dict(type='activity', id=row.activity_id,
+                                        bucket_id=row.bucket_id,
+                                        description=row.activity_description,
+                                        created=isoformat(row.activity_created),
+                                        updated=isoformat(row.activity_updated))))
+            if len(lines) >= chunk_size:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename=bucketlists.ndjson'
+    return response
+
+
+@transfer.route('/import', methods=['POST'])
+@login_required
+def import_api():
+    """
+    This end point is used to load buckets and activities sent as newline delimited JSON,
+    in the format of the export. The body is read line by line and loaded in batches of
+    IMPORT_BATCH_SIZE rows within one transaction, so nothing is created when a line is
+    invalid
+    :return: json response with the number of buckets and activities created
+    """
+    user = g.principal
+    max_line = current_app.config['IMPORT_MAX_LINE_BYTES']
+    importer = Importer(user.id, current_app.config['IMPORT_BATCH_SIZE'])
+    number = 0
+    try:
+        while True:
+            line = request.stream.readline(max_line + 1)
+            if not line:
+                break
+
+            number += 1
+            if len(line) > max_line:
+                raise InvalidLine(number, 'Lines must be shorter than %s bytes' % max_line)
+
+            try:
+                line = line.decode('utf-8')
+            except UnicodeDecodeError:
+                raise InvalidLine(number, 'Invalid UTF-8')
+
+            if line.strip():
+                importer.add(number, line)
+
+        importer.flush()
+
+    except InvalidLine as error:
+        db.session.rollback()
+        return make_response(jsonify(dict(error=str(error))), error.status)
+
+    if not any(importer.counts.values()):
+        return make_response(jsonify(dict(error='Bad request. Please enter some data')), 400)
+
+    db.session.commit()
+    invalidate_user_caches(user.id)
+    return make_response(jsonify(dict(success='Import successful', **importer.counts)), 201)
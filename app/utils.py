@@ -1,8 +1,27 @@
+import hashlib
 import re
+import time
 
-from flask import session, make_response, jsonify, request
+from app import app
 
-from app.models import User
+from app.cache import LRUCache
+
+from app.encoding import jsonify, list_framing, pretty_print
+
+from app.models import db, User
+
+from collections import namedtuple
+
+from flask_sqlalchemy import Pagination
+
+from flask import session, make_response, request, current_app, g, Response, \
+    stream_with_context
+
+from itsdangerous import URLSafeSerializer, BadSignature
+
+from sqlalchemy import event
+
+from werkzeug.urls import url_encode
 
 from functools import wraps
 
@@ -45,32 +64,133 @@ def send_mail(recipient, password):
         return False
 
 
+Principal = namedtuple('Principal', ['id', 'email', 'is_active'])
+
+principals = LRUCache(app.config['AUTH_CACHE_SIZE'], app.config['AUTH_CACHE_TTL'])
+
+
+@event.listens_for(User.__table__, 'after_drop')
+def clear_principals(*args, **kwargs):
+    """
+    This function is used to empty the principal cache when the users are dropped
+    """
+    principals.clear()
+
+
+def get_principal(token=None, email=None):
+    """
+    This function is used to get the authenticated user of a token or a session email.
+    Verified principals are cached, so authenticated requests do not query the database
+    :param token:
+    :param email:
+    :return: Principal or None
+    """
+    key = ('token', token) if token else ('email', email)
+    principal = principals.get(key)
+    if principal is not None:
+        return principal
+
+    ttl = None
+    query = db.session.query(User.id, User.email, User.is_active)
+    if token:
+        data = User.decode_token(token)
+        if data is None:
+            return None
+        ttl = data['exp'] - time.time()
+        row = query.filter_by(id=data['id']).first()
+    else:
+        row = query.filter_by(email=email).first()
+
+    if row is None:
+        return None
+
+    principal = Principal(*row)
+    principals.set(key, principal, ttl=ttl)
+    return principal
+
+
+def forget_principal(user_id=None, token=None, email=None):
+    """
+    This function is used to invalidate cached principals.
+    It must be called whenever a user logs out, changes password or is deleted
+    :param user_id: removes every cached principal of that user
+    :param token:
+    :param email:
+    """
+    if token:
+        principals.pop(('token', token))
+
+    if email:
+        principals.pop(('email', email))
+
+    if user_id is not None:
+        principals.discard_where(lambda principal: principal.id == user_id)
+
+
 def login_required(func):
     """
-    This function is used to check the login status of a user
+    This function is used to check the login status of a user.
+    The authenticated user is shared with the view as g.principal
     :param func:
     :return: login status
     """
     @wraps(func)
     def check_login_status(*args, **kwargs):
-        if 'token' in request.headers or 'user' in session:
-            email = session.get('user')
-            token = request.headers.get('token')
-            if token and not email:
-                if User.verify_token(token) is None:
-                    return make_response(jsonify(dict(error='Invalid session or token. Please '
-                                                            'login')), 403)
-                else:
-                    session['user'] = User.verify_token(token).email
-
-            if email and not token:
-                User.query.filter_by(email=email).first()
-        else:
+        email = session.get('user')
+        token = request.headers.get('token')
+
+        if not any([email, token]):
             return make_response(jsonify(error='Unauthorised. Please login'), 403)
+
+        if email:
+            principal = get_principal(email=email)
+        else:
+            principal = get_principal(token=token)
+
+        if principal is None or principal.is_active is False:
+            return make_response(jsonify(dict(error='Invalid session or token. Please '
+                                                    'login')), 403)
+
+        if not email:
+            session['user'] = principal.email
+        g.principal = principal
         return func(*args, **kwargs)
     return check_login_status
 
 
+def conditional(fingerprint):
+    """
+    This function is used to answer conditional GETs of the logged in user.
+    The weak ETag is derived from cheap aggregates of the rows the view reads and from the
+    query string, so a matching If-None-Match gets a 304 before any row is loaded
+    :param fingerprint: callable taking the user id and the view's keyword arguments, returning
+    the aggregates or None to always run the view
+    :return: decorator
+    """
+    def decorator(func):
+        @wraps(func)
+        def check_etag(*args, **kwargs):
+            state = fingerprint(g.principal.id, **kwargs)
+            if state is None:
+                return func(*args, **kwargs)
+
+            etag = hashlib.sha1(repr((g.principal.id, state, request.full_path))
+                                .encode('utf-8')).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = func(*args, **kwargs)
+
+            if response.status_code in (200, 304):
+                response.set_etag(etag, weak=True)
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+                response.vary.update(['Cookie', 'token'])
+            return response
+        return check_etag
+    return decorator
+
+
 def validate_text(value):
     """
     This function is used to validate the nature of text that is passed to the function
@@ -81,3 +201,143 @@ def validate_text(value):
     if len(stripped_value) == 0:
         return False
     return True
+
+
+def encode_cursor(value):
+    """
+    This function is used to build an opaque pagination cursor from the position of the last
+    seen row
+    :param value: JSON serializable position
+    :return: cursor
+    """
+    key = URLSafeSerializer(current_app.config['SECRET_KEY'], salt='cursor')
+    return key.dumps(value)
+
+
+def decode_cursor(cursor):
+    """
+    This function is used to get the position of the last seen row back from a cursor
+    :param cursor:
+    :return: position
+    """
+    key = URLSafeSerializer(current_app.config['SECRET_KEY'], salt='cursor')
+    try:
+        return key.loads(cursor)
+
+    except BadSignature:
+        raise ValueError('Invalid cursor')
+
+
+def paginate_after(query, column, cursor, limit):
+    """
+    This function is used to get a page of results using keyset pagination.
+    The rows are ordered by a unique indexed column and the page starts after the row the
+    cursor points to, so each page is a single range scan without any OFFSET or COUNT
+    :param query:
+    :param column: unique column to order by
+    :param cursor: cursor returned with the previous page, empty for the first page
+    :param limit:
+    :return: list of rows and the cursor of the next page
+    """
+    if limit < 1:
+        raise ValueError('Invalid limit')
+
+    if cursor:
+        last_seen = decode_cursor(cursor)
+        if not isinstance(last_seen, int):
+            raise ValueError('Invalid cursor')
+        query = query.filter(column > last_seen)
+
+    items = query.order_by(column).limit(limit + 1).all()
+    next_cursor = ''
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(getattr(items[-1], column.key))
+    return items, next_cursor
+
+
+def paginate(query, page, limit, total):
+    """
+    This function is used to get a page of a query whose number of rows is already known,
+    sparing the COUNT(*) of Query.paginate. Invalid numbers are handled as paginate does
+    when error_out is False
+    :param query:
+    :param page:
+    :param limit:
+    :param total: number of rows of the query
+    :return: pagination
+    """
+    page = max(page, 1)
+    if limit < 0:
+        limit = 20
+    items = query.limit(limit).offset((page - 1) * limit).all()
+    return Pagination(query, page, limit, total, items)
+
+
+def parse_fields(*models):
+    """
+    This function is used to read the fields query parameter, a comma separated list of the
+    serialized fields wanted
+    :param models: models whose FIELDS can be asked for
+    :return: list of field names, None when all the fields are wanted
+    :raises ValueError: when a field is unknown
+    """
+    value = request.args.get('fields')
+    if value is None:
+        return None
+
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    known = set()
+    for model in models:
+        known.update(model.FIELDS)
+    if not fields or not known.issuperset(fields):
+        raise ValueError('Invalid fields')
+    return fields
+
+
+def page_url(name, value, limit):
+    """
+    This function is used to build the url of another page of a listing, keeping the
+    fields asked for
+    :param name: page or cursor
+    :param value:
+    :param limit:
+    :return: url
+    """
+    url = request.base_url + '?' + name + '=' + str(value) + '&limit=' + str(limit)
+    if 'fields' in request.args:
+        url += '&' + url_encode(dict(fields=request.args['fields']))
+    return url
+
+
+def stream_json(key, query, serialize_many):
+    """
+    This function is used to stream a JSON object holding a list of serialized rows.
+    Rows are read from a server side cursor in chunks of STREAM_CHUNK_SIZE and each chunk is
+    serialized and sent before the next one is fetched, so memory does not grow with the
+    number of rows. The bytes are the ones jsonify would write for the whole list
+    :param key: name of the list in the JSON object
+    :param query:
+    :param serialize_many: callable serializing a list of rows
+    :return: streamed response
+    """
+    chunk_size = current_app.config['STREAM_CHUNK_SIZE']
+    rows = query.execution_options(stream_results=True).yield_per(chunk_size)
+    opening, separator, closing, empty, encode = list_framing(key, pretty_print())
+
+    def generate():
+        prefix = opening
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield prefix + separator.join(encode(obj) for obj in serialize_many(chunk))
+                prefix = separator
+                chunk = []
+
+        if chunk:
+            yield prefix + separator.join(encode(obj) for obj in serialize_many(chunk))
+            prefix = separator
+        yield closing if prefix == separator else empty
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
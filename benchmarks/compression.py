@@ -0,0 +1,65 @@
+"""
+Measures the bytes sent and the CPU time spent for the bucket listings under each encoding
+"""
+import time
+
+from app import app
+from app.compression import brotli
+from app.models import User
+
+from benchmarks.deletion import seed_account
+
+
+def measure(client, url, encoding, repeats):
+    """
+    Requests a url a number of times
+    :param client: logged in test client
+    :param url:
+    :param encoding: value of the Accept-Encoding header
+    :param repeats:
+    :return: bytes of the body and mean CPU seconds per request
+    """
+    start = time.process_time()
+    for _ in range(repeats):
+        response = client.get(url, headers={'Accept-Encoding': encoding})
+        body = response.data
+    return len(body), (time.process_time() - start) / repeats
+
+
+def run(sizes, levels, repeats=5):
+    """
+    Prints the size and CPU cost of the paginated and streamed bucket listings
+    :param sizes: numbers of buckets listed
+    :param levels: gzip levels compared
+    :param repeats: requests timed per measure
+    """
+    settings = [('identity', 'COMPRESS_LEVEL', 0)]
+    settings.extend(('gzip', 'COMPRESS_LEVEL', level) for level in levels)
+    if brotli is not None:
+        settings.extend(('br', 'COMPRESS_BROTLI_QUALITY', quality) for quality in levels)
+    saved = dict((name, app.config[name]) for _, name, _ in settings)
+
+    print('%8s %9s %10s %12s %7s %14s %14s' % ('buckets', 'listing', 'encoding', 'bytes',
+                                               'ratio', 'CPU/req (ms)', 'extra CPU (ms)'))
+    try:
+        for size in sizes:
+            email, _, _ = seed_account(size, 0)
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['user'] = email
+
+            for listing, url in [('paginated', '/api/v1/bucketlists/?limit=%s' % size),
+                                 ('streamed', '/api/v1/bucketlists/')]:
+                measure(client, url, 'identity', 1)
+                plain_bytes, plain_cpu = measure(client, url, 'identity', repeats)
+                for encoding, name, level in settings:
+                    app.config[name] = level
+                    size_bytes, cpu = measure(client, url, encoding, repeats)
+                    label = encoding if encoding == 'identity' else '%s-%s' % (encoding, level)
+                    print('%8s %9s %10s %12s %7.2f %14.2f %14.2f' % (
+                        size, listing, label, size_bytes, plain_bytes / size_bytes, cpu * 1000,
+                        (cpu - plain_cpu) * 1000))
+            User.delete(email)
+
+    finally:
+        app.config.update(saved)
@@ -0,0 +1,70 @@
+"""
+Times the deletion of buckets and accounts against the number of rows they own
+"""
+import time
+import uuid
+
+from app.models import db, User, Bucket, Activity
+
+
+def insert_rows(table, rows, batch_size=1000):
+    """
+    Inserts rows with multi-row INSERT statements
+    :param table:
+    :param rows:
+    :param batch_size:
+    :return: inserted ids
+    """
+    ids = []
+    for start in range(0, len(rows), batch_size):
+        statement = table.insert().values(rows[start:start + batch_size]).returning(table.c.id)
+        ids.extend(row.id for row in db.session.execute(statement))
+    db.session.commit()
+    return ids
+
+
+def seed_account(buckets, activities):
+    """
+    Creates a user owning a number of buckets, the activities being spread across them
+    :param buckets:
+    :param activities:
+    :return: user email and bucket ids
+    """
+    email = 'bench-%s@example.com' % uuid.uuid4().hex[:12]
+    user = User(email=email, password='benchmark').save()
+    bucket_ids = insert_rows(Bucket.__table__, [
+        dict(bucket_name='Bucket %s' % index, description='Benchmark', user_id=user.id)
+        for index in range(buckets)])
+    insert_rows(Activity.__table__, [
+        dict(description='Activity %s' % index, user_id=user.id,
+             bucket_id=bucket_ids[index % len(bucket_ids)])
+        for index in range(activities)])
+    return email, user.id, bucket_ids
+
+
+def timed(func, *args):
+    """
+    Runs a function
+    :return: elapsed seconds
+    """
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def run(sizes):
+    """
+    Prints how long deleting a bucket and an account take as their number of children grows
+    :param sizes: numbers of activities to delete
+    """
+    print('%10s %10s %18s %18s' % ('activities', 'buckets', 'delete bucket (s)',
+                                   'delete account (s)'))
+    for size in sizes:
+        email, user_id, bucket_ids = seed_account(1, size)
+        bucket_time = timed(Bucket.delete, bucket_ids[0], user_id)
+        User.delete(email)
+
+        buckets = max(1, size // 10)
+        email, _, _ = seed_account(buckets, size)
+        account_time = timed(User.delete, email)
+        print('%10s %10s %18.4f %18.4f' % (size, buckets, bucket_time, account_time))
@@ -0,0 +1,52 @@
+"""
+Times the encoding of bucket listings with flask's jsonify and each JSON backend
+"""
+import datetime
+import time
+
+from app import app
+from app.encoding import BACKENDS, jsonify
+
+from flask import jsonify as flask_jsonify
+
+
+def bucket_rows(count):
+    """
+    Builds serialized buckets as Bucket.serialize_many returns them
+    :param count:
+    :return: list of dicts
+    """
+    now = datetime.datetime.now()
+    return [dict(id=index, bucket_name='Bucket %s' % index, created=now.date(),
+                 user='bench@example.com', description='Benchmark bucket', updated=now,
+                 category='Category %s' % (index % 50))
+            for index in range(count)]
+
+
+def run(sizes, repeats=5):
+    """
+    Prints the mean time taken to encode a compact listing and whether the bytes match
+    flask's jsonify
+    :param sizes: numbers of buckets encoded
+    :param repeats: encodings timed per measure
+    """
+    saved = dict((name, app.config[name])
+                 for name in ['JSON_BACKEND', 'JSONIFY_PRETTYPRINT_REGULAR'])
+    app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+    encoders = [('flask', flask_jsonify)] + [(name, jsonify) for name in sorted(BACKENDS)]
+    print('%8s %10s %12s %12s %10s' % ('buckets', 'encoder', 'bytes', 'time (ms)', 'identical'))
+    try:
+        with app.test_request_context('/'):
+            for size in sizes:
+                rows = bucket_rows(size)
+                expected = flask_jsonify(buckets=rows).get_data()
+                for name, encoder in encoders:
+                    app.config['JSON_BACKEND'] = name
+                    start = time.perf_counter()
+                    for _ in range(repeats):
+                        body = encoder(buckets=rows).get_data()
+                    elapsed = (time.perf_counter() - start) / repeats
+                    print('%8s %10s %12s %12.2f %10s' % (size, name, len(body),
+                                                         elapsed * 1000, body == expected))
+    finally:
+        app.config.update(saved)
@@ -0,0 +1,276 @@
+"""
+Measures the throughput and latency percentiles of every route for users owning a growing
+number of buckets and activities, and compares them against a baseline
+"""
+import datetime
+import importlib
+import json
+import math
+import time
+import uuid
+
+from app import app
+from app.hashing import hashing
+from app.models import User, Bucket, Activity
+
+from benchmarks.deletion import insert_rows, seed_account
+
+PASSWORD = 'benchmark'
+
+# The blueprint is bound to app.auth, so the module of the views is looked up by its name
+auth_views = importlib.import_module('app.auth.views')
+
+
+def login(client, email):
+    """
+    Used to log a test client in
+    :param client:
+    :param email:
+    """
+    with client.session_transaction() as sess:
+        sess['user'] = email
+
+
+def scenarios(email, user_id, bucket_ids, item_id, emails):
+    """
+    Builds the requests sent to every route. Routes which log out, delete or change a row
+    are sent a fresh user or row before each request, so every request does the same work
+    :param email: email of the user
+    :param user_id: id of the user
+    :param bucket_ids: ids of the buckets of the user
+    :param item_id: id of an activity of the first bucket
+    :param emails: list the emails of the users created are added to
+    :return: list of (name, method, url, body, prepare) where url and body are callables
+    taking the number of the request, and prepare, when given, is called with the client
+    and the number before the request and is not timed
+    """
+    buckets = '/api/v1/bucketlists/'
+    bucket = buckets + str(bucket_ids[-1])
+    items = buckets + str(bucket_ids[0]) + '/items'
+    item = items + '/' + str(item_id)
+    password_hash = hashing.generate_password_hash(PASSWORD)
+    fresh = {}
+
+    def fixed(value):
+        return lambda number: value
+
+    def new_email():
+        emails.append('bench-%s@example.com' % uuid.uuid4().hex[:12])
+        return emails[-1]
+
+    def relogin(client, number):
+        login(client, email)
+
+    def new_user(client, number):
+        fresh['email'] = new_email()
+        insert_rows(User.__table__, [dict(email=fresh['email'], _password=password_hash,
+                                          is_active=True)])
+        login(client, fresh['email'])
+
+    def new_bucket(client, number):
+        fresh['bucket'], = insert_rows(Bucket.__table__, [dict(
+            bucket_name='Deleted %s' % number, description='Benchmark', user_id=user_id)])
+
+    def new_item(client, number):
+        fresh['item'], = insert_rows(Activity.__table__, [dict(
+            description='Deleted item %s' % number, user_id=user_id, bucket_id=bucket_ids[0])])
+
+    def ndjson(number):
+        lines = [dict(type='bucket', id=1, bucket_name='Imported %s' % number,
+                      description='Benchmark')]
+        lines.extend(dict(type='activity', bucket_id=1, description='Imported item %s' % index)
+                     for index in range(50))
+        return '\n'.join(json.dumps(line) for line in lines)
+
+    return [
+        ('register', 'post', fixed('/api/v1/auth/register'),
+         lambda number: dict(email=new_email(), password=PASSWORD, confirm_password=PASSWORD),
+         None),
+        ('login', 'post', fixed('/api/v1/auth/login'),
+         fixed(dict(email=email, password=PASSWORD)), None),
+        ('logout', 'post', fixed('/api/v1/auth/logout'), None, relogin),
+        ('reset password', 'post', fixed('/api/v1/auth/reset_password'),
+         lambda number: dict(email=fresh['email']), new_user),
+        ('change password', 'put', fixed('/api/v1/auth/change_password'),
+         fixed(dict(old_password=PASSWORD, new_password=PASSWORD,
+                    confirm_password=PASSWORD)), new_user),
+        ('delete account', 'delete', fixed('/api/v1/auth/delete_account'),
+         fixed(dict(password=PASSWORD)), new_user),
+        ('callback', 'get', fixed('/api/v1/callback'), None, None),
+        ('list buckets page', 'get', fixed(buckets + '?page=1&limit=20'), None, None),
+        ('list buckets cursor', 'get', fixed(buckets + '?cursor=&limit=20'), None, None),
+        ('list buckets streamed', 'get', fixed(buckets), None, None),
+        ('get bucket', 'get', fixed(bucket), None, None),
+        ('create bucket', 'post', fixed(buckets),
+         lambda number: dict(bucket_name='Created %s' % number, description='Benchmark',
+                             category='Category %s' % (number % 10)), None),
+        ('update bucket', 'put', fixed(bucket),
+         lambda number: dict(bucket_name='Updated %s' % number, description='Benchmark'),
+         None),
+        ('bulk create buckets', 'post', fixed(buckets + 'bulk'),
+         lambda number: [dict(bucket_name='Bulk %s %s' % (number, index),
+                              description='Benchmark') for index in range(50)], None),
+        ('delete bucket', 'delete', lambda number: buckets + str(fresh['bucket']), None,
+         new_bucket),
+        ('list items page', 'get', fixed(items + '?page=1&limit=20'), None, None),
+        ('list items cursor', 'get', fixed(items + '?cursor=&limit=20'), None, None),
+        ('list items streamed', 'get', fixed(items), None, None),
+        ('get item', 'get', fixed(item), None, None),
+        ('create item', 'post', fixed(items),
+         lambda number: dict(description='Created item %s' % number), None),
+        ('update item', 'put', fixed(item),
+         lambda number: dict(description='Updated item %s' % number), None),
+        ('bulk create items', 'post', fixed(items + '/bulk'),
+         lambda number: [dict(description='Bulk item %s %s' % (number, index))
+                         for index in range(50)], None),
+        ('delete item', 'delete', lambda number: items + '/' + str(fresh['item']), None,
+         new_item),
+        ('search', 'get', fixed('/api/v1/search?q=activity'), None, None),
+        ('ranked search', 'get', fixed('/api/v1/search?q=activity&mode=ranked&limit=20'),
+         None, None),
+        ('autocomplete', 'get', lambda number: '/api/v1/search/autocomplete?q=activity %s' %
+         number, None, None),
+        ('stats', 'get', fixed('/api/v1/stats'), None, None),
+        ('export', 'get', fixed('/api/v1/export'), None, None),
+        ('import', 'post', fixed('/api/v1/import'), ndjson, None),
+        ('health', 'get', fixed('/api/v1/health'), None, None),
+    ]
+
+
+def percentile(latencies, rank):
+    """
+    Used to get a percentile with the nearest rank method
+    :param latencies: sorted list
+    :param rank: 0 to 100
+    :return: value
+    """
+    return latencies[max(0, int(math.ceil(rank / 100.0 * len(latencies))) - 1)]
+
+
+def measure(client, method, url, body, prepare, requests):
+    """
+    Sends a request a number of times, after one unmeasured request
+    :param client: logged in test client
+    :param method:
+    :param url: callable taking the number of the request
+    :param body: callable taking the number of the request, or None. Bodies given as str
+    are sent as NDJSON, the others as JSON
+    :param prepare: callable taking the client and the number of the request, or None
+    :param requests:
+    :return: dict of the throughput, latency percentiles and status codes
+    """
+    latencies = []
+    statuses = set()
+    for number in range(requests + 1):
+        if prepare is not None:
+            prepare(client, number)
+        data = None if body is None else body(number)
+        if data is None:
+            kwargs = {}
+        elif isinstance(data, str):
+            kwargs = dict(data=data, content_type='application/x-ndjson')
+        else:
+            kwargs = dict(data=json.dumps(data), content_type='application/json')
+        start = time.perf_counter()
+        response = getattr(client, method)(url(number), **kwargs)
+        response.data
+        elapsed = time.perf_counter() - start
+        statuses.add(response.status_code)
+        if number:
+            latencies.append(elapsed)
+
+    latencies.sort()
+    return dict(requests=requests, throughput=round(requests / sum(latencies), 2),
+                p50_ms=round(percentile(latencies, 50) * 1000, 3),
+                p95_ms=round(percentile(latencies, 95) * 1000, 3),
+                p99_ms=round(percentile(latencies, 99) * 1000, 3),
+                statuses=sorted(statuses))
+
+
+def send_mail(recipient, password):
+    """
+    Stands for app.utils.send_mail while benchmarking, so resetting a password neither
+    sends an email nor times the mail server
+    :return: True
+    """
+    return True
+
+
+def run(sizes, requests, output=None, baseline=None, tolerance=0.2):
+    """
+    Prints the throughput and latencies of every route for each size, saves them as JSON
+    and compares them against a baseline saved the same way. No email is sent
+    :param sizes: numbers of buckets and of activities of the user
+    :param requests: requests measured per route
+    :param output: file the results are saved to
+    :param baseline: file of the results compared against
+    :param tolerance: share by which a latency may grow, or a throughput drop, before being
+    reported as a regression
+    :return: list of the regressions
+    """
+    results = []
+    print('%8s %22s %10s %10s %10s %10s %8s' % ('rows', 'route', 'req/s', 'p50 (ms)',
+                                                'p95 (ms)', 'p99 (ms)', 'status'))
+    for size in sizes:
+        email, user_id, bucket_ids = seed_account(size, 0)
+        item_ids = insert_rows(Activity.__table__, [
+            dict(description='Activity %s' % index, user_id=user_id, bucket_id=bucket_ids[0])
+            for index in range(size)])
+        emails = [email]
+        sent_mail, auth_views.send_mail = auth_views.send_mail, send_mail
+
+        try:
+            for name, method, url, body, prepare in scenarios(email, user_id, bucket_ids,
+                                                              item_ids[0], emails):
+                client = app.test_client()
+                login(client, email)
+                result = measure(client, method, url, body, prepare, requests)
+                result.update(rows=size, route=name)
+                results.append(result)
+                print('%8s %22s %10.1f %10.2f %10.2f %10.2f %8s' % (
+                    size, name, result['throughput'], result['p50_ms'], result['p95_ms'],
+                    result['p99_ms'], ','.join(str(status) for status in result['statuses'])))
+        finally:
+            for created in emails:
+                User.delete(created)
+            auth_views.send_mail = sent_mail
+
+    if output:
+        with open(output, 'w') as results_file:
+            json.dump(dict(date=datetime.datetime.now().isoformat(), requests=requests,
+                           results=results), results_file, indent=2, sort_keys=True)
+
+    regressions = []
+    if baseline:
+        regressions = compare(results, baseline, tolerance)
+    return regressions
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints how the results compare with a baseline
+    :param results: list of results
+    :param baseline: file of the baseline results
+    :param tolerance:
+    :return: list of the (rows, route) which regressed
+    """
+    with open(baseline) as baseline_file:
+        previous = dict(((result['rows'], result['route']), result)
+                        for result in json.load(baseline_file)['results'])
+
+    regressions = []
+    print('\n%8s %22s %14s %14s' % ('rows', 'route', 'p95 change', 'req/s change'))
+    for result in results:
+        before = previous.get((result['rows'], result['route']))
+        if before is None:
+            continue
+
+        latency = result['p95_ms'] / before['p95_ms'] - 1
+        throughput = result['throughput'] / before['throughput'] - 1
+        regressed = latency > tolerance or throughput < -tolerance
+        if regressed:
+            regressions.append((result['rows'], result['route']))
+        print('%8s %22s %+13.1f%% %+13.1f%%%s' % (result['rows'], result['route'],
+                                                  latency * 100, throughput * 100,
+                                                  '  REGRESSION' if regressed else ''))
+    return regressions
@@ -0,0 +1,236 @@
+"""
+Generates users, categories, buckets and activities in bulk for the benchmarks and load tests.
+The same seed always generates the same rows. They are loaded with COPY on Postgres and with
+multi-row INSERT statements on the other databases
+"""
+import csv
+import datetime
+import io
+import random
+
+from app.hashing import hashing
+from app.models import db, User, Bucket, Activity, Category, repair_counters
+
+from sqlalchemy import func
+
+FIRST_NAMES = ['Amina', 'Brian', 'Carmen', 'David', 'Esther', 'Felix', 'Grace', 'Hassan',
+               'Irene', 'James', 'Kamau', 'Lucy', 'Mohamed', 'Njeri', 'Omar', 'Priya', 'Quentin',
+               'Rose', 'Samuel', 'Tanya', 'Umar', 'Violet', 'Wanjiru', 'Xavier', 'Yusuf', 'Zoe']
+LAST_NAMES = ['Achieng', 'Baker', 'Chen', 'Diaz', 'Evans', 'Fischer', 'Gitau', 'Hughes',
+              'Ito', 'Johnson', 'Kimani', 'Lopez', 'Mwangi', 'Nakamura', 'Otieno', 'Patel',
+              'Rossi', 'Smith', 'Tanaka', 'Wafula']
+CATEGORIES = ['Travel', 'Adventure', 'Career', 'Education', 'Family', 'Finance', 'Fitness',
+              'Food', 'Health', 'Hobbies', 'Music', 'Nature', 'Reading', 'Relationships',
+              'Spirituality', 'Sports', 'Volunteering']
+VERBS = ['Visit', 'Learn', 'Climb', 'Run', 'Cook', 'Photograph', 'Explore', 'Read', 'Build',
+         'Swim in', 'Write about', 'Cycle across', 'Camp at', 'Paint', 'Sail to']
+PLACES = ['Mount Kenya', 'the Maasai Mara', 'Kyoto', 'Patagonia', 'Lake Turkana', 'Iceland',
+          'the Amazon', 'Zanzibar', 'the Alps', 'Cape Town', 'New York', 'the Sahara',
+          'Lamu', 'Bali', 'Machu Picchu', 'the Great Barrier Reef', 'Lisbon', 'Istanbul']
+THINGS = ['a marathon', 'Spanish', 'the guitar', 'a sourdough loaf', 'a treehouse', 'a novel',
+          'pottery', 'chess', 'scuba diving', 'a vegetable garden', 'sign language',
+          'the northern lights', 'a startup', 'a half ironman', 'ballroom dancing']
+REASONS = ['Dreamt of it since childhood', 'Promised my family', 'Before I turn forty',
+           'With my closest friends', 'Once the loan is paid off', 'For the photographs',
+           'To prove I can', 'During the next long holiday', 'Recommended by a colleague']
+STEPS = ['Book the flights', 'Save %s dollars', 'Buy the gear', 'Train for %s weeks',
+         'Find a guide', 'Read %s reviews', 'Ask %s friends to join', 'Get a visa',
+         'Take %s lessons', 'Plan the route', 'Set a date', 'Write down %s ideas']
+
+START = datetime.datetime(2017, 1, 1)
+
+
+def bucket_name(rng, number):
+    """
+    Used to generate a bucket name, unique among the buckets of a user
+    :param rng: random.Random
+    :param number: number of the bucket of the user
+    :return: str
+    """
+    if rng.random() < 0.5:
+        return '%s %s %s' % (rng.choice(VERBS), rng.choice(PLACES), number)
+    return 'Try %s %s' % (rng.choice(THINGS), number)
+
+
+def step(rng, number):
+    """
+    Used to generate the description of an activity, unique among the activities of a bucket
+    :param rng: random.Random
+    :param number: number of the activity of the bucket
+    :return: str
+    """
+    description = rng.choice(STEPS)
+    if '%s' in description:
+        description %= rng.randint(2, 500)
+    return '%s %s' % (description, number)
+
+
+def generate(seed, users, buckets, activities, password_hash, first_ids):
+    """
+    Generates the rows of every table. They are built while being consumed, so millions of
+    rows can be generated without holding them in memory
+    :param seed: seed of the random generator
+    :param users: number of users
+    :param buckets: number of buckets of every user
+    :param activities: number of activities of every bucket
+    :param password_hash: hash of the password shared by all the users
+    :param first_ids: dict of table name to the first id given to its rows, and of the
+    category names to their ids
+    :return: dict of table name to (columns, iterable of rows)
+    """
+    category_ids = [first_ids['categories'][name] for name in CATEGORIES]
+
+    def user_rows():
+        # The emails hold the ids so seeding twice does not collide
+        rng = random.Random('%s-users' % seed)
+        for index in range(users):
+            user_id = first_ids['user'] + index
+            yield (user_id, 'seed%s-user%s@example.com' % (seed, user_id), password_hash,
+                   rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES),
+                   START + datetime.timedelta(days=rng.randint(0, 365)), True)
+
+    def bucket_rows():
+        rng = random.Random('%s-buckets' % seed)
+        for index in range(users * buckets):
+            created = START + datetime.timedelta(days=rng.randint(0, 730),
+                                                 seconds=rng.randint(0, 86399))
+            yield (first_ids['bucket'] + index, bucket_name(rng, index % buckets + 1),
+                   rng.choice(category_ids) if rng.random() < 0.9 else None, created,
+                   created + datetime.timedelta(days=rng.randint(0, 60)),
+                   first_ids['user'] + index // buckets, rng.choice(REASONS))
+
+    def activity_rows():
+        rng = random.Random('%s-activities' % seed)
+        for index in range(users * buckets * activities):
+            bucket = index // activities
+            created = START + datetime.timedelta(days=rng.randint(0, 790),
+                                                 seconds=rng.randint(0, 86399))
+            yield (first_ids['activity'] + index, step(rng, index % activities + 1),
+                   first_ids['bucket'] + bucket, first_ids['user'] + bucket // buckets, created,
+                   created + datetime.timedelta(days=rng.randint(0, 30)))
+
+    return dict(
+        user=(['id', 'email', '_password', 'first_name', 'last_name', 'date_joined',
+               'is_active'], user_rows()),
+        bucket=(['id', 'bucket_name', 'category_id', 'created', 'updated', 'user_id',
+                 'description'], bucket_rows()),
+        activity=(['id', 'description', 'bucket_id', 'user_id', 'created', 'updated'],
+                  activity_rows()))
+
+
+def batches(rows, size):
+    """
+    Used to split rows in lists
+    :param rows: iterable
+    :param size: rows per list
+    :return: generator of lists
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def copy_rows(table, columns, rows, batch_size):
+    """
+    Loads rows with COPY in the transaction of the session
+    :param table:
+    :param columns:
+    :param rows: iterable of tuples
+    :param batch_size: rows sent per COPY statement
+    :return: number of rows
+    """
+    preparer = db.engine.dialect.identifier_preparer
+    statement = 'COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (
+        preparer.format_table(table), ', '.join(preparer.quote(column) for column in columns))
+    cursor = db.session.connection().connection.cursor()
+    count = 0
+    for batch in batches(rows, batch_size):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in batch:
+            writer.writerow(['\\x' + value.hex() if isinstance(value, bytes) else value
+                             for value in row])
+        buffer.seek(0)
+        cursor.copy_expert(statement, buffer)
+        count += len(batch)
+    return count
+
+
+def insert_rows(table, columns, rows, batch_size):
+    """
+    Loads rows with multi-row INSERT statements in the transaction of the session
+    :param table:
+    :param columns:
+    :param rows: iterable of tuples
+    :param batch_size: rows sent per statement
+    :return: number of rows
+    """
+    count = 0
+    for batch in batches(rows, batch_size):
+        db.session.execute(table.insert().values([dict(zip(columns, row)) for row in batch]))
+        count += len(batch)
+    return count
+
+
+def seed_categories():
+    """
+    Creates the missing categories
+    :return: dict of category name to id
+    """
+    existing = dict(db.session.query(Category.category_name, Category.id)
+                    .filter(Category.category_name.in_(CATEGORIES)))
+    missing = [name for name in CATEGORIES if name not in existing]
+    if missing:
+        db.session.execute(Category.__table__.insert().values(
+            [dict(category_name=name) for name in missing]))
+        existing.update(db.session.query(Category.category_name, Category.id)
+                        .filter(Category.category_name.in_(missing)))
+    return existing
+
+
+def run(seed, users, buckets, activities, password, batch_size=10000):
+    """
+    Generates and loads the rows in one transaction
+    :param seed:
+    :param users: number of users
+    :param buckets: number of buckets of every user
+    :param activities: number of activities of every bucket
+    :param password: password of all the users, hashed once
+    :param batch_size: rows sent per statement
+    :return: dict of table name to number of rows loaded
+    """
+    postgres = db.engine.dialect.name == 'postgresql'
+    models = [User, Bucket, Activity]
+    if postgres:
+        db.session.execute('LOCK TABLE %s IN EXCLUSIVE MODE' % ', '.join(
+            db.engine.dialect.identifier_preparer.format_table(model.__table__)
+            for model in models))
+
+    first_ids = dict(categories=seed_categories())
+    for model in models:
+        first_ids[model.__tablename__] = (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+    tables = generate(seed, users, buckets, activities,
+                      hashing.generate_password_hash(password), first_ids)
+    load = copy_rows if postgres else insert_rows
+    loaded = {}
+    for model in models:
+        columns, rows = tables[model.__tablename__]
+        loaded[model.__tablename__] = load(model.__table__, columns, rows, batch_size)
+
+    if postgres:
+        # The ids were given explicitly so the sequences are moved past them. The triggers
+        # filled the search vectors and the counters while the rows were copied
+        for model in models:
+            table = db.engine.dialect.identifier_preparer.format_table(model.__table__)
+            db.session.execute("SELECT setval(pg_get_serial_sequence('%s', 'id'), "
+                               "(SELECT max(id) FROM %s))" % (table, table))
+        db.session.commit()
+    else:
+        repair_counters()
+    return loaded
@@ -25,5 +25,80 @@ def init_db():
     db.session.commit()
 
 
+@manager.command
+def repair_counters():
+    """
+    Recomputes the bucket and activity counters of the users and buckets
+    """
+    from app.models import repair_counters
+    for name, fixed in sorted(repair_counters().items()):
+        print('%s: %s rows fixed' % (name, fixed))
+
+
+@manager.option('-s', '--sizes', dest='sizes', default='100,1000,10000,100000')
+def bench_delete(sizes):
+    """
+    Times bucket and account deletion against the number of activities they own
+    """
+    from benchmarks.deletion import run
+    run([int(size) for size in sizes.split(',')])
+
+
+@manager.option('-s', '--sizes', dest='sizes', default='100,1000,10000')
+@manager.option('-l', '--levels', dest='levels', default='1,6,9')
+def bench_compress(sizes, levels):
+    """
+    Compares the bytes sent and the CPU time of the bucket listings under each encoding
+    """
+    from benchmarks.compression import run
+    run([int(size) for size in sizes.split(',')], [int(level) for level in levels.split(',')])
+
+
+@manager.option('-s', '--sizes', dest='sizes', default='100,10000')
+def bench_encode(sizes):
+    """
+    Times the encoding of bucket listings with each JSON backend
+    """
+    from benchmarks.encoding import run
+    run([int(size) for size in sizes.split(',')])
+
+
+@manager.option('-s', '--seed', dest='seed', default='0')
+@manager.option('-u', '--users', dest='users', default='100')
+@manager.option('-b', '--buckets', dest='buckets', default='20')
+@manager.option('-a', '--activities', dest='activities', default='10')
+@manager.option('-p', '--password', dest='password', default='password')
+@manager.option('--batch-size', dest='batch_size', default='10000')
+def seed(seed, users, buckets, activities, password, batch_size):
+    """
+    Generates users owning buckets and activities, the same seed giving the same rows.
+    Every user gets the number of buckets and every bucket the number of activities
+    """
+    import time
+    from benchmarks.seed import run
+    start = time.perf_counter()
+    loaded = run(seed, int(users), int(buckets), int(activities), password, int(batch_size))
+    for table in ['user', 'bucket', 'activity']:
+        print('%s: %s rows' % (table, loaded[table]))
+    print('loaded in %.1f s' % (time.perf_counter() - start))
+
+
+@manager.option('-s', '--sizes', dest='sizes', default='10,1000,100000')
+@manager.option('-n', '--requests', dest='requests', default='20')
+@manager.option('-o', '--output', dest='output', default='benchmarks/results.json')
+@manager.option('-b', '--baseline', dest='baseline', default=None)
+@manager.option('-t', '--tolerance', dest='tolerance', default='0.2')
+def bench_endpoints(sizes, requests, output, baseline, tolerance):
+    """
+    Measures the throughput and latency percentiles of every route and compares them with a
+    baseline, failing when one of them regressed
+    """
+    from benchmarks.endpoints import run
+    regressions = run([int(size) for size in sizes.split(',')], int(requests), output,
+                      baseline, float(tolerance))
+    if regressions:
+        raise SystemExit('%d routes regressed' % len(regressions))
+
+
 if __name__ == '__main__':
     manager.run()
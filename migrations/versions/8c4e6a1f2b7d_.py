@@ -0,0 +1,38 @@
+"""empty message
+
+Revision ID: 8c4e6a1f2b7d
+Revises: 5f1b2c7d9e3a
+Create Date: 2026-10-18 11:02:13.207415
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e6a1f2b7d'
+down_revision = '5f1b2c7d9e3a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_constraint('bucket_user_id_fkey', 'bucket', type_='foreignkey')
+    op.create_foreign_key('bucket_user_id_fkey', 'bucket', 'user', ['user_id'], ['id'],
+                          ondelete='CASCADE')
+    op.drop_constraint('activity_bucket_id_fkey', 'activity', type_='foreignkey')
+    op.create_foreign_key('activity_bucket_id_fkey', 'activity', 'bucket', ['bucket_id'], ['id'],
+                          ondelete='CASCADE')
+    op.drop_constraint('activity_user_id_fkey', 'activity', type_='foreignkey')
+    op.create_foreign_key('activity_user_id_fkey', 'activity', 'user', ['user_id'], ['id'],
+                          ondelete='CASCADE')
+    op.create_index(op.f('ix_activity_user_id'), 'activity', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_activity_user_id'), table_name='activity')
+    op.drop_constraint('activity_user_id_fkey', 'activity', type_='foreignkey')
+    op.create_foreign_key('activity_user_id_fkey', 'activity', 'user', ['user_id'], ['id'])
+    op.drop_constraint('activity_bucket_id_fkey', 'activity', type_='foreignkey')
+    op.create_foreign_key('activity_bucket_id_fkey', 'activity', 'bucket', ['bucket_id'], ['id'])
+    op.drop_constraint('bucket_user_id_fkey', 'bucket', type_='foreignkey')
+    op.create_foreign_key('bucket_user_id_fkey', 'bucket', 'user', ['user_id'], ['id'])
@@ -0,0 +1,29 @@
+"""empty message
+
+Revision ID: b3d9f0e5a1c8
+Revises: 8c4e6a1f2b7d
+Create Date: 2026-10-18 15:42:09.118734
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d9f0e5a1c8'
+down_revision = '8c4e6a1f2b7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Trigram indexes serving the ILIKE lookups of the autocomplete
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_bucket_bucket_name_trgm', 'bucket', ['bucket_name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'bucket_name': 'gin_trgm_ops'})
+    op.create_index('ix_activity_description_trgm', 'activity', ['description'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'description': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_activity_description_trgm', table_name='activity')
+    op.drop_index('ix_bucket_bucket_name_trgm', table_name='bucket')
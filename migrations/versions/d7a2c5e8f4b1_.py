@@ -0,0 +1,106 @@
+"""empty message
+
+Revision ID: d7a2c5e8f4b1
+Revises: b3d9f0e5a1c8
+Create Date: 2026-10-18 17:05:33.620481
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a2c5e8f4b1'
+down_revision = 'b3d9f0e5a1c8'
+branch_labels = None
+depends_on = None
+
+
+BUCKET_COUNTERS = """
+CREATE OR REPLACE FUNCTION count_buckets() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE "user" SET bucket_count = "user".bucket_count + added.total
+        FROM (SELECT user_id, count(*) AS total FROM new_rows GROUP BY user_id) AS added
+        WHERE "user".id = added.user_id;
+    ELSE
+        UPDATE "user" SET bucket_count = "user".bucket_count - removed.total
+        FROM (SELECT user_id, count(*) AS total FROM old_rows GROUP BY user_id) AS removed
+        WHERE "user".id = removed.user_id;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER bucket_counters_insert AFTER INSERT ON bucket
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE count_buckets();
+
+CREATE TRIGGER bucket_counters_delete AFTER DELETE ON bucket
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE count_buckets();
+"""
+
+ACTIVITY_COUNTERS = """
+CREATE OR REPLACE FUNCTION count_activities() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE bucket SET item_count = bucket.item_count + added.total
+        FROM (SELECT bucket_id, count(*) AS total FROM new_rows GROUP BY bucket_id) AS added
+        WHERE bucket.id = added.bucket_id;
+        UPDATE "user" SET activity_count = "user".activity_count + added.total
+        FROM (SELECT user_id, count(*) AS total FROM new_rows GROUP BY user_id) AS added
+        WHERE "user".id = added.user_id;
+    ELSE
+        UPDATE bucket SET item_count = bucket.item_count - removed.total
+        FROM (SELECT bucket_id, count(*) AS total FROM old_rows GROUP BY bucket_id) AS removed
+        WHERE bucket.id = removed.bucket_id;
+        UPDATE "user" SET activity_count = "user".activity_count - removed.total
+        FROM (SELECT user_id, count(*) AS total FROM old_rows GROUP BY user_id) AS removed
+        WHERE "user".id = removed.user_id;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER activity_counters_insert AFTER INSERT ON activity
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE count_activities();
+
+CREATE TRIGGER activity_counters_delete AFTER DELETE ON activity
+REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE count_activities();
+"""
+
+
+def upgrade():
+    version = op.get_bind().dialect.server_version_info
+    if version < (10,):
+        raise RuntimeError('The counter triggers read transition tables, which need PostgreSQL '
+                           '10 or later. This server runs %s' % '.'.join(map(str, version)))
+
+    op.add_column('user', sa.Column('bucket_count', sa.Integer(), server_default='0',
+                                    nullable=False))
+    op.add_column('user', sa.Column('activity_count', sa.Integer(), server_default='0',
+                                    nullable=False))
+    op.add_column('bucket', sa.Column('item_count', sa.Integer(), server_default='0',
+                                      nullable=False))
+    op.execute(BUCKET_COUNTERS)
+    op.execute(ACTIVITY_COUNTERS)
+    op.execute('UPDATE "user" SET bucket_count = counts.total FROM '
+               '(SELECT user_id, count(*) AS total FROM bucket GROUP BY user_id) AS counts '
+               'WHERE "user".id = counts.user_id')
+    op.execute('UPDATE "user" SET activity_count = counts.total FROM '
+               '(SELECT user_id, count(*) AS total FROM activity GROUP BY user_id) AS counts '
+               'WHERE "user".id = counts.user_id')
+    op.execute('UPDATE bucket SET item_count = counts.total FROM '
+               '(SELECT bucket_id, count(*) AS total FROM activity GROUP BY bucket_id) AS counts '
+               'WHERE bucket.id = counts.bucket_id')
+
+
+def downgrade():
+    op.execute('DROP TRIGGER activity_counters_delete ON activity')
+    op.execute('DROP TRIGGER activity_counters_insert ON activity')
+    op.execute('DROP TRIGGER bucket_counters_delete ON bucket')
+    op.execute('DROP TRIGGER bucket_counters_insert ON bucket')
+    op.execute('DROP FUNCTION count_activities()')
+    op.execute('DROP FUNCTION count_buckets()')
+    op.drop_column('bucket', 'item_count')
+    op.drop_column('user', 'activity_count')
+    op.drop_column('user', 'bucket_count')
@@ -1,12 +1,35 @@
+import datetime
+
+import gzip
+
 import json
 
+import os
+
+import tempfile
+
 import unittest
 
 from app import app, app_config
 
-from app.models import db, User, Bucket, Activity
+from app.database import SlowQueryLog, redact
+
+from app.encoding import BACKENDS, jsonify
+
+from app.models import db, User, Bucket, Activity, Category, autocomplete_hits, repair_counters
+
+from app.utils import principals
+
+from benchmarks import seed
+
+from flask import jsonify as flask_jsonify
+
+from sqlalchemy import event
+
+from tests.utils import QueryCounter, send, seed_user
 
 app.config.from_object(app_config['testing'])
+db.configure_mappers()
 
 
 class TestRegisterApi(unittest.TestCase):
@@ -106,6 +129,25 @@ class TestLoginApi(unittest.TestCase):
 
         assert response.status_code == 200
 
+    def test_login_rehashes_password_when_cost_changes(self):
+        """
+        Test that the stored hash is upgraded to the configured cost on login
+        :return: 200
+        """
+        rounds = app.config['BCRYPT_LOG_ROUNDS']
+        app.config['BCRYPT_LOG_ROUNDS'] = rounds + 1
+        try:
+            data = dict(email='test@users.com', password='test_password')
+            response = self.app.post('/api/v1/auth/login', data=json.dumps(data),
+                                     content_type='application/json')
+            assert response.status_code == 200
+            user = User.query.filter_by(email='test@users.com').first()
+            assert not user.needs_rehash()
+            assert user.check_password('test_password')
+
+        finally:
+            app.config['BCRYPT_LOG_ROUNDS'] = rounds
+
     def test_login_user_with_invalid_credentials(self):
         """
         Test login with invalid credentials.
@@ -353,6 +395,84 @@ class TestBucketListTestCases(unittest.TestCase):
         response2 = self.app.post('/api/v1/bucketlists/', data=data, content_type='application/json')
         assert response2.status_code == 409
 
+    def test_create_buckets_with_cached_category(self):
+        """
+        Test that a known category is resolved without touching the category table
+        :return: 201
+        """
+        data = dict(bucket_name='first', description='test', category='Travel')
+        response = self.app.post('/api/v1/bucketlists/', data=json.dumps(data),
+                                 content_type='application/json')
+        assert response.status_code == 201
+
+        data['bucket_name'] = 'second'
+        with QueryCounter() as counter:
+            response = self.app.post('/api/v1/bucketlists/', data=json.dumps(data),
+                                     content_type='application/json')
+        assert response.status_code == 201
+        assert json.loads(response.data.decode())['bucket']['category'] == 'Travel'
+        assert not [statement for statement in counter.statements
+                    if 'INSERT INTO category' in statement]
+        assert Category.query.filter_by(category_name='Travel').count() == 1
+
+    def test_create_buckets_in_bulk(self):
+        """
+        Test create a list of buckets at once.
+        Name collisions and invalid entries are reported without failing the others
+        :return: 201
+        """
+        data = json.dumps([dict(bucket_name='first', description='test', category='Travel'),
+                           dict(bucket_name='second', description='test'),
+                           dict(bucket_name='first', description='test'),
+                           dict(bucket_name='Test', description='test'),
+                           dict(bucket_name='third')])
+        with QueryCounter() as counter:
+            response = self.app.post('/api/v1/bucketlists/bulk', data=data,
+                                     content_type='application/json')
+        assert response.status_code == 201
+        results = json.loads(response.data.decode())['buckets']
+        assert [result['status'] for result in results] == [201, 201, 409, 409, 400]
+        assert results[0]['bucket']['category'] == 'Travel'
+        assert results[1]['bucket']['category'] == 'General'
+        assert len([statement for statement in counter.statements
+                    if statement.startswith('INSERT INTO bucket')]) == 1
+
+    def test_create_existing_buckets_in_bulk(self):
+        """
+        Test a list of buckets which all exist is a conflict
+        :return: 409, 400
+        """
+        data = json.dumps([dict(bucket_name='Test', description='test'),
+                           dict(bucket_name='Test', description='test')])
+        response = self.app.post('/api/v1/bucketlists/bulk', data=data,
+                                 content_type='application/json')
+        assert response.status_code == 409
+        results = json.loads(response.data.decode())['buckets']
+        assert [result['status'] for result in results] == [409, 409]
+
+        data = json.dumps([dict(bucket_name='Test', description='test'), dict()])
+        response = self.app.post('/api/v1/bucketlists/bulk', data=data,
+                                 content_type='application/json')
+        assert response.status_code == 400
+
+    def test_create_buckets_in_bulk_with_invalid_values(self):
+        """
+        Test entries with values which are not text or too long are rejected one by one
+        :return: 201
+        """
+        data = json.dumps([dict(bucket_name=5, description='test'),
+                           dict(bucket_name=dict(name='first'), description='test'),
+                           dict(bucket_name='first', description=['test']),
+                           dict(bucket_name='first', description='test', category=7),
+                           dict(bucket_name='x' * 71, description='test'),
+                           dict(bucket_name='first', description='x' * 101),
+                           dict(bucket_name='first', description='test')])
+        response = self.app.post('/api/v1/bucketlists/bulk', data=data,
+                                 content_type='application/json')
+        assert response.status_code == 201
+        results = json.loads(response.data.decode())['buckets']
+        assert [result['status'] for result in results] == [400] * 6 + [201]
+
     def test_view_buckets(self):
         """
         Test view buckets
@@ -361,6 +481,50 @@ class TestBucketListTestCases(unittest.TestCase):
         response = self.app.get('/api/v1/bucketlists/')
         assert response.status_code == 200
 
+    def test_view_buckets_streamed(self):
+        """
+        Test that the unpaginated listing is streamed in chunks as a valid JSON document
+        :return: 200
+        """
+        for index in range(4):
+            Bucket(bucket_name='test%s' % index, user_id=self.bucket.user_id,
+                   description='test desc').save()
+        chunk_size = app.config['STREAM_CHUNK_SIZE']
+        app.config['STREAM_CHUNK_SIZE'] = 2
+        try:
+            response = self.app.get('/api/v1/bucketlists/')
+        finally:
+            app.config['STREAM_CHUNK_SIZE'] = chunk_size
+        assert response.status_code == 200
+        assert response.is_streamed
+        buckets = json.loads(response.data.decode())['buckets']
+        assert [bucket['bucket_name'] for bucket in buckets] == ['Test', 'test0', 'test1',
+                                                                 'test2', 'test3']
+
+    def test_streamed_listings_match_jsonify(self):
+        """
+        Test that streamed listings have the bytes of jsonify, compact or pretty printed
+        :return: 200
+        """
+        for index in range(4):
+            Bucket(bucket_name='test%s' % index, user_id=self.bucket.user_id,
+                   description='test desc').save()
+        saved = dict((name, app.config[name])
+                     for name in ['STREAM_CHUNK_SIZE', 'JSONIFY_PRETTYPRINT_REGULAR'])
+        app.config['STREAM_CHUNK_SIZE'] = 2
+        try:
+            for app.config['JSONIFY_PRETTYPRINT_REGULAR'] in [False, True]:
+                for url in ['/api/v1/bucketlists/',
+                            '/api/v1/bucketlists/' + str(self.bucket.id) + '/items']:
+                    response = self.app.get(url)
+                    assert response.is_streamed
+                    data = response.data
+                    with app.test_request_context('/'):
+                        expected = jsonify(json.loads(data.decode())).get_data()
+                    assert data == expected
+        finally:
+            app.config.update(saved)
+
     def test_view_buckets_with_id(self):
         """
         TEst view buckets with bucket id
@@ -377,6 +541,31 @@ class TestBucketListTestCases(unittest.TestCase):
         response = self.app.get('/api/v1/bucketlists/?page=1&limit=1')
         assert response.status_code == 200
 
+    def test_view_buckets_with_cursor(self):
+        """
+        Test walking through the buckets with a cursor
+        :return: 200
+        """
+        Bucket(bucket_name='test1', user_id=self.bucket.user_id, description='test desc').save()
+        Bucket(bucket_name='test2', user_id=self.bucket.user_id, description='test desc').save()
+        response = self.app.get('/api/v1/bucketlists/?cursor=&limit=2')
+        assert response.status_code == 200
+        data = json.loads(response.data.decode())
+        assert [bucket['bucket_name'] for bucket in data['buckets']] == ['Test', 'test1']
+
+        response = self.app.get('/api/v1/bucketlists/?limit=2&cursor=' + data['next_cursor'])
+        data = json.loads(response.data.decode())
+        assert [bucket['bucket_name'] for bucket in data['buckets']] == ['test2']
+        assert data['next_cursor'] == ''
+
+    def test_view_buckets_with_invalid_cursor(self):
+        """
+        Test view buckets with a tampered cursor
+        :return: 400
+        """
+        response = self.app.get('/api/v1/bucketlists/?cursor=1&limit=2')
+        assert response.status_code == 400
+
     def test_view_buckets_with_invalid_limits(self):
         """
         Test view buckets with invalid limits
@@ -515,6 +704,48 @@ class TestItemTestCases(unittest.TestCase):
 
         assert response2.status_code == 409
 
+    def test_add_activities_in_bulk(self):
+        """
+        Test add a list of activities at once.
+        Duplicates and invalid entries are reported without failing the others
+        :return: 201
+        """
+        Activity(description='existing', user=self.user, bucket_id=self.bucket.id).save()
+        data = json.dumps([dict(description='first'), dict(description='second'),
+                           dict(description='first'), dict(description='existing'),
+                           dict(description='  '), 'third', dict(description=5),
+                           dict(description=['fourth'])])
+        with QueryCounter() as counter:
+            response = self.app.post('/api/v1/bucketlists/' + str(self.bucket.id) +
+                                     '/items/bulk', data=data, content_type='application/json')
+        assert response.status_code == 201
+        results = json.loads(response.data.decode())['items']
+        assert [result['status'] for result in results] == [201, 201, 409, 409] + [400] * 4
+        assert [result['item']['description'] for result in results[:2]] == ['first', 'second']
+        assert len([statement for statement in counter.statements
+                    if statement.startswith('INSERT')]) == 1
+
+    def test_add_existing_activities_in_bulk(self):
+        """
+        Test a list of activities which all exist is a conflict
+        :return: 409
+        """
+        Activity(description='existing', user=self.user, bucket_id=self.bucket.id).save()
+        response = self.app.post('/api/v1/bucketlists/' + str(self.bucket.id) + '/items/bulk',
+                                 data=json.dumps([dict(description='existing')]),
+                                 content_type='application/json')
+        assert response.status_code == 409
+
+    def test_add_activities_in_bulk_with_invalid_data(self):
+        """
+        Test add activities in bulk without a list
+        :return: 400
+        """
+        response = self.app.post('/api/v1/bucketlists/' + str(self.bucket.id) + '/items/bulk',
+                                 data=json.dumps(dict(description='first')),
+                                 content_type='application/json')
+        assert response.status_code == 400
+
     def test_add_activity_with_no_data(self):
         """
         TEst add activity with no data
@@ -533,6 +764,17 @@ class TestItemTestCases(unittest.TestCase):
                                 content_type='application/json')
         assert response.status_code == 200
 
+    def test_get_activities_streamed(self):
+        """
+        Test that the unpaginated activities listing is a valid JSON document
+        :return: 200
+        """
+        Activity(description='Test desc', user=self.user, bucket_id=self.bucket.id).save()
+        response = self.app.get('/api/v1/bucketlists/' + str(self.bucket.id) + '/items')
+        assert response.status_code == 200
+        activities = json.loads(response.data.decode())['activities']
+        assert [activity['description'] for activity in activities] == ['Test desc']
+
     def test_get_specific_activity(self):
         """
         Test for get specific activity
@@ -552,6 +794,24 @@ class TestItemTestCases(unittest.TestCase):
                                 + '/items' + '?page=1&limit=1', content_type='application/json')
         assert response.status_code == 200
 
+    def test_get_activities_with_cursor(self):
+        """
+        Test walking through the activities with a cursor
+        :return: 200
+        """
+        for description in ['first', 'second', 'third']:
+            Activity(description=description, user=self.user, bucket_id=self.bucket.id).save()
+        url = '/api/v1/bucketlists/' + str(self.bucket.id) + '/items?limit=2&cursor='
+        response = self.app.get(url)
+        assert response.status_code == 200
+        data = json.loads(response.data.decode())
+        assert [item['description'] for item in data['activities']] == ['first', 'second']
+
+        response = self.app.get(url + data['next_cursor'])
+        data = json.loads(response.data.decode())
+        assert [item['description'] for item in data['activities']] == ['third']
+        assert data['next_cursor'] == ''
+
     def test_update_activity(self):
         """
         Test update activity.
@@ -594,6 +854,53 @@ class TestItemTestCases(unittest.TestCase):
             act.id), content_type='application/json')
         assert response.status_code == 200
 
+    def test_delete_bucket_cascades_to_activities(self):
+        """
+        Test that deleting a bucket removes its activities with a single DELETE statement
+        :return: 200
+        """
+        for description in ['first', 'second', 'third']:
+            Activity(description=description, user=self.user, bucket_id=self.bucket.id).save()
+        bucket_id = self.bucket.id
+        with QueryCounter() as counter:
+            response = self.app.delete('/api/v1/bucketlists/' + str(bucket_id))
+        assert response.status_code == 200
+        assert len([statement for statement in counter.statements
+                    if statement.startswith('DELETE')]) == 1
+        assert Activity.query.filter_by(bucket_id=bucket_id).count() == 0
+
+    def test_counters(self):
+        """
+        Test the item and bucket counters follow inserts and deletes, and can be repaired
+        :return: 200
+        """
+        bucket_id = self.bucket.id
+        user_id = self.user.id
+        url = '/api/v1/bucketlists/' + str(bucket_id) + '/items'
+        self.app.post(url, data=json.dumps(dict(description='first')),
+                      content_type='application/json')
+        self.app.post(url + '/bulk', data=json.dumps([dict(description='second'),
+                                                      dict(description='third')]),
+                      content_type='application/json')
+        response = self.app.get('/api/v1/bucketlists/' + str(bucket_id))
+        assert json.loads(response.data.decode())['bucket']['item_count'] == 3
+
+        response = self.app.get(url + '?page=1&limit=2')
+        data = json.loads(response.data.decode())
+        assert data['total'] == 3
+        assert data['next_page']
+
+        item_id = Activity.query.filter_by(description='first').first().id
+        self.app.delete(url + '/' + str(item_id))
+        user = User.query.get(user_id)
+        assert (user.bucket_count, user.activity_count) == (1, 2)
+        assert Bucket.query.get(bucket_id).item_count == 2
+
+        User.query.filter_by(id=user_id).update(dict(bucket_count=7))
+        db.session.commit()
+        assert repair_counters() == dict(bucket_count=1, activity_count=0, item_count=0)
+        assert User.query.get(user_id).bucket_count == 1
+
     def test_post_activity_with_invalid_content(self):
         """
         Test add activity with invalid content
@@ -641,6 +948,192 @@ class TestSearchApi(unittest.TestCase):
         response = self.app.get('/api/v1/search?q=test')
         assert response.status_code == 200
 
+    def test_ranked_search(self):
+        """
+        Test the ranked search merges buckets and activities, best matches first
+        :return: 200
+        """
+        Bucket(bucket_name='Travel', user_id=self.user.id, description='Travel travel').save()
+        Activity(description='Travel to Mombasa', user=self.user, bucket_id=self.bucket.id).save()
+        response = self.app.get('/api/v1/search?q=travel&mode=ranked&limit=1&highlight=true')
+        assert response.status_code == 200
+        data = json.loads(response.data.decode())
+        assert [result['type'] for result in data['results']] == ['bucket']
+        assert data['results'][0]['bucket']['bucket_name'] == 'Travel'
+        assert '<b>' in data['results'][0]['snippet']
+
+        response = self.app.get('/api/v1/search?q=travel&mode=ranked&limit=1&cursor=' +
+                                data['next_cursor'])
+        data = json.loads(response.data.decode())
+        assert [result['type'] for result in data['results']] == ['activity']
+        assert data['results'][0]['activity']['description'] == 'Travel to Mombasa'
+        assert data['next_cursor'] == ''
+
+    def test_ranked_search_pages_through_tied_ranks(self):
+        """
+        Test every hit is returned once when the pages end between hits of the same rank
+        :return: 200
+        """
+        for index in range(5):
+            Activity(description='Travel plan %s' % index, user=self.user,
+                     bucket_id=self.bucket.id).save()
+        Bucket(bucket_name='Travel', user_id=self.user.id, description='Travel travel').save()
+
+        hits = []
+        cursor = ''
+        for page in range(6):
+            response = self.app.get('/api/v1/search?q=travel&mode=ranked&limit=2&cursor=' +
+                                    cursor)
+            assert response.status_code == 200
+            data = json.loads(response.data.decode())
+            hits.extend((result['type'], result['rank'],
+                         result[result['type']].get('id') or
+                         result[result['type']]['activity_id']) for result in data['results'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+
+        assert not cursor
+        assert len(hits) == len(set(hits)) == 6
+
+    def test_ranked_search_with_invalid_cursor(self):
+        """
+        Test the ranked search with a tampered cursor
+        :return: 400
+        """
+        response = self.app.get('/api/v1/search?q=travel&mode=ranked&cursor=1')
+        assert response.status_code == 400
+
+    def test_search_is_cached_until_a_write(self):
+        """
+        Test that repeated searches are served from the cache and writes invalidate it
+        :return: 200
+        """
+        response = self.app.get('/api/v1/search?q=test')
+        assert response.headers['X-Cache'] == 'MISS'
+        assert len(json.loads(response.data.decode())['activities']) == 0
+
+        with QueryCounter() as counter:
+            response = self.app.get('/api/v1/search?q=%20TEST%20')
+        assert response.headers['X-Cache'] == 'HIT'
+        assert counter.count == 0
+
+        data = json.dumps(dict(description='test activity'))
+        self.app.post('/api/v1/bucketlists/' + str(self.bucket.id) + '/items', data=data,
+                      content_type='application/json')
+        response = self.app.get('/api/v1/search?q=test')
+        assert response.headers['X-Cache'] == 'MISS'
+        assert len(json.loads(response.data.decode())['activities']) == 1
+
+    def test_conditional_get(self):
+        """
+        Test reads carry a weak ETag and matching polls get a 304 without loading rows
+        :return: 304
+        """
+        url = '/api/v1/bucketlists/' + str(self.bucket.id) + '/items'
+        response = self.app.get(url)
+        etag = response.headers['ETag']
+        assert etag.startswith('W/')
+        assert 'private' in response.headers['Cache-Control']
+        assert 'no-cache' in response.headers['Cache-Control']
+
+        with QueryCounter() as counter:
+            response = self.app.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        assert counter.count == 1
+
+        data = json.dumps(dict(description='test activity'))
+        self.app.post(url, data=data, content_type='application/json')
+        response = self.app.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+        response = self.app.get(url + '?limit=1&page=1', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+
+        response = self.app.get('/api/v1/bucketlists/')
+        etag = response.headers['ETag']
+        assert json.loads(response.data.decode())['buckets']
+        self.app.put('/api/v1/bucketlists/' + str(self.bucket.id),
+                     data=json.dumps(dict(bucket_name='Renamed', description='Test')),
+                     content_type='application/json')
+        response = self.app.get('/api/v1/bucketlists/', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert json.loads(response.data.decode())['buckets'][0]['bucket_name'] == 'Renamed'
+
+        response = self.app.get('/api/v1/bucketlists/' + str(self.bucket.id + 1),
+                                headers={'If-None-Match': etag})
+        assert response.status_code == 404
+
+    def test_conditional_get_after_an_item_is_added(self):
+        """
+        Test the ETags of the buckets change with their item counts
+        :return: 200
+        """
+        url = '/api/v1/bucketlists/' + str(self.bucket.id)
+        listing = self.app.get('/api/v1/bucketlists/')
+        bucket = self.app.get(url)
+        self.app.post(url + '/items', data=json.dumps(dict(description='test activity')),
+                      content_type='application/json')
+
+        response = self.app.get('/api/v1/bucketlists/',
+                                headers={'If-None-Match': listing.headers['ETag']})
+        assert response.status_code == 200
+        assert json.loads(response.data.decode())['buckets'][0]['item_count'] == 1
+
+        response = self.app.get(url, headers={'If-None-Match': bucket.headers['ETag']})
+        assert response.status_code == 200
+
+    def test_autocomplete(self):
+        """
+        Test the autocomplete suggests prefixes first and caps the suggestions
+        :return: 200
+        """
+        bucket_id = self.bucket.id
+        Bucket(bucket_name='Go hiking', user_id=self.user.id, description='').save()
+        Bucket(bucket_name='Hiking', user_id=self.user.id, description='').save()
+        Activity(description='Hike Mt Kenya', user=self.user, bucket_id=bucket_id).save()
+        Activity(description='100% hiking', user=self.user, bucket_id=bucket_id).save()
+        response = self.app.get('/api/v1/search/autocomplete?q=HIK')
+        assert response.status_code == 200
+        data = json.loads(response.data.decode())
+        assert [suggestion['text'] for suggestion in data['suggestions']] == \
+            ['Hiking', 'Hike Mt Kenya', 'Go hiking', '100% hiking']
+        assert data['truncated'] is False
+
+        response = self.app.get('/api/v1/search/autocomplete?q=hik&limit=1')
+        data = json.loads(response.data.decode())
+        assert [suggestion['text'] for suggestion in data['suggestions']] == ['Hiking']
+
+        response = self.app.get('/api/v1/search/autocomplete?q=0%25%20h')
+        data = json.loads(response.data.decode())
+        assert [suggestion['type'] for suggestion in data['suggestions']] == ['activity']
+
+    def test_autocomplete_keeps_the_session(self):
+        """
+        Test the lookup leaves the pending changes and the statement timeout of the session
+        """
+        timeout = db.session.execute('SHOW statement_timeout').scalar()
+        db.session.add(Bucket(bucket_name='Hiking', user_id=self.user.id, description=''))
+        hits = autocomplete_hits(self.user.id, 'hik', 10, 100)
+        assert [hit.text for hit in hits] == ['Hiking']
+        assert db.session.execute('SHOW statement_timeout').scalar() == timeout
+        db.session.commit()
+        assert Bucket.query.filter_by(bucket_name='Hiking').count() == 1
+
+    def test_autocomplete_with_short_or_invalid_parameters(self):
+        """
+        Test the autocomplete ignores fragments under three letters and rejects invalid limits
+        :return: 200, 400
+        """
+        response = self.app.get('/api/v1/search/autocomplete?q=te')
+        assert response.status_code == 200
+        assert json.loads(response.data.decode())['suggestions'] == []
+
+        response = self.app.get('/api/v1/search/autocomplete?q=test&limit=none')
+        assert response.status_code == 400
+
     def test_search_with_no_parameters(self):
         """
         Test search with no parameters given
@@ -659,5 +1152,958 @@ class TestSearchApi(unittest.TestCase):
         db.drop_all()
 
 
+class TestSerializationQueries(unittest.TestCase):
+    """
+    Test that list endpoints issue a fixed number of queries whatever the number of rows
+    """
+    def setUp(self):
+        """
+        Create initial data
+        :return: flask app
+        """
+        self.app = app.test_client()
+        db.create_all()
+        user = User(email='test@email.com', password='test_password').get_or_create()
+        category = Category(category_name='Travel').save()
+        bucket = Bucket(bucket_name='Test', user_id=user.id, description='Test',
+                        category_id=category.id).save()
+        Activity(description='Test desc', user_id=user.id, bucket_id=bucket.id).save()
+        self.user_id = user.id
+        self.bucket_id = bucket.id
+        with self.app as app_:
+            with app_.session_transaction() as sess:
+                sess['user'] = user.email
+        self.app.get('/api/v1/callback')
+
+    def add_rows(self, count):
+        """
+        Adds buckets with their own category and items
+        :param count:
+        """
+        for index in range(Category.query.count(), Category.query.count() + count):
+            category = Category(category_name='Category %s' % index).save()
+            Bucket(bucket_name='Bucket %s' % index, user_id=self.user_id, description='Test',
+                   category_id=category.id).save()
+            Activity(description='Activity %s' % index, user_id=self.user_id,
+                     bucket_id=self.bucket_id).save()
+
+    def count_queries(self, method, url):
+        """
+        Counts the queries issued by a request
+        :param method:
+        :param url:
+        :return: number of queries
+        """
+        with QueryCounter() as counter:
+            response = getattr(self.app, method)(url)
+            response.data
+        assert response.status_code == 200
+        return counter.count
+
+    def assert_constant_queries(self, method, url):
+        """
+        Asserts that the query count of a request does not grow with the number of rows
+        :param method:
+        :param url: callable returning the url of the request
+        """
+        queries = self.count_queries(method, url())
+        self.add_rows(10)
+        assert self.count_queries(method, url()) == queries
+
+    def test_list_buckets(self):
+        """
+        Test the query count of the bucket listing
+        """
+        self.assert_constant_queries('get', lambda: '/api/v1/bucketlists/')
+        self.assert_constant_queries('get', lambda: '/api/v1/bucketlists/?page=1&limit=50')
+
+    def test_list_items(self):
+        """
+        Test the query count of the items listing
+        """
+        url = '/api/v1/bucketlists/' + str(self.bucket_id) + '/items'
+        self.assert_constant_queries('get', lambda: url)
+        self.assert_constant_queries('get', lambda: url + '?page=1&limit=50')
+
+    def test_sparse_fieldsets(self):
+        """
+        Test that asking for some fields selects their columns only and skips the lookups
+        of the owner and category
+        """
+        url = '/api/v1/bucketlists/?page=1&limit=1&fields=id,bucket_name'
+        self.add_rows(1)
+        full = self.count_queries('get', '/api/v1/bucketlists/?page=1&limit=1')
+        with QueryCounter() as counter:
+            response = self.app.get(url)
+        data = json.loads(response.data.decode())
+        assert data['buckets'] == [dict(id=self.bucket_id, bucket_name='Test')]
+        assert 'fields=id%2Cbucket_name' in data['next_page']
+        assert counter.count == full - 2
+        select = [statement for statement in counter.statements
+                  if 'FROM bucket' in statement and 'count(' not in statement][0]
+        assert 'bucket.description' not in select
+        assert 'bucket.search_vector' not in select
+
+        response = self.app.get('/api/v1/bucketlists/' + str(self.bucket_id) +
+                                '/items?cursor=&limit=1&fields=description')
+        assert json.loads(response.data.decode())['activities'] == [dict(description='Test desc')]
+
+        response = self.app.get('/api/v1/search?q=test&fields=bucket_name,activity_id')
+        data = json.loads(response.data.decode())
+        assert data['buckets']
+        assert all(list(bucket) == ['bucket_name'] for bucket in data['buckets'])
+        assert all(list(activity) == ['activity_id'] for activity in data['activities'])
+
+        response = self.app.get('/api/v1/bucketlists/?fields=id,password')
+        assert response.status_code == 400
+
+    def test_search(self):
+        """
+        Test the query count of the search
+        """
+        self.assert_constant_queries('get', lambda: '/api/v1/search?q=test')
+
+    def test_delete_bucket(self):
+        """
+        Test the query count of deleting a bucket
+        """
+        def url():
+            bucket = Bucket(bucket_name='Deleted', user_id=self.user_id, description='Test').save()
+            return '/api/v1/bucketlists/' + str(bucket.id)
+
+        self.assert_constant_queries('delete', url)
+
+    def test_delete_item(self):
+        """
+        Test the query count of deleting an item
+        """
+        def url():
+            activity = Activity(description='Deleted', user_id=self.user_id,
+                                bucket_id=self.bucket_id).save()
+            return '/api/v1/bucketlists/' + str(self.bucket_id) + '/items/' + str(activity.id)
+
+        self.assert_constant_queries('delete', url)
+
+    def tearDown(self):
+        """
+        Destroy initial data
+        :return:
+        """
+        User.drop_all()
+        db.session.remove()
+        db.drop_all()
+
+
+class TestPrincipalCache(unittest.TestCase):
+    """
+    Test the caching of authenticated users
+    """
+    def setUp(self):
+        """
+        Create initial data
+        :return: flask app
+        """
+        self.app = app.test_client(use_cookies=False)
+        db.create_all()
+        principals.clear()
+        user = User(email='test@email.com', password='test_password').get_or_create()
+        self.headers = dict(token=user.generate_token().decode())
+
+    def test_authenticated_request_makes_no_auth_queries(self):
+        """
+        Test that a cached token does not query the database
+        :return: 200
+        """
+        response = self.app.get('/api/v1/callback', headers=self.headers)
+        assert response.status_code == 200
+        with QueryCounter() as counter:
+            response = self.app.get('/api/v1/callback', headers=self.headers)
+        assert response.status_code == 200
+        assert counter.count == 0
+
+    def test_invalid_token(self):
+        """
+        Test that an invalid token is rejected
+        :return: 403
+        """
+        response = self.app.get('/api/v1/callback', headers=dict(token='invalid'))
+        assert response.status_code == 403
+
+    def test_delete_account_invalidates_token(self):
+        """
+        Test that a deleted account can no longer authenticate
+        :return: 403
+        """
+        response = self.app.get('/api/v1/callback', headers=self.headers)
+        assert response.status_code == 200
+        response = self.app.delete('/api/v1/auth/delete_account', headers=self.headers,
+                                   data=json.dumps(dict(password='test_password')),
+                                   content_type='application/json')
+        assert response.status_code == 200
+        response = self.app.get('/api/v1/callback', headers=self.headers)
+        assert response.status_code == 403
+
+    def tearDown(self):
+        """
+        Destroy initial data
+        :return:
+        """
+        principals.clear()
+        User.drop_all()
+        db.session.remove()
+        db.drop_all()
+
+
+class TestCompression(unittest.TestCase):
+    """
+    Test the compression of the responses
+    """
+    def setUp(self):
+        """
+        Create initial data
+        :return: flask app
+        """
+        self.app = app.test_client()
+        db.create_all()
+        self.user = User(email='test@email.com', password='test_password').get_or_create()
+        for index in range(20):
+            Bucket(bucket_name='Bucket %s' % index, user_id=self.user.id,
+                   description='Test').save()
+        with self.app as app_:
+            with app_.session_transaction() as sess:
+                sess['user'] = self.user.email
+
+    def test_large_responses_are_compressed(self):
+        """
+        Test that paginated and streamed listings are gzipped when the client accepts it
+        :return: 200
+        """
+        for url in ['/api/v1/bucketlists/?limit=20', '/api/v1/bucketlists/']:
+            plain = self.app.get(url)
+            assert 'Content-Encoding' not in plain.headers
+            assert 'Accept-Encoding' in plain.headers['Vary']
+
+            response = self.app.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+            assert response.headers['Content-Encoding'] == 'gzip'
+            assert 'Accept-Encoding' in response.headers['Vary']
+            assert len(response.data) < len(plain.data)
+            assert json.loads(gzip.decompress(response.data).decode()) == \
+                json.loads(plain.data.decode())
+
+    def test_small_responses_are_not_compressed(self):
+        """
+        Test that bodies under the size threshold are sent as they are
+        :return: 200
+        """
+        response = self.app.get('/api/v1/bucketlists/?limit=1',
+                                headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200
+        assert 'Content-Encoding' not in response.headers
+        assert json.loads(response.data.decode())['buckets']
+
+    def tearDown(self):
+        """
+        Destroy initial data
+        :return:
+        """
+        User.drop_all()
+        db.session.remove()
+        db.drop_all()
+
+
+class TestEncoding(unittest.TestCase):
+    """
+    Test the JSON encoders of the responses
+    """
+    payloads = [
+        dict(buckets=[dict(id=1, bucket_name='Travel', description='Visit \u00e9cosse',
+                           created=datetime.date(2017, 8, 1),
+                           updated=datetime.datetime(2017, 8, 1, 10, 20, 30, 400))]),
+        dict(results=[dict(rank=0.0607927, type='bucket'), dict(rank=1e-05), dict(rank=2e16)]),
+        [1, -2, 3.5, None, True, 'tab\t', 'del\x7f', '\u2028', {'b': 1, 'a': 2}],
+        dict(error='Resource not found'),
+    ]
+
+    def test_backends_match_flask_jsonify(self):
+        """
+        Test every backend produces the bytes of flask's jsonify
+        :return:
+        """
+        pretty = app.config['JSONIFY_PRETTYPRINT_REGULAR']
+        backend = app.config['JSON_BACKEND']
+        try:
+            for app.config['JSONIFY_PRETTYPRINT_REGULAR'] in [False, True]:
+                for app.config['JSON_BACKEND'] in BACKENDS:
+                    for payload in self.payloads:
+                        with app.test_request_context('/'):
+                            assert jsonify(payload).get_data() == \
+                                flask_jsonify(payload).get_data()
+                            assert jsonify(**dict(data=payload)).get_data() == \
+                                flask_jsonify(data=payload).get_data()
+
+        finally:
+            app.config['JSONIFY_PRETTYPRINT_REGULAR'] = pretty
+            app.config['JSON_BACKEND'] = backend
+
+
+class TestStatsApi(unittest.TestCase):
+    """
+    Test the stats api
+    """
+    def setUp(self):
+        """
+        Create initial data
+        :return: flask app
+        """
+        self.app = app.test_client()
+        db.create_all()
+        user = User(email='test@email.com', password='test_password').get_or_create()
+        category = Category(category_name='Travel').save()
+        for name in ['First', 'Second']:
+            Bucket(bucket_name=name, user_id=user.id, description='Test',
+                   category_id=category.id).save()
+        bucket = Bucket(bucket_name='Third', user_id=user.id, description='Test').save()
+        Activity(description='Test desc', user_id=user.id, bucket_id=bucket.id).save()
+        self.bucket_id = bucket.id
+        with self.app as app_:
+            with app_.session_transaction() as sess:
+                sess['user'] = user.email
+
+    def test_stats(self):
+        """
+        Test the stats of a user
+        :return: 200
+        """
+        response = self.app.get('/api/v1/stats')
+        assert response.status_code == 200
+        assert response.headers['X-Cache'] == 'MISS'
+        data = json.loads(response.data.decode())
+        assert (data['buckets'], data['activities']) == (3, 1)
+        assert data['buckets_per_category'] == [dict(category='Travel', buckets=2),
+                                                dict(category=None, buckets=1)]
+        monday = datetime.date.today() - datetime.timedelta(days=datetime.date.today().weekday())
+        assert data['activities_per_week'] == [dict(week=str(monday), activities=1)]
+        assert data['recently_updated'][0]['bucket_name'] == 'Third'
+
+    def test_stats_are_cached_until_a_write(self):
+        """
+        Test that repeated calls are served from the cache and writes invalidate it
+        :return: 200
+        """
+        self.app.get('/api/v1/stats')
+        with QueryCounter() as counter:
+            response = self.app.get('/api/v1/stats')
+        assert response.headers['X-Cache'] == 'HIT'
+        assert counter.count == 0
+
+        self.app.post('/api/v1/bucketlists/' + str(self.bucket_id) + '/items',
+                      data=json.dumps(dict(description='Another')),
+                      content_type='application/json')
+        response = self.app.get('/api/v1/stats')
+        assert response.headers['X-Cache'] == 'MISS'
+        assert json.loads(response.data.decode())['activities'] == 2
+
+    def tearDown(self):
+        """
+        Destroy initial data
+        :return:
+        """
+        User.drop_all()
+        db.session.remove()
+        db.drop_all()
+
+
+class TestHealthApi(unittest.TestCase):
+    """
+    Test the health api and the connection pool
+    """
+    def setUp(self):
+        """
+        Create initial data
+        :return: flask app
+        """
+        self.app = app.test_client()
+        db.create_all()
+
+    def test_health(self):
+        """
+        Test the health check reports the pool stats
+        :return: 200
+        """
+        response = self.app.get('/api/v1/health')
+        assert response.status_code == 200
+        data = json.loads(response.data.decode())
+        assert data['database'] == 'ok'
+        assert data['pool']['size'] == app.config['SQLALCHEMY_POOL_SIZE']
+        assert data['pool']['checkouts'] > 0
+
+    def test_connections_are_configured(self):
+        """
+        Test the statement timeout is set on the connections
+        """
+        timeout = db.session.execute('SHOW statement_timeout').scalar()
+        assert timeout == '%ss' % (app.config['DATABASE_STATEMENT_TIMEOUT'] // 1000)
+
+    def test_closed_connections_are_replaced(self):
+        """
+        Test that connections closed by the server are replaced before being used
+        :return: 200
+        """
+        pooled = db.engine.connect()
+        pid = pooled.scalar('SELECT pg_backend_pid()')
+        with db.engine.connect() as connection:
+            pooled.close()
+            connection.execute('SELECT pg_terminate_backend(%s)' % pid)
+        for _ in range(app.config['SQLALCHEMY_POOL_SIZE']):
+            response = self.app.get('/api/v1/health')
+            assert response.status_code == 200
+
+    def tearDown(self):
+        """
+        Destroy initial data
+        :return:
+        """
+        db.session.remove()
+        db.drop_all()
+
+
+class TestMetricsApi(unittest.TestCase):
+    """
+    Test the metrics of the requests
+    """
+    def setUp(self):
+        """
+        Create initial data
+        :return: flask app
+        """
+        self.app = app.test_client()
+        db.create_all()
+        user = User(email='test@email.com', password='test_password').get_or_create()
+        for name in ['First', 'Second']:
+            Bucket(bucket_name=name, user_id=user.id, description='Test').save()
+        with self.app as app_:
+            with app_.session_transaction() as sess:
+                sess['user'] = user.email
+
+    def scrape(self):
+        """
+        Used to read the samples of the metrics endpoint
+        :return: dict of sample name and labels to value
+        """
+        response = self.app.get('/metrics')
+        assert response.status_code == 200
+        assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+        samples = {}
+        for line in response.data.decode().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_requests_are_recorded(self):
+        """
+        Test the status, latency and SQL statements of the requests are recorded per endpoint
+        :return: 200
+        """
+        labels = '{endpoint="bucketlists.buckets",method="GET"'
+        before = self.scrape()
+        response = self.app.get('/api/v1/bucketlists/')
+        assert len(json.loads(response.data.decode())['buckets']) == 2
+        self.app.get('/api/v1/bucketlists/?limit=1')
+        after = self.scrape()
+
+        def added(name):
+            return after.get(name, 0) - before.get(name, 0)
+
+        assert added('http_requests_total' + labels + ',status="200"}') == 2
+        assert added('http_request_duration_seconds_count' + labels + '}') == 2
+        assert added('http_request_duration_seconds_bucket' + labels + ',le="+Inf"}') == 2
+        assert added('http_request_queries_sum' + labels + '}') > 0
+        assert added('http_request_db_seconds_sum' + labels + '}') > 0
+        assert after['db_pool_size'] == app.config['SQLALCHEMY_POOL_SIZE']
+        assert 'cache_hits_total{cache="principals"}' in after
+        assert 'bcrypt_workers' in after
+
+    def test_unmatched_requests_are_recorded(self):
+        """
+        Test the requests of unknown urls are recorded under one endpoint
+        :return: 404
+        """
+        name = 'http_requests_total{endpoint="none",method="GET",status="404"}'
+        before = self.scrape().get(name, 0)
+        assert self.app.get('/api/v1/unknown').status_code == 404
+        assert self.scrape()[name] == before + 1
+
+    def tearDown(self):
+        """
+        Destroy initial data
+        :return:
+        """
+        User.drop_all()
+        db.session.remove()
+        db.drop_all()
+
+
+class TestSlowQueryLog(unittest.TestCase):
+    """
+    Test the recording of the slow statements
+    """
+    def setUp(self):
+        """
+        Create initial data
+        :return: flask app
+        """
+        self.app = app.test_client()
+        db.create_all()
+        user = User(email='test@email.com', password='test_password').get_or_create()
+        Bucket(bucket_name='First', user_id=user.id, description='Test').save()
+        self.user_id = user.id
+        with self.app as app_:
+            with app_.session_transaction() as sess:
+                sess['user'] = user.email
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.log = SlowQueryLog(0, explain_rate=1, size=50, path=self.path)
+        self.log.attach(db.engine)
+
+    def test_slow_statements_are_recorded(self):
+        """
+        Test the statements are recorded with their endpoint and a plan of the SELECTs
+        :return: 200
+        """
+        response = self.app.get('/api/v1/bucketlists/?limit=5')
+        assert response.status_code == 200
+        self.log.join()
+        entries = [entry for entry in self.log.entries() if entry['endpoint']]
+        assert entries
+        assert all(entry['endpoint'] == 'bucketlists.buckets' for entry in entries)
+        plans = [entry['plan'] for entry in entries if entry['plan']]
+        assert plans and 'actual time' in plans[0] and 'EXPLAIN failed' not in plans[0]
+
+        with open(self.path) as log_file:
+            logged = [json.loads(line) for line in log_file]
+        assert any(entry['plan'] == plans[0] for entry in logged)
+
+    def test_writes_are_not_explained(self):
+        """
+        Test that statements with side effects are recorded without being run again
+        """
+        db.session.execute('UPDATE bucket SET description = :description',
+                           dict(description='Updated'))
+        db.session.commit()
+        self.log.join()
+        updates = [entry for entry in self.log.entries()
+                   if entry['statement'].startswith('UPDATE bucket')]
+        assert len(updates) == 1
+        assert updates[0]['plan'] is None
+        assert 'description' in updates[0]['parameters']
+        assert 'Updated' not in updates[0]['parameters']
+        assert redact([dict(email='test@email.com')] * 2) == "2 x {'email': 'str'}"
+        assert redact(('test@email.com', 1)) == "['str', 'int']"
+
+    def test_ring_is_bounded(self):
+        """
+        Test that only the last statements are kept in memory
+        """
+        log = SlowQueryLog(0, size=3)
+        log.attach(db.engine)
+        try:
+            for number in range(5):
+                db.session.execute('SELECT %d' % number)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', log.before_cursor_execute)
+            event.remove(db.engine, 'after_cursor_execute', log.after_cursor_execute)
+        assert [entry['statement'] for entry in log.entries()] == ['SELECT 2', 'SELECT 3',
+                                                                   'SELECT 4']
+        assert log.recorded == 5
+        assert db.slow_queries.threshold == app.config['SLOW_QUERY_MS'] / 1000.0
+
+    def tearDown(self):
+        """
+        Destroy initial data
+        :return:
+        """
+        self.log.join()
+        event.remove(db.engine, 'before_cursor_execute', self.log.before_cursor_execute)
+        event.remove(db.engine, 'after_cursor_execute', self.log.after_cursor_execute)
+        for handler in self.log.logger.handlers:
+            handler.close()
+        os.remove(self.path)
+        User.drop_all()
+        db.session.remove()
+        db.drop_all()
+
+
+class TestQueryBudgets(unittest.TestCase):
+    """
+    Test that every endpoint stays within its budget of SQL statements for a user owning
+    many rows, so statements sent per row fail the build
+    """
+    ROWS = 100
+
+    # Statements allowed per endpoint and method, whatever the number of rows of the user
+    BUDGETS = {
+        ('auth.register-api', 'POST'): 4,
+        ('auth.login-api', 'POST'): 2,
+        ('auth.logout-api', 'POST'): 0,
+        ('auth.reset-api', 'POST'): 1,
+        ('auth.change_password-api', 'PUT'): 4,
+        ('auth.delete-account', 'DELETE'): 4,
+        ('callback.callback', 'GET'): 2,
+        ('callback.callback', 'POST'): 2,
+        ('bucketlists.buckets', 'GET'): 5,
+        ('bucketlists.buckets', 'POST'): 8,
+        ('bucketlists.bulk-buckets', 'POST'): 6,
+        ('bucketlists.bucket_specific', 'GET'): 5,
+        ('bucketlists.bucket_specific', 'PUT'): 9,
+        ('bucketlists.bucket_specific', 'DELETE'): 5,
+        ('bucketlists.bucket-items', 'GET'): 5,
+        ('bucketlists.bucket-items', 'POST'): 6,
+        ('bucketlists.bulk-items', 'POST'): 4,
+        ('bucketlists.item', 'GET'): 4,
+        ('bucketlists.item', 'PUT'): 7,
+        ('bucketlists.item', 'DELETE'): 5,
+        ('search.search_api', 'GET'): 8,
+        ('search.autocomplete_api', 'GET'): 4,
+        ('stats.stats_api', 'GET'): 6,
+        ('health.health_api', 'GET'): 1,
+        ('transfer.export_api', 'GET'): 2,
+        ('transfer.import_api', 'POST'): 5,
+    }
+
+    def setUp(self):
+        """
+        Create initial data
+        :return: flask app
+        """
+        self.app = app.test_client()
+        db.create_all()
+        user = User(email='test@email.com', password='test_password').get_or_create()
+        self.bucket_ids = seed_user(user, self.ROWS, self.ROWS)
+        self.item_id = Activity.query.filter_by(bucket_id=self.bucket_ids[0]).first().id
+        with self.app as app_:
+            with app_.session_transaction() as sess:
+                sess['user'] = user.email
+
+    def assert_budget(self, method, url, data=None, status=200):
+        """
+        Asserts that a request stays within the budget of its endpoint
+        :param method:
+        :param url:
+        :param data: JSON body
+        :param status: expected status code
+        :return: response
+        """
+        endpoint = app.url_map.bind('localhost').match(url.split('?')[0], method.upper())[0]
+        response, _ = send(self.app, method, url, data,
+                           self.BUDGETS[endpoint, method.upper()], endpoint)
+        assert response.status_code == status
+        return response
+
+    def test_every_endpoint_has_a_budget(self):
+        """
+        Test that no endpoint is left without a budget
+        """
+        endpoints = set(endpoint for endpoint, _ in self.BUDGETS)
+        assert set(app.view_functions) - endpoints == {'static', 'index', 'metrics'}
+
+    def test_bucket_budgets(self):
+        """
+        Test the budgets of the bucket endpoints
+        """
+        url = '/api/v1/bucketlists/'
+        bucket_url = url + str(self.bucket_ids[1])
+        for listing in ['', '?page=2&limit=10', '?cursor=&limit=10', '?fields=id,category']:
+            self.assert_budget('get', url + listing)
+        self.assert_budget('get', bucket_url)
+        self.assert_budget('post', url, dict(bucket_name='New', description='Test',
+                                             category='Category 1'), 201)
+        self.assert_budget('post', url, dict(bucket_name='Newer', description='Test',
+                                             category='New category'), 201)
+        self.assert_budget('post', url + 'bulk', [
+            dict(bucket_name='Bulk %s' % index, description='Test',
+                 category='Bulk category %s' % index) for index in range(self.ROWS)], 201)
+        self.assert_budget('put', bucket_url, dict(bucket_name='Renamed', description='Test',
+                                                   category='Category 2'))
+        self.assert_budget('delete', bucket_url)
+        self.assert_budget('delete', url + str(self.bucket_ids[0]))
+
+    def test_item_budgets(self):
+        """
+        Test the budgets of the item endpoints
+        """
+        url = '/api/v1/bucketlists/' + str(self.bucket_ids[0]) + '/items'
+        item_url = url + '/' + str(self.item_id)
+        for listing in ['', '?page=2&limit=10', '?cursor=&limit=10', '?fields=description']:
+            self.assert_budget('get', url + listing)
+        self.assert_budget('get', item_url)
+        self.assert_budget('post', url, dict(description='New item'), 201)
+        self.assert_budget('post', url + '/bulk', [dict(description='Bulk item %s' % index)
+                                                   for index in range(self.ROWS)], 201)
+        self.assert_budget('put', item_url, dict(description='Changed item'))
+        self.assert_budget('delete', item_url)
+
+    def test_search_budgets(self):
+        """
+        Test the budgets of the search, stats and health endpoints
+        """
+        self.assert_budget('get', '/api/v1/search?q=Seeded')
+        self.assert_budget('get', '/api/v1/search?q=Seeded&mode=ranked&highlight=true')
+        self.assert_budget('get', '/api/v1/search/autocomplete?q=seeded')
+        self.assert_budget('get', '/api/v1/stats')
+        self.assert_budget('get', '/api/v1/health')
+
+    def test_transfer_budgets(self):
+        """
+        Test the budgets of the export and import endpoints
+        """
+        response = self.assert_budget('get', '/api/v1/export')
+        lines = response.data.decode().replace('"Bucket ', '"Imported ').splitlines()
+        assert len(lines) == 2 * self.ROWS
+        self.assert_budget('post', '/api/v1/import', '\n'.join(lines), 201)
+
+    def test_auth_budgets(self):
+        """
+        Test the budgets of the auth and callback endpoints
+        """
+        self.assert_budget('get', '/api/v1/callback')
+        self.assert_budget('post', '/api/v1/callback')
+        self.assert_budget('post', '/api/v1/auth/reset_password',
+                           dict(email='unknown@email.com'), 400)
+        self.assert_budget('put', '/api/v1/auth/change_password',
+                           dict(old_password='test_password', new_password='password',
+                                confirm_password='password'))
+        self.assert_budget('post', '/api/v1/auth/logout')
+        self.assert_budget('post', '/api/v1/auth/login',
+                           dict(email='test@email.com', password='password'))
+        self.assert_budget('post', '/api/v1/auth/register',
+                           dict(email='new@email.com', password='password',
+                                confirm_password='password'))
+        self.app.post('/api/v1/auth/login', data=json.dumps(dict(email='test@email.com',
+                                                                 password='password')),
+                      content_type='application/json')
+        self.assert_budget('delete', '/api/v1/auth/delete_account', dict(password='password'))
+
+    def tearDown(self):
+        """
+        Destroy initial data
+        :return:
+        """
+        User.drop_all()
+        db.session.remove()
+        db.drop_all()
+
+
+class TestSeed(unittest.TestCase):
+    """
+    Test the generation of seeded data
+    """
+    def setUp(self):
+        """
+        Create initial data
+        :return: flask app
+        """
+        self.app = app.test_client()
+        db.create_all()
+
+    def test_rows_are_deterministic(self):
+        """
+        Test that a seed always generates the same rows
+        """
+        first_ids = dict(user=1, bucket=1, activity=1,
+                         categories=dict((name, index) for index, name in
+                                         enumerate(seed.CATEGORIES)))
+
+        def rows(value):
+            tables = seed.generate(value, 2, 3, 4, b'hash', first_ids)
+            return dict((name, list(rows)) for name, (_, rows) in tables.items())
+
+        assert rows(1) == rows(1)
+        assert rows(1) != rows(2)
+        assert [len(rows(1)[name]) for name in ['user', 'bucket', 'activity']] == [2, 6, 24]
+
+    def test_seed(self):
+        """
+        Test the seeded rows can be used like the ones created through the api
+        :return: 200
+        """
+        User(email='test@email.com', password='test_password').save()
+        loaded = seed.run(1, users=3, buckets=4, activities=5, password='password',
+                          batch_size=7)
+        assert loaded == dict(user=3, bucket=12, activity=60)
+        assert seed.run(1, users=3, buckets=4, activities=5, password='password') == loaded
+        assert db.session.query(Activity.bucket_id, Activity.description).distinct().count() \
+            == 120
+        user = User.query.filter_by(email='seed1-user2@example.com').first()
+        assert User.counters(user.id) == (4, 20)
+        assert Bucket.query.filter(Bucket.search_vector.is_(None)).count() == 0
+        assert Activity.query.filter(Activity.search_vector.is_(None)).count() == 0
+
+        response = self.app.post('/api/v1/auth/login', content_type='application/json',
+                                 data=json.dumps(dict(email=user.email, password='password')))
+        assert response.status_code == 200
+        response = self.app.post('/api/v1/bucketlists/', content_type='application/json',
+                                 data=json.dumps(dict(bucket_name='New', description='Test')))
+        assert response.status_code == 201
+
+    def tearDown(self):
+        """
+        Destroy initial data
+        :return:
+        """
+        User.drop_all()
+        db.session.remove()
+        db.drop_all()
+
+
+class TestTransferApi(unittest.TestCase):
+    """
+    Test the export and import of the buckets and activities of a user
+    """
+    def setUp(self):
+        """
+        Create initial data
+        :return: flask app
+        """
+        self.app = app.test_client()
+        db.create_all()
+        user = User(email='test@email.com', password='test_password').get_or_create()
+        seed_user(user, 5, 7, categories=2)
+        self.other = User(email='other@email.com', password='test_password').save()
+        self.batch_size = app.config['IMPORT_BATCH_SIZE']
+        self.login('test@email.com')
+
+    def login(self, email):
+        """
+        Used to log a user in
+        :param email:
+        """
+        with self.app as app_:
+            with app_.session_transaction() as sess:
+                sess['user'] = email
+
+    def export(self):
+        """
+        Used to export the data of the user logged in
+        :return: list of the exported objects
+        """
+        response = self.app.get('/api/v1/export')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        return [json.loads(line) for line in response.data.decode().splitlines()]
+
+    def import_lines(self, lines):
+        """
+        Used to import objects for the user logged in
+        :param lines: list of objects or raw lines
+        :return: response
+        """
+        body = '\n'.join(line if isinstance(line, str) else json.dumps(line) for line in lines)
+        return self.app.post('/api/v1/import', data=body, content_type='application/x-ndjson')
+
+    def test_export(self):
+        """
+        Test every bucket is exported followed by its activities
+        :return: 200
+        """
+        lines = self.export()
+        assert [line['type'] for line in lines] == ['bucket'] + ['activity'] * 7 + ['bucket'] * 4
+        assert all(line['bucket_id'] == lines[0]['id'] for line in lines[1:8])
+        assert lines[0]['category'] == 'Category 0'
+        assert lines[0]['created'] and lines[1]['description'] == 'Seeded item 0'
+
+    def test_export_then_import(self):
+        """
+        Test that an export imported by another user gives them the same buckets and
+        activities, batches being split in the middle of a bucket
+        :return: 201
+        """
+        lines = self.export()
+        app.config['IMPORT_BATCH_SIZE'] = 3
+        self.login('other@email.com')
+        response = self.import_lines(lines)
+        assert response.status_code == 201
+        assert json.loads(response.data.decode())['buckets'] == 5
+        assert json.loads(response.data.decode())['activities'] == 7
+        assert User.counters(self.other.id) == (5, 7)
+
+        def strip(exported):
+            return [dict((key, value) for key, value in line.items()
+                         if key not in ('id', 'bucket_id')) for line in exported]
+        assert strip(self.export()) == strip(lines)
+
+    def test_import_is_atomic(self):
+        """
+        Test that nothing is created when a line is invalid, even after batches were loaded
+        :return: 400, 409
+        """
+        lines = self.export()
+        app.config['IMPORT_BATCH_SIZE'] = 2
+        self.login('other@email.com')
+        response = self.import_lines(lines[:10] + ['{"type": "bucket"'])
+        assert response.status_code == 400
+        assert json.loads(response.data.decode())['error'] == 'Line 11: Invalid JSON'
+        assert User.counters(self.other.id) == (0, 0)
+
+        response = self.import_lines(lines[1:])
+        assert response.status_code == 400
+        assert 'must follow' in json.loads(response.data.decode())['error']
+
+        response = self.import_lines(lines[:3] + [lines[2]])
+        assert response.status_code == 409
+        assert User.counters(self.other.id) == (0, 0)
+
+        self.login('test@email.com')
+        response = self.import_lines(lines)
+        assert response.status_code == 409
+        assert json.loads(response.data.decode())['error'] == 'Line 1: Bucket name exists'
+
+        assert self.import_lines([]).status_code == 400
+
+    def test_import_buckets_without_ids(self):
+        """
+        Test buckets without ids can be imported over several batches
+        :return: 201
+        """
+        app.config['IMPORT_BATCH_SIZE'] = 2
+        self.login('other@email.com')
+        response = self.import_lines([dict(type='bucket', bucket_name='Bucket %s' % index,
+                                           description='Imported') for index in range(5)])
+        assert response.status_code == 201
+        assert User.counters(self.other.id) == (5, 0)
+
+    def test_import_with_invalid_values(self):
+        """
+        Test repeated bucket ids and values which are not text are reported with their line
+        :return: 400
+        """
+        lines = self.export()
+        self.login('other@email.com')
+        repeated = dict(lines[8], id=lines[0]['id'])
+        response = self.import_lines(lines[:8] + [repeated])
+        assert response.status_code == 400
+        assert json.loads(response.data.decode())['error'] == \
+            'Line 9: The id of the bucket is repeated'
+
+        for key in ['bucket_name', 'description', 'category']:
+            response = self.import_lines([lines[8], dict(lines[9], **{key: 5})])
+            assert response.status_code == 400
+            assert json.loads(response.data.decode())['error'].startswith('Line 2: ')
+
+        response = self.import_lines(lines[:1] + [dict(lines[1], description=5)])
+        assert response.status_code == 400
+        assert User.counters(self.other.id) == (0, 0)
+
+    def tearDown(self):
+        """
+        Destroy initial data
+        :return:
+        """
+        app.config['IMPORT_BATCH_SIZE'] = self.batch_size
+        User.drop_all()
+        db.session.remove()
+        db.drop_all()
+
+
 if __name__ == '__main__':
     unittest.main()
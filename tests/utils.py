@@ -0,0 +1,83 @@
+import json
+
+from app.models import db, Activity, Bucket, Category
+
+from sqlalchemy import event
+
+
+class QueryCounter(object):
+    """
+    Context manager used to count the SQL statements sent to the database.
+    When a budget is given, sending more statements than it fails the test
+    """
+    def __init__(self, budget=None, name=''):
+        """
+        :param budget: maximum number of statements, None for no limit
+        :param name: what is counted, shown when the budget is exceeded
+        """
+        self.budget = budget
+        self.name = name
+        self.count = 0
+        self.statements = []
+
+    def increment(self, conn, cursor, statement, *args):
+        self.count += 1
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self.increment)
+        return self
+
+    def __exit__(self, exc_type, *args):
+        event.remove(db.engine, 'before_cursor_execute', self.increment)
+        if exc_type is None and self.budget is not None:
+            assert self.count <= self.budget, '%s sent %d statements, its budget is %d:\n%s' % (
+                self.name, self.count, self.budget, '\n\n'.join(self.statements))
+
+
+def send(client, method, url, data=None, budget=None, name=None):
+    """
+    Used to send a request and count its statements, streamed bodies being read to the end
+    :param client: test client
+    :param method: get, post, put or delete
+    :param url:
+    :param data: body, sent as JSON unless it is already encoded as NDJSON
+    :param budget: maximum number of statements
+    :param name: what is counted, defaults to the method and url
+    :return: (response, counter)
+    """
+    if data is None:
+        kwargs = {}
+    elif isinstance(data, (bytes, str)):
+        kwargs = dict(data=data, content_type='application/x-ndjson')
+    else:
+        kwargs = dict(data=json.dumps(data), content_type='application/json')
+    with QueryCounter(budget, name or '%s %s' % (method.upper(), url)) as counter:
+        response = getattr(client, method)(url, **kwargs)
+        response.data
+    return response, counter
+
+
+def seed_user(user, buckets, items, categories=10):
+    """
+    Used to give a user many rows in a few statements: buckets spread over categories,
+    the first bucket holding all the items
+    :param user:
+    :param buckets: number of buckets
+    :param items: number of items of the first bucket
+    :param categories: number of categories the buckets are spread over
+    :return: list of the bucket ids
+    """
+    category_ids = [Category(category_name='Category %s' % index).save().id
+                    for index in range(categories)]
+    db.session.execute(Bucket.__table__.insert(), [
+        dict(bucket_name='Bucket %s' % index, description='Seeded bucket %s' % index,
+             user_id=user.id, category_id=category_ids[index % categories])
+        for index in range(buckets)])
+    bucket_ids = [row[0] for row in db.session.query(Bucket.id).filter_by(user_id=user.id)
+                  .order_by(Bucket.id)]
+    db.session.execute(Activity.__table__.insert(), [
+        dict(description='Seeded item %s' % index, user_id=user.id, bucket_id=bucket_ids[0])
+        for index in range(items)])
+    db.session.commit()
+    return bucket_ids